@@ -20,7 +20,8 @@ REQUIRED = ["asyncpg", "fastapi", "uvicorn"]
 
 # What packages are optional?
 EXTRAS = {
-    # 'fancy feature': ['some_pakcage'],
+    # Arrow IPC and Parquet exports of track results
+    "arrow": ["pyarrow"],
 }
 
 TEST_REQUIRES = [["pytest", "requests"]]
@@ -1,7 +1,6 @@
-import os
 import logging
-
-import asyncpg
+import math
+import os
 
 from fastapi import FastAPI
 from fastapi.encoders import jsonable_encoder
@@ -11,10 +10,15 @@ from starlette.requests import Request
 from starlette.responses import JSONResponse
 from starlette.status import HTTP_422_UNPROCESSABLE_ENTITY
 
-from odm2_postgres_api.aquamonitor.aquamonitor_client import AquamonitorAPIError
+from odm2_postgres_api.aquamonitor.aquamonitor_client import (
+    AquamonitorAPIError,
+    AquamonitorUnavailableError,
+    aquamonitor_client_manager,
+)
+from odm2_postgres_api.aquamonitor.aquamonitor_outbox import outbox_worker
 from odm2_postgres_api.metadata_init.populate_metadata import populate_metadata
 from odm2_postgres_api.routes.fish_rfid import fish_rfid_routes
-from odm2_postgres_api.utils.api_pool_manager import api_pool_manager
+from odm2_postgres_api.utils.api_pool_manager import api_pool_manager, read_only_pool_manager
 
 from odm2_postgres_api.routes import (
     begroing_routes,
@@ -51,37 +55,35 @@ async def aquamonitor_api_exception_handler(request: Request, exc: AquamonitorAP
     )
 
 
+@app.exception_handler(AquamonitorUnavailableError)
+async def aquamonitor_unavailable_exception_handler(
+    request: Request, exc: AquamonitorUnavailableError
+) -> JSONResponse:
+    # the circuit breaker is open, the request was not sent to aquamonitor
+    logging.warning(exc, extra={"method": exc.method, "url": exc.url, "retry_after": exc.retry_after})
+    return JSONResponse(
+        status_code=503,
+        content={"message": "Aquamonitor API is unavailable", "detail": exc.message},
+        headers={"Retry-After": str(math.ceil(exc.retry_after))},
+    )
+
+
 @app.on_event("startup")
 async def startup_event():
     setup_logging()
-
-    # TODO: This can run before the database is ready, it should actually be lazily tried on the first connection
-    # Get DB connection from environment
-    db_host = os.environ["TIMESCALE_ODM2_SERVICE_HOST"]
-    db_port = os.environ["TIMESCALE_ODM2_SERVICE_PORT"]
-    db_mighty_user = os.environ["ODM2_DB_USER"]
-    db_mighty_pwd = os.environ["ODM2_DB_PASSWORD"]
-    db_name = os.environ["ODM2_DB"]
-
-    logging.info("Creating connection pool")
-    api_pool_manager.pool = await asyncpg.create_pool(
-        user=db_mighty_user,
-        password=db_mighty_pwd,
-        server_settings={"search_path": "odm2,public"},
-        host=db_host,
-        port=db_port,
-        database=db_name,
-    )
-    logging.info("Successfully created connection pool")
-
-    await populate_metadata(api_pool_manager.pool)
+    # the pool is created lazily by the first request, metadata is populated before it is handed out
+    api_pool_manager.on_create = populate_metadata
+    if os.environ.get("WRITE_TO_AQUAMONITOR", "false").lower() == "true":
+        aquamonitor_client_manager.get_client()
+        outbox_worker.start()
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    logging.info("Closing connection pool")
-    await api_pool_manager.pool.close()
-    logging.info("Successfully closed connection pool")
+    await outbox_worker.stop()
+    await aquamonitor_client_manager.close()
+    await read_only_pool_manager.close()
+    await api_pool_manager.close()
 
 
 app.include_router(shared_routes.router)
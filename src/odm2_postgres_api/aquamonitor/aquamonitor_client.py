@@ -1,12 +1,18 @@
 import asyncio
 import logging
 import os
+import random
+import re
+import time
 from datetime import datetime
-from typing import List, Dict
+from typing import Awaitable, List, Dict, Optional, Tuple
 
+import httpx
 from fastapi import HTTPException
 from httpx import AsyncClient
 from nivacloud_logging.log_utils import LogContext, generate_trace_id
+from prometheus_client import Counter, Gauge, Histogram
+from pydantic import BaseModel
 
 from odm2_postgres_api.aquamonitor.aquamonitor_api_types import (
     BegroingSampleCargo,
@@ -18,11 +24,23 @@ from odm2_postgres_api.aquamonitor.aquamonitor_api_types import (
     TaxonomyCodeCargo,
     ProjectCargo,
 )
+from odm2_postgres_api.aquamonitor.aquamonitor_identifiers import find_aquamonitor_station, save_aquamonitor_station
 from odm2_postgres_api.aquamonitor.aquamonitor_mapping import METHODS_NIVABASE_MAP
 from odm2_postgres_api.schemas.schemas import (
     Directive,
     BegroingObservations,
     BegroingObservationValues,
+    SamplingFeatures,
+)
+from odm2_postgres_api.utils.api_pool_manager import ApiPoolManager, api_pool_manager
+from odm2_postgres_api.utils.ttl_cache import SingleFlightTTLCache
+
+# Reference data from aquamonitor (methods, taxonomy and stations) that every observation needs, but which
+# rarely changes
+aquamonitor_cache = SingleFlightTTLCache(
+    name="aquamonitor",
+    maxsize=int(os.environ.get("AQUAMONITOR_CACHE_SIZE", 4096)),
+    ttl=float(os.environ.get("AQUAMONITOR_CACHE_TTL_SECONDS", 3600)),
 )
 
 
@@ -114,13 +132,42 @@ async def methods_for_project_station(client: AsyncClient, project_id: int, stat
     return [MethodCargo(**m) for m in res.json()]
 
 
+async def get_method_by_id_cached(client: AsyncClient, method_id: int) -> MethodCargo:
+    return await aquamonitor_cache.get_or_load(("method", method_id), lambda: get_method_by_id(client, method_id))
+
+
+async def get_taxonomy_cached(client: AsyncClient, domain_name: str, code: str) -> TaxonomyCodeCargo:
+    return await aquamonitor_cache.get_or_load(
+        ("taxonomy", domain_name, code), lambda: get_taxonomy(client, domain_name, code)
+    )
+
+
+async def get_project_stations_cached(client: AsyncClient, project_name: str, station_code: str) -> StationCargo:
+    return await aquamonitor_cache.get_or_load(
+        ("station", project_name, station_code), lambda: get_project_stations(client, project_name, station_code)
+    )
+
+
+def sample_cache_key(station: StationCargo, sample_date: datetime) -> Tuple:
+    return "sample", station.Id, sample_date
+
+
 async def get_or_create_begroing_sample(
     client, station: StationCargo, result: BegroingObservations
-) -> BegroingSampleCargo:
+) -> Tuple[BegroingSampleCargo, bool]:
+    """
+    The sample of the station and date, and whether it was created by this call. Samples are cached once found or
+    created, so resubmissions for the same station and date do not look the sample up again.
+    """
+    cached = aquamonitor_cache.get(sample_cache_key(station, result.date))
+    if cached is not None:
+        return cached, False
+
     samples = await get_begroing_samples(client, station.Id, result.date)
     if len(samples) == 1:
         logging.info("Found sample in aquamonitor", extra={"sample_id": samples[0].Id})
-        return samples[0]
+        aquamonitor_cache.set(sample_cache_key(station, result.date), samples[0])
+        return samples[0], False
 
     if len(samples) > 1:
         # TODO: what do we do if we get more than 1 sample back? throwing exception for now
@@ -131,8 +178,9 @@ async def get_or_create_begroing_sample(
 
     body = BegroingSampleCargoCreate(Station=station, SampleDate=result.date)
     sample = await post_begroing_sample(client, body)
+    aquamonitor_cache.set(sample_cache_key(station, result.date), sample)
 
-    return sample
+    return sample, True
 
 
 async def update_begroing_observation(
@@ -145,21 +193,20 @@ async def update_begroing_observation(
         headers={"Content-Type": "application/json"},
     )
     handle_aquamonitor_error(res)
-    return res.json()
+    return BegroingObservationCargo(**res.json())
 
 
 async def delete_begroing_observation(client: AsyncClient, observation: BegroingObservationCargo):
     sample_id = observation.Sample.Id
     res = await client.delete(f"/begroing/samples/{sample_id}/observations/{observation.Id}")
     handle_aquamonitor_error(res)
-    return res.json()
 
 
 async def post_begroing_observation(
     client: AsyncClient, sample: BegroingSampleCargo, obs: BegroingObservationValues
 ) -> BegroingObservationCargo:
-    method = await get_method_by_id(client, METHODS_NIVABASE_MAP[obs.method.methodname])
-    taxon = await get_taxonomy(client, "Begroingsalger", obs.taxon.taxonomicclassifiername)
+    method = await get_method_by_id_cached(client, METHODS_NIVABASE_MAP[obs.method.methodname])
+    taxon = await get_taxonomy_cached(client, "Begroingsalger", obs.taxon.taxonomicclassifiername)
 
     body = BegroingObservationCargoCreate(Sample=sample, Method=method, Taxonomy=taxon, Value=obs.value)
     res = await client.post(
@@ -173,19 +220,105 @@ async def post_begroing_observation(
     return result
 
 
-async def store_begroing_results(result: BegroingObservations) -> Dict:
-    base_url = "https://test-aquamonitor.niva.no/AquaServices/api"
-    username = os.environ["AQUAMONITOR_USER"]
-    password = os.environ["AQUAMONITOR_PASSWORD"]
-    async with AsyncClient(base_url=base_url, auth=(username, password), event_hooks=request_hooks) as client:
-        return await post_begroing_observations(client=client, result=result)
-
-
-async def post_begroing_observations(client: AsyncClient, result: BegroingObservations) -> Dict:
-    station_code = result.station.samplingfeaturecode
-    station: StationCargo = await get_project_stations(client, result.project.directivedescription, station_code)
+async def resolve_station(
+    client: AsyncClient, pool_manager: ApiPoolManager, project: Directive, station: SamplingFeatures
+) -> StationCargo:
+    """
+    The Aquamonitor station of the sampling feature in the project, from ODM2 if it has been resolved before and from
+    Aquamonitor otherwise, storing it for the next time
+    """
+    async with pool_manager.acquire() as conn:
+        station_cargo = await find_aquamonitor_station(conn, project.directiveid, station.samplingfeatureid)
+    if station_cargo is not None:
+        return station_cargo
+
+    # no connection is held while waiting for aquamonitor
+    station_cargo = await get_project_stations_cached(
+        client, project.directivedescription, station.samplingfeaturecode
+    )
+    async with pool_manager.acquire() as conn:
+        async with conn.transaction():
+            await save_aquamonitor_station(conn, project.directiveid, station.samplingfeatureid, station_cargo)
+    logging.info(
+        "Stored aquamonitor station",
+        extra={"station_id": station_cargo.Id, "project_id": station_cargo.ProjectId},
+    )
+    return station_cargo
+
+
+async def store_begroing_results(
+    result: BegroingObservations, sync: bool = True, pool_manager: ApiPoolManager = api_pool_manager
+) -> Dict:
+    client = aquamonitor_client_manager.get_client()
+    station = await resolve_station(client, pool_manager, result.project, result.station)
+    return await post_begroing_observations(client=client, result=result, sync=sync, station=station)
+
+
+def observation_key(observation: BegroingObservationValues) -> Tuple[int, str]:
+    """Identifies an observation within a sample by Aquamonitor method id and taxonomy code"""
+    return METHODS_NIVABASE_MAP[observation.method.methodname], observation.taxon.taxonomicclassifiername
+
+
+class BegroingObservationDiff(BaseModel):
+    add: List[BegroingObservationValues] = []
+    update: List[BegroingObservationCargo] = []
+    delete: List[BegroingObservationCargo] = []
+    unchanged: int = 0
+
+
+def diff_begroing_observations(
+    existing: List[BegroingObservationCargo], observations: List[BegroingObservationValues]
+) -> BegroingObservationDiff:
+    """
+    What has to change for the sample to hold exactly the submitted observations. Observations are matched by method
+    and taxon, duplicates of a match are deleted. Existing observations with methods this api does not write are left
+    alone.
+    """
+    existing_by_key: Dict[Tuple[int, str], List[BegroingObservationCargo]] = {}
+    for e in existing:
+        # without a code the taxon can not be matched, such observations are neither updated nor deleted
+        if e.Taxonomy.Code is None:
+            continue
+        existing_by_key.setdefault((e.Method.Id, e.Taxonomy.Code), []).append(e)
+
+    diff = BegroingObservationDiff()
+    for observation in observations:
+        matches = existing_by_key.pop(observation_key(observation), [])
+        if not matches:
+            diff.add.append(observation)
+        elif matches[0].Value != observation.value:
+            diff.update.append(matches[0].copy(update={"Value": observation.value}))
+        else:
+            diff.unchanged += 1
+        diff.delete.extend(matches[1:])
+
+    synced_methods = set(METHODS_NIVABASE_MAP.values())
+    for (method_id, _), matches in existing_by_key.items():
+        if method_id in synced_methods:
+            diff.delete.extend(matches)
+    return diff
+
+
+async def post_begroing_observations(
+    client: AsyncClient,
+    result: BegroingObservations,
+    sync: bool = False,
+    station: Optional[StationCargo] = None,
+) -> Dict:
+    """
+    Posts the observations to the sample of the station and date, creating the sample if needed. With sync=True, the
+    observations the sample already has are fetched once and only the difference is sent: new observations are
+    posted, changed values updated and observations missing from the submission deleted. Resubmitting or retrying a
+    partly completed call is then safe, and an unchanged resubmission of a cached sample costs a single request.
+
+    The station is looked up in Aquamonitor when not given.
+    """
+    if station is None:
+        station = await get_project_stations_cached(
+            client, result.project.directivedescription, result.station.samplingfeaturecode
+        )
 
-    sample = await get_or_create_begroing_sample(client, station, result)
+    sample, created = await get_or_create_begroing_sample(client, station, result)
     with LogContext(
         sample_id=sample.Id,
         station_code=station.Code,
@@ -193,16 +326,43 @@ async def post_begroing_observations(client: AsyncClient, result: BegroingObserv
         project_name=result.project.directivedescription,
         date=result.date,
     ):
-        created_observations = await asyncio.gather(
-            *[post_begroing_observation(client, sample, o) for o in result.observations]
+        if sync and not created:
+            try:
+                existing = await get_begroing_observations(client, sample.Id)
+            except AquamonitorAPIError as e:
+                if e.status_code == 404:
+                    # the cached sample was deleted in aquamonitor, it is looked up again on the next attempt
+                    sample_key = sample_cache_key(station, result.date)
+                    aquamonitor_cache.invalidate(lambda key: key == sample_key)
+                raise
+            diff = diff_begroing_observations(existing, result.observations)
+        else:
+            diff = BegroingObservationDiff(add=result.observations)
+
+        # bounds the requests one submission has in flight, so it does not take all connections of the shared client
+        slots = asyncio.Semaphore(int(os.environ.get("AQUAMONITOR_MAX_CONCURRENT_POSTS", 5)))
+
+        async def bounded(request: Awaitable):
+            async with slots:
+                return await request
+
+        created_observations, updated_observations, _ = await asyncio.gather(
+            asyncio.gather(*[bounded(post_begroing_observation(client, sample, o)) for o in diff.add]),
+            asyncio.gather(*[bounded(update_begroing_observation(client, o)) for o in diff.update]),
+            asyncio.gather(*[bounded(delete_begroing_observation(client, o)) for o in diff.delete]),
         )
-        observation_ids = [o.Id for o in created_observations]
+        counts = {
+            "added": len(diff.add),
+            "updated": len(diff.update),
+            "deleted": len(diff.delete),
+            "unchanged": diff.unchanged,
+        }
 
         logging.info(
             "Successfully stored observations",
-            extra={"observation_ids": observation_ids},
+            extra={"observation_ids": [o.Id for o in created_observations + updated_observations], **counts},
         )
-        return {"sample": sample, "observations": created_observations}
+        return {"sample": sample, "observations": created_observations + updated_observations, **counts}
 
 
 # TODO: move this to nivacloud-logging
@@ -238,11 +398,213 @@ async def response_logger(response):
     )
 
 
+AQUAMONITOR_REQUEST_SECONDS = Histogram(
+    "odm2_aquamonitor_request_seconds", "Duration of requests to Aquamonitor", ["method", "endpoint", "status"]
+)
+
+
+def endpoint_label(url: httpx.URL) -> str:
+    """The path with ids replaced, so that all requests to an endpoint share one histogram"""
+    return re.sub(r"/\d+", "/{id}", url.path)
+
+
+async def request_metrics(response):
+    request = response.request
+    AQUAMONITOR_REQUEST_SECONDS.labels(
+        method=request.method, endpoint=endpoint_label(request.url), status=response.status_code
+    ).observe(response.elapsed.total_seconds())
+
+
 request_hooks = {
     "request": [traced_request, request_logger],
-    "response": [response_logger],
+    "response": [response_logger, request_metrics],
 }
 
+AQUAMONITOR_RETRIES = Counter(
+    "odm2_aquamonitor_retries_total", "Requests to Aquamonitor that were retried", ["method", "endpoint", "reason"]
+)
+AQUAMONITOR_CIRCUIT_OPEN = Gauge("odm2_aquamonitor_circuit_open", "1 while requests to Aquamonitor fail fast")
+AQUAMONITOR_CIRCUIT_OPEN_SECONDS = Counter(
+    "odm2_aquamonitor_circuit_open_seconds_total", "Time requests to Aquamonitor failed fast, counted on recovery"
+)
+AQUAMONITOR_CIRCUIT_REJECTED = Counter(
+    "odm2_aquamonitor_circuit_rejected_total", "Requests to Aquamonitor rejected while the circuit was open"
+)
+
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+# statuses where the request was not processed and any request can be sent again
+RETRY_ANY_STATUSES = {429}
+# statuses where a POST may have been processed anyway, so only requests that do no harm when repeated are retried
+RETRY_IDEMPOTENT_STATUSES = {500, 502, 503, 504}
+# errors raised before the request reached Aquamonitor
+NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive server errors or transport errors, and fails requests right away while
+    open. After reset_seconds the circuit is half open and lets a single probe request through, the others keep
+    failing fast. A successful probe closes the circuit, a failed one opens it for another reset_seconds.
+    """
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probe_in_flight = False
+
+    def allow_request(self) -> bool:
+        if self.opened_at is None:
+            return True
+        if self.retry_after() > 0 or self.probe_in_flight:
+            return False
+        self.probe_in_flight = True
+        return True
+
+    def retry_after(self) -> float:
+        """Seconds until requests are let through again"""
+        if self.opened_at is None:
+            return 0
+        return max(self.reset_seconds - (time.monotonic() - self.opened_at), 0)
+
+    def release_probe(self):
+        """Lets another request probe, when the probe ended without an outcome, e.g. because it was cancelled"""
+        self.probe_in_flight = False
+
+    def record_success(self):
+        self.failures = 0
+        self.probe_in_flight = False
+        if self.opened_at is not None:
+            AQUAMONITOR_CIRCUIT_OPEN_SECONDS.inc(time.monotonic() - self.opened_at)
+            AQUAMONITOR_CIRCUIT_OPEN.set(0)
+            logging.info("Aquamonitor circuit closed")
+            self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        self.probe_in_flight = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                logging.warning("Aquamonitor circuit opened", extra={"failures": self.failures})
+            else:
+                AQUAMONITOR_CIRCUIT_OPEN_SECONDS.inc(time.monotonic() - self.opened_at)
+            self.opened_at = time.monotonic()
+            AQUAMONITOR_CIRCUIT_OPEN.set(1)
+
+
+def should_retry_error(request: httpx.Request, error: httpx.TransportError) -> bool:
+    return request.method in IDEMPOTENT_METHODS or isinstance(error, NOT_SENT_ERRORS)
+
+
+def should_retry_response(request: httpx.Request, response: httpx.Response) -> bool:
+    return response.status_code in RETRY_ANY_STATUSES or (
+        request.method in IDEMPOTENT_METHODS and response.status_code in RETRY_IDEMPOTENT_STATUSES
+    )
+
+
+def retry_delay(attempt: int, backoff: float, max_backoff: float) -> float:
+    """Exponential backoff with full jitter, so requests failing together do not retry together"""
+    return random.uniform(0, min(backoff * 2 ** (attempt - 1), max_backoff))
+
+
+class ResilientAsyncClient(AsyncClient):
+    """
+    AsyncClient that retries requests failing with transient errors, with jittered exponential backoff, and fails fast
+    through a circuit breaker while Aquamonitor is down. Event hooks run for every attempt, so each one is logged and
+    measured.
+    """
+
+    def __init__(self, *args, retries: int, backoff: float, max_backoff: float, breaker: CircuitBreaker, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker = breaker
+
+    async def send(self, request: httpx.Request, **kwargs) -> httpx.Response:
+        attempt = 0
+        while True:
+            if not self.breaker.allow_request():
+                AQUAMONITOR_CIRCUIT_REJECTED.inc()
+                raise AquamonitorUnavailableError(
+                    message="Aquamonitor is unavailable, try again later",
+                    url=str(request.url),
+                    method=request.method,
+                    retry_after=self.breaker.retry_after(),
+                )
+
+            attempt += 1
+            try:
+                response = await super().send(request, **kwargs)
+            except httpx.TransportError as e:
+                self.breaker.record_failure()
+                if attempt > self.retries or not should_retry_error(request, e):
+                    raise
+                reason = type(e).__name__
+            except BaseException:
+                self.breaker.release_probe()
+                raise
+            else:
+                if response.status_code >= 500:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+                if attempt > self.retries or not should_retry_response(request, response):
+                    return response
+                reason = str(response.status_code)
+
+            AQUAMONITOR_RETRIES.labels(
+                method=request.method, endpoint=endpoint_label(request.url), reason=reason
+            ).inc()
+            delay = retry_delay(attempt, self.backoff, self.max_backoff)
+            logging.warning(
+                "Retrying request to aquamonitor",
+                extra={"url": request.url, "method": request.method, "reason": reason, "retry_in_seconds": delay},
+            )
+            await asyncio.sleep(delay)
+
+
+class AquamonitorClientManager:
+    """
+    Holds one AsyncClient for the lifetime of the app, so connections to Aquamonitor are kept alive and reused instead
+    of doing a TLS handshake for every submission. The app opens it on startup and closes it on shutdown, get_client
+    creates it on first use otherwise.
+    """
+
+    def __init__(self):
+        self.client: Optional[AsyncClient] = None
+
+    def get_client(self) -> AsyncClient:
+        if self.client is None:
+            max_connections = int(os.environ.get("AQUAMONITOR_MAX_CONNECTIONS", 10))
+            timeout = float(os.environ.get("AQUAMONITOR_TIMEOUT_SECONDS", 30))
+            self.client = ResilientAsyncClient(
+                base_url=os.environ.get("AQUAMONITOR_URL", "https://test-aquamonitor.niva.no/AquaServices/api"),
+                auth=(os.environ["AQUAMONITOR_USER"], os.environ["AQUAMONITOR_PASSWORD"]),
+                event_hooks=request_hooks,
+                limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+                timeout=httpx.Timeout(
+                    timeout, connect=float(os.environ.get("AQUAMONITOR_CONNECT_TIMEOUT_SECONDS", 5))
+                ),
+                retries=int(os.environ.get("AQUAMONITOR_RETRIES", 3)),
+                backoff=float(os.environ.get("AQUAMONITOR_RETRY_BACKOFF_SECONDS", 0.5)),
+                max_backoff=float(os.environ.get("AQUAMONITOR_RETRY_MAX_BACKOFF_SECONDS", 10)),
+                breaker=CircuitBreaker(
+                    failure_threshold=int(os.environ.get("AQUAMONITOR_CIRCUIT_FAILURES", 5)),
+                    reset_seconds=float(os.environ.get("AQUAMONITOR_CIRCUIT_RESET_SECONDS", 30)),
+                ),
+            )
+        return self.client
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+
+aquamonitor_client_manager = AquamonitorClientManager()
+
 
 class AquamonitorAPIError(Exception):
     def __init__(
@@ -262,6 +624,15 @@ class AquamonitorAPIError(Exception):
         return f"Aquamonitor API error: {self.message}"
 
 
+class AquamonitorUnavailableError(AquamonitorAPIError):
+    """Raised without sending the request while the circuit breaker is open, retry_after is the seconds until it lets
+    requests through again"""
+
+    def __init__(self, message: str, url: str, method: str, retry_after: float) -> None:
+        super().__init__(message=message, url=url, method=method, status_code=503)
+        self.retry_after = retry_after
+
+
 def handle_aquamonitor_error(response):
     if response.status_code < 399:
         return
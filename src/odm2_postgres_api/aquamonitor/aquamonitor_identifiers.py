@@ -0,0 +1,53 @@
+"""
+Aquamonitor stations stored in ODM2, so they are looked up in Aquamonitor only the first time a station is posted to.
+
+Stations in Aquamonitor belong to a project, so they are stored per directive and sampling feature in
+directivesamplingfeatureexternalidentifiers. The StationCargo that is sent back to Aquamonitor is stored with the id,
+it holds the id of the project as well.
+"""
+import json
+from typing import Optional
+
+import asyncpg
+
+from odm2_postgres_api.aquamonitor.aquamonitor_api_types import StationCargo
+
+AQUAMONITOR_SYSTEM = "aquamonitor"
+
+
+async def find_aquamonitor_station(
+    conn: asyncpg.connection, directiveid: int, samplingfeatureid: int
+) -> Optional[StationCargo]:
+    properties = await conn.fetchval(
+        "SELECT dse.externalidentifierproperties FROM directivesamplingfeatureexternalidentifiers dse "
+        "INNER JOIN externalidentifiersystems eis ON eis.externalidentifiersystemid = dse.externalidentifiersystemid "
+        "WHERE dse.directiveid = $1 AND dse.samplingfeatureid = $2 AND eis.externalidentifiersystemname = $3",
+        directiveid,
+        samplingfeatureid,
+        AQUAMONITOR_SYSTEM,
+    )
+    if properties is None:
+        return None
+    return StationCargo.parse_raw(properties)
+
+
+async def save_aquamonitor_station(
+    conn: asyncpg.connection, directiveid: int, samplingfeatureid: int, station: StationCargo
+):
+    """Stores the station, replacing what was stored before"""
+    system_id = await conn.fetchval(
+        "SELECT externalidentifiersystemid FROM externalidentifiersystems WHERE externalidentifiersystemname = $1",
+        AQUAMONITOR_SYSTEM,
+    )
+    await conn.execute(
+        "INSERT INTO directivesamplingfeatureexternalidentifiers (directiveid, samplingfeatureid, "
+        "externalidentifiersystemid, samplingfeatureexternalidentifier, externalidentifierproperties) "
+        "VALUES ($1, $2, $3, $4, $5) ON CONFLICT (directiveid, samplingfeatureid, externalidentifiersystemid) "
+        "DO UPDATE SET samplingfeatureexternalidentifier = excluded.samplingfeatureexternalidentifier, "
+        "externalidentifierproperties = excluded.externalidentifierproperties",
+        directiveid,
+        samplingfeatureid,
+        system_id,
+        str(station.Id),
+        json.dumps(station.dict(exclude_none=True)),
+    )
@@ -0,0 +1,183 @@
+"""
+Transactional outbox for writes to Aquamonitor.
+
+Routes store what has to be sent in aquamonitoroutbox, in the same transaction as the ODM2 rows, and return as soon as
+that is committed. AquamonitorOutboxWorker sends the entries in the background and retries failures with backoff.
+Entries are synced with the sample in Aquamonitor, only what differs is sent, so neither an entry that failed halfway
+nor a resubmitted begroing result is stored twice.
+
+Entries go from 'pending' to 'in_progress' when claimed and end as 'done' or 'failed'. A claimed entry is leased, if
+the worker dies while sending it the entry is claimed again once the lease has expired.
+"""
+import asyncio
+import datetime as dt
+import json
+import logging
+import os
+import random
+from typing import Optional
+
+import asyncpg
+from fastapi import HTTPException
+from nivacloud_logging.log_utils import LogContext
+
+from odm2_postgres_api.aquamonitor.aquamonitor_client import (
+    AquamonitorAPIError,
+    AquamonitorUnavailableError,
+    store_begroing_results,
+)
+from odm2_postgres_api.schemas import schemas
+from odm2_postgres_api.utils.api_pool_manager import ApiPoolManager, api_pool_manager
+
+CLAIM_DUE_ENTRIES_QUERY = (
+    "UPDATE aquamonitoroutbox SET status = 'in_progress', attempts = attempts + 1, nextattemptdatetime = now() + $2 "
+    "WHERE outboxid IN (SELECT outboxid FROM aquamonitoroutbox "
+    "WHERE status IN ('pending', 'in_progress') AND nextattemptdatetime <= now() "
+    "ORDER BY nextattemptdatetime LIMIT $1 FOR UPDATE SKIP LOCKED) returning *"
+)
+
+
+async def enqueue_begroing_results(
+    conn: asyncpg.connection, observations: schemas.BegroingObservations
+) -> schemas.AquamonitorOutboxEntry:
+    """Stores the observations for the worker, call it inside the transaction that stores them in ODM2"""
+    row = await conn.fetchrow(
+        "INSERT INTO aquamonitoroutbox (payload, status, attempts, nextattemptdatetime, createddatetime) "
+        "VALUES ($1, 'pending', 0, now(), now()) returning *",
+        observations.json(),
+    )
+    return schemas.AquamonitorOutboxEntry(**row)
+
+
+async def find_outbox_entry(conn: asyncpg.connection, outboxid: int) -> schemas.AquamonitorOutboxEntry:
+    row = await conn.fetchrow("SELECT * FROM aquamonitoroutbox WHERE outboxid = $1", outboxid)
+    if row is None:
+        raise HTTPException(status_code=404, detail=f"Outbox entry {outboxid} does not exist")
+    return schemas.AquamonitorOutboxEntry(**row)
+
+
+async def outbox_status(conn: asyncpg.connection) -> schemas.AquamonitorOutboxStatus:
+    rows = await conn.fetch(
+        "SELECT status, count(*) AS entries, min(createddatetime) AS oldest FROM aquamonitoroutbox GROUP BY status"
+    )
+    unsent = [row["oldest"] for row in rows if row["status"] in ("pending", "in_progress")]
+    return schemas.AquamonitorOutboxStatus(
+        entries={row["status"]: row["entries"] for row in rows}, oldest_unsent=min(unsent) if unsent else None
+    )
+
+
+def retry_delay(attempts: int, backoff: float, max_backoff: float) -> dt.timedelta:
+    """Exponential backoff, jittered between half and all of the delay so retries of many entries spread out"""
+    delay = min(backoff * 2 ** (attempts - 1), max_backoff)
+    return dt.timedelta(seconds=random.uniform(delay / 2, delay))
+
+
+def is_permanent_error(error: Exception) -> bool:
+    """Client errors other than timeouts and rate limiting fail the same way on every attempt"""
+    if isinstance(error, AquamonitorAPIError):
+        return 400 <= error.status_code < 500 and error.status_code not in (408, 429)
+    return isinstance(error, HTTPException) and error.status_code < 500
+
+
+class AquamonitorOutboxWorker:
+    def __init__(self, pool_manager: ApiPoolManager, store=store_begroing_results):
+        self.pool_manager = pool_manager
+        self.store = store
+        self.batch_size = int(os.environ.get("AQUAMONITOR_OUTBOX_BATCH_SIZE", 10))
+        self.poll_interval = float(os.environ.get("AQUAMONITOR_OUTBOX_POLL_SECONDS", 5))
+        self.max_attempts = int(os.environ.get("AQUAMONITOR_OUTBOX_MAX_ATTEMPTS", 10))
+        self.backoff = float(os.environ.get("AQUAMONITOR_OUTBOX_BACKOFF_SECONDS", 30))
+        self.max_backoff = float(os.environ.get("AQUAMONITOR_OUTBOX_MAX_BACKOFF_SECONDS", 3600))
+        self.lease = dt.timedelta(seconds=float(os.environ.get("AQUAMONITOR_OUTBOX_LEASE_SECONDS", 300)))
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def wake(self):
+        """Processes due entries now instead of after the poll interval, call it after committing an entry"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def run(self):
+        while True:
+            try:
+                processed = await self.run_once()
+            except Exception:
+                logging.exception("Aquamonitor outbox worker failed, retrying after the poll interval")
+                processed = 0
+            if processed < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+
+    async def run_once(self) -> int:
+        """Sends one batch of due entries, returns the number of entries claimed"""
+        async with self.pool_manager.acquire() as conn:
+            entries = await conn.fetch(CLAIM_DUE_ENTRIES_QUERY, self.batch_size, self.lease)
+        # no connection is held while waiting for aquamonitor
+        for entry in entries:
+            await self.send(entry)
+        return len(entries)
+
+    async def send(self, entry: asyncpg.Record):
+        with LogContext(outboxid=entry["outboxid"], attempt=entry["attempts"]):
+            observations = schemas.BegroingObservations.parse_raw(entry["payload"])
+            try:
+                stored = await self.store(observations, sync=True)
+            except Exception as e:
+                await self.mark_failed_attempt(entry, e)
+            else:
+                response = {
+                    "sample_id": stored["sample"].Id,
+                    "observation_ids": [o.Id for o in stored["observations"]],
+                    **{count: stored[count] for count in ("added", "updated", "deleted", "unchanged")},
+                }
+                async with self.pool_manager.acquire() as conn:
+                    await conn.execute(
+                        "UPDATE aquamonitoroutbox SET status = 'done', completeddatetime = now(), lasterror = NULL, "
+                        "response = $2 WHERE outboxid = $1",
+                        entry["outboxid"],
+                        json.dumps(response),
+                    )
+                logging.info("Sent outbox entry to aquamonitor", extra=response)
+
+    async def mark_failed_attempt(self, entry: asyncpg.Record, error: Exception):
+        failed = is_permanent_error(error) or entry["attempts"] >= self.max_attempts
+        delay = retry_delay(entry["attempts"], self.backoff, self.max_backoff)
+        if isinstance(error, AquamonitorUnavailableError):
+            # the circuit breaker fails every attempt until it lets requests through again
+            delay = max(delay, dt.timedelta(seconds=error.retry_after))
+        async with self.pool_manager.acquire() as conn:
+            await conn.execute(
+                "UPDATE aquamonitoroutbox SET status = $2, nextattemptdatetime = now() + $3, lasterror = $4 "
+                "WHERE outboxid = $1",
+                entry["outboxid"],
+                "failed" if failed else "pending",
+                delay,
+                str(error)[:5000],
+            )
+        logging.warning(
+            "Could not send outbox entry to aquamonitor",
+            extra={
+                "error": str(error),
+                "failed": failed,
+                "retry_in_seconds": None if failed else delay.total_seconds(),
+            },
+        )
+
+
+outbox_worker = AquamonitorOutboxWorker(api_pool_manager)
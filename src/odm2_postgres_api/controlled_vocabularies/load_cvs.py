@@ -1,29 +1,66 @@
+import asyncio
 import json
 import logging
 import os
-from typing import List
+from typing import Dict, List, Tuple
 
 from odm2_postgres_api.controlled_vocabularies.download_cvs import (
     CONTROLLED_VOCABULARY_TABLE_NAMES,
 )
-from odm2_postgres_api.queries.core_queries import find_row, insert_pydantic_object
+from odm2_postgres_api.queries.core_queries import parse_row_count
 from odm2_postgres_api.schemas.schemas import ControlledVocabulary
 
 
+def cv_file_path(cv_name) -> str:
+    return os.path.join(os.path.dirname(__file__), "cv_definitions", f"{cv_name}.json")
+
+
 def read_cv_from_file(cv_name) -> List[ControlledVocabulary]:
-    path = os.path.join(os.path.dirname(__file__), "cv_definitions", f"{cv_name}.json")
+    path = cv_file_path(cv_name)
     logging.info("Loading CV's from file", extra={"file": path})
     with open(path) as f:
         o = json.load(f)
         return [ControlledVocabulary(**cv) for cv in o["objects"]]
 
 
-async def load_controlled_vocabularies(db_pool):
-    logging.info("Loading controlled vocabularies defined as json")
+CV_COLUMNS = ["term", "name", "definition", "category"]
+
+
+def cv_records(cv_name) -> List[Tuple]:
+    return [tuple(getattr(cv, column) for column in CV_COLUMNS) for cv in read_cv_from_file(cv_name)]
+
+
+async def copy_controlled_vocabulary(db_pool, cv_name) -> Dict:
+    """
+    Streams a CV file with COPY into a staging table and merges the terms not stored yet into the cv table with a
+    single statement. Returns the number of inserted and unchanged terms.
+    """
+    records = cv_records(cv_name)
     async with db_pool.acquire() as conn:
-        for cv_name in CONTROLLED_VOCABULARY_TABLE_NAMES:
-            cv_entries = read_cv_from_file(cv_name)
-            for cv in cv_entries:
-                existing = await find_row(conn, cv_name, "term", cv.term, ControlledVocabulary)
-                if not existing:
-                    await insert_pydantic_object(conn, cv_name, cv, ControlledVocabulary)
+        async with conn.transaction():
+            await conn.execute(f"CREATE TEMPORARY TABLE cv_staging (LIKE {cv_name}) ON COMMIT DROP")
+            await conn.copy_records_to_table("cv_staging", records=records, columns=CV_COLUMNS)
+            status = await conn.execute(
+                f"INSERT INTO {cv_name} ({', '.join(CV_COLUMNS)}) SELECT {', '.join(CV_COLUMNS)} FROM cv_staging s "
+                f"WHERE NOT EXISTS (SELECT 1 FROM {cv_name} existing WHERE existing.term = s.term) "
+                f"ON CONFLICT DO NOTHING"
+            )
+    inserted = parse_row_count(status)
+    return {"table": cv_name, "inserted": inserted, "unchanged": len(records) - inserted}
+
+
+async def load_controlled_vocabularies(db_pool) -> List[Dict]:
+    """Loads all CV files concurrently, each on its own pool connection"""
+    logging.info("Loading controlled vocabularies defined as json")
+    report = await asyncio.gather(
+        *(copy_controlled_vocabulary(db_pool, cv_name) for cv_name in CONTROLLED_VOCABULARY_TABLE_NAMES)
+    )
+    logging.info(
+        "Controlled vocabularies loaded",
+        extra={
+            "inserted": sum(r["inserted"] for r in report),
+            "unchanged": sum(r["unchanged"] for r in report),
+            "tables": len(report),
+        },
+    )
+    return report
@@ -979,7 +979,7 @@ create table ODM2.TimeSeriesResults (
 	aggregationstatisticcv varchar (255) NOT NULL
 );
 create table ODM2.TimeSeriesResultValues (
-	valueid bigserial  NOT NULL primary key,
+	valueid bigserial  NOT NULL,
 	resultid bigint  NOT NULL,
 	datavalue double precision  NOT NULL,
 	valuedatetime timestamp  NOT NULL,
@@ -988,7 +988,8 @@ create table ODM2.TimeSeriesResultValues (
 	qualitycodecv varchar (255) NOT NULL,
 	timeaggregationinterval double precision  NOT NULL,
 	timeaggregationintervalunitsid integer  NOT NULL,
-	UNIQUE (ResultID, DataValue, ValueDateTime, ValueDateTimeUTCOffset, CensorCodeCV, QualityCodeCV, TimeAggregationInterval, TimeAggregationIntervalUnitsID)
+	primary key (ValueID, ValueDateTime),
+	CONSTRAINT time_series_result_value_unique UNIQUE (ValueDateTime, ResultID)
 );
 create table ODM2.TrajectoryResults (
 	resultid bigint  NOT NULL primary key,
@@ -1243,10 +1244,6 @@ alter table ODM2.TimeSeriesResultValueAnnotations add constraint fk_TimeSeriesRe
 foreign key (AnnotationID) References ODM2.Annotations (AnnotationID)
 on update no Action on delete RESTRICT;
 
-alter table ODM2.TimeSeriesResultValueAnnotations add constraint fk_TimeSeriesResultValueAnnotations_TimeSeriesResultValues
-foreign key (ValueID) References ODM2.TimeSeriesResultValues (ValueID)
-on update no Action on delete RESTRICT;
-
 alter table ODM2.TrajectoryResultValueAnnotations add constraint fk_TrajectoryResultValueAnnotations_Annotations
 foreign key (AnnotationID) References ODM2.Annotations (AnnotationID)
 on update no Action on delete RESTRICT;
@@ -2319,6 +2316,9 @@ on update no Action on delete RESTRICT;
 create index TrackResultValues_resultid_time_idx
     on ODM2.TrackResultValues (resultid asc, valuedatetime desc);
 
+create index TimeSeriesResultValues_resultid_time_idx
+    on ODM2.TimeSeriesResultValues (resultid asc, valuedatetime desc);
+
 create index TrackResultLocations_resultid_time_idx
     on ODM2.TrackResultLocations (samplingfeatureid asc, valuedatetime desc);
 
@@ -2366,3 +2366,47 @@ on update no Action on delete RESTRICT;
 alter table ODM2.RelatedTaxonomicClassifiers add constraint fk_RelatedTaxonomicClassifiers_CV_RelationshipType
 foreign key (RelationshipTypeCV) References ODM2.CV_RelationshipType (Name)
 on update no Action on delete RESTRICT;
+
+create table ODM2.MetadataFingerprints (
+	fingerprint varchar (64) NOT NULL primary key,
+	applieddatetime timestamp  NOT NULL
+);
+
+create table ODM2.AquamonitorOutbox (
+	outboxid bigserial  NOT NULL primary key,
+	payload jsonb  NOT NULL,
+	status varchar (50) NOT NULL,
+	attempts integer  NOT NULL,
+	nextattemptdatetime timestamp with time zone  NOT NULL,
+	createddatetime timestamp with time zone  NOT NULL,
+	completeddatetime timestamp with time zone  NULL,
+	lasterror varchar (5000) NULL,
+	response jsonb  NULL
+);
+
+create index AquamonitorOutbox_due_idx
+    on ODM2.AquamonitorOutbox (nextattemptdatetime) where status in ('pending', 'in_progress');
+
+create table ODM2.DirectiveSamplingFeatureExternalIdentifiers (
+	bridgeid serial  NOT NULL primary key,
+	directiveid integer  NOT NULL,
+	samplingfeatureid integer  NOT NULL,
+	externalidentifiersystemid integer  NOT NULL,
+	samplingfeatureexternalidentifier varchar (255) NOT NULL,
+	externalidentifierproperties jsonb  NOT NULL
+);
+
+alter table ODM2.DirectiveSamplingFeatureExternalIdentifiers add constraint fk_DirectiveSFExternalIdentifiers_ExternalIdentifierSystems
+foreign key (ExternalIdentifierSystemID) References ODM2.ExternalIdentifierSystems (ExternalIdentifierSystemID)
+on update no Action on delete RESTRICT;
+
+alter table ODM2.DirectiveSamplingFeatureExternalIdentifiers add constraint fk_DirectiveSFExternalIdentifiers_Directives
+foreign key (DirectiveID) References ODM2.Directives (DirectiveID)
+on update no Action on delete RESTRICT;
+
+alter table ODM2.DirectiveSamplingFeatureExternalIdentifiers add constraint fk_DirectiveSFExternalIdentifiers_SamplingFeatures
+foreign key (SamplingFeatureID) References ODM2.SamplingFeatures (SamplingFeatureID)
+on update no Action on delete RESTRICT;
+
+create unique index DirectiveSamplingFeatureExternalIdentifiers_idx
+    on ODM2.DirectiveSamplingFeatureExternalIdentifiers (directiveid, samplingfeatureid, externalidentifiersystemid);
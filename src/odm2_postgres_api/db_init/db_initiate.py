@@ -7,6 +7,8 @@ import asyncpg
 from dotenv import load_dotenv
 from nivacloud_logging.log_utils import setup_logging
 
+from odm2_postgres_api.db_init.timescale_policies import run_hypertable_policies
+
 
 async def create_database_if_not_exists(conn, quoted_db_name: str):
     if (
@@ -112,9 +114,43 @@ async def postgres_user_on_odm_db(connection_string, db_name: str, schema_name:
         await conn.close()
 
 
+async def migrate_time_series_result_values(conn):
+    """
+    Databases created before TimeSeriesResultValues became a hypertable have a primary key on valueid alone and a
+    foreign key from TimeSeriesResultValueAnnotations to it. Timescale needs valuedatetime in every unique index and
+    does not support foreign keys to hypertables, so these are replaced with the constraints from
+    ODM2_for_PostgreSQL.sql.
+    """
+    logging.info(
+        await conn.execute(
+            "ALTER TABLE ODM2.TimeSeriesResultValueAnnotations "
+            "DROP CONSTRAINT IF EXISTS fk_TimeSeriesResultValueAnnotations_TimeSeriesResultValues"
+        )
+    )
+    primary_key_columns = await conn.fetchval(
+        "SELECT array_length(conkey, 1) FROM pg_constraint "
+        "WHERE conrelid = 'odm2.timeseriesresultvalues'::regclass AND contype = 'p'"
+    )
+    if primary_key_columns == 1:
+        commands = [
+            "ALTER TABLE ODM2.TimeSeriesResultValues DROP CONSTRAINT timeseriesresultvalues_pkey",
+            "ALTER TABLE ODM2.TimeSeriesResultValues ADD PRIMARY KEY (ValueID, ValueDateTime)",
+        ]
+        for command in commands:
+            logging.info(await conn.execute(command))
+    if not await conn.fetchval("SELECT count(*) FROM pg_constraint WHERE conname = 'time_series_result_value_unique'"):
+        logging.info(
+            await conn.execute(
+                "ALTER TABLE ODM2.TimeSeriesResultValues "
+                "ADD CONSTRAINT time_series_result_value_unique UNIQUE (ValueDateTime, ResultID)"
+            )
+        )
+
+
 async def run_create_hypertable_commands(connection_string):
     hyper_tables_sql = [
-        # "SELECT create_hypertable('odm2.TimeSeriesResultValues', 'valueid', chunk_time_interval => 100000)",
+        "SELECT create_hypertable('ODM2.TimeSeriesResultValues', 'valuedatetime', "
+        "chunk_time_interval => interval '7 day', if_not_exists=>TRUE, migrate_data=>TRUE)",
         "SELECT create_hypertable('ODM2.TrackResultLocations', 'valuedatetime', "
         "chunk_time_interval => interval '7 day', if_not_exists=>TRUE)",
         "SELECT create_hypertable('ODM2.TrackResultValues', 'valuedatetime', "
@@ -124,8 +160,10 @@ async def run_create_hypertable_commands(connection_string):
     conn = await asyncpg.connect(connection_string)
     try:
         async with conn.transaction():
+            await migrate_time_series_result_values(conn)
             for command in hyper_tables_sql:
                 logging.info(await conn.execute(command))
+        await run_hypertable_policies(conn)
     finally:
         await conn.close()
 
@@ -0,0 +1,169 @@
+"""
+Chunk interval, compression and retention of the hypertables, configured from the environment:
+
+TIMESCALE_CHUNK_TIME_INTERVAL        interval of new chunks, default '7 days'
+TIMESCALE_COMPRESS_AFTER             compress chunks older than this, e.g. '90 days'. Default '' leaves compression
+                                     off. Compressed chunks are read only on TimescaleDB 1.7, inserts and upserts of
+                                     values older than this fail, so only enable it when older values are never
+                                     re-posted or backfilled.
+TIMESCALE_COMPRESS_EXISTING_CHUNKS   compress the chunks already older than TIMESCALE_COMPRESS_AFTER right away instead
+                                     of waiting for the policy, default 'false'
+TIMESCALE_RETENTION                  drop chunks older than this, default '' which keeps all data
+
+Hourly and daily statistics of trackresultvalues are kept in continuous aggregates, which also keep the statistics of
+chunks dropped by the retention policy.
+"""
+import datetime as dt
+import logging
+import os
+from typing import Dict, List
+
+# segmentby should be the column range reads filter on, orderby must cover the remaining unique constraint columns
+HYPERTABLES = {
+    "timeseriesresultvalues": {"segmentby": "resultid", "orderby": "valuedatetime DESC, valueid"},
+    "trackresultlocations": {"segmentby": "samplingfeatureid", "orderby": "valuedatetime DESC"},
+    "trackresultvalues": {"segmentby": "resultid", "orderby": "valuedatetime DESC"},
+}
+
+# continuous aggregates over trackresultvalues and their bucket, from the coarsest
+TRACK_RESULT_AGGREGATES: Dict[str, dt.timedelta] = {
+    "trackresultvalues_daily": dt.timedelta(days=1),
+    "trackresultvalues_hourly": dt.timedelta(hours=1),
+}
+
+# refresh_lag keeps the newest, still changing, bucket out of the materialization, reads include it by aggregating
+# the raw rows
+TRACK_RESULT_AGGREGATE_REFRESH: Dict[str, Dict[str, str]] = {
+    "trackresultvalues_daily": {"refresh_lag": "1 day", "refresh_interval": "1 hour"},
+    "trackresultvalues_hourly": {"refresh_lag": "1 hour", "refresh_interval": "15 minutes"},
+}
+
+CHUNK_REPORT_QUERY = (
+    "SELECT count(to_regclass(format('%I.%I', c.schema_name, c.table_name))) AS chunks, "
+    "count(s.chunk_id) AS compressed_chunks, "
+    "coalesce(sum(pg_total_relation_size(to_regclass(format('%I.%I', c.schema_name, c.table_name)))), 0) "
+    "+ coalesce(sum(s.compressed_heap_size + s.compressed_toast_size + s.compressed_index_size), 0) AS total_bytes "
+    "FROM _timescaledb_catalog.chunk c "
+    "JOIN _timescaledb_catalog.hypertable h ON h.id = c.hypertable_id "
+    "LEFT JOIN _timescaledb_catalog.compression_chunk_size s ON s.chunk_id = c.id "
+    "WHERE h.schema_name = 'odm2' AND h.table_name = $1"
+)
+
+
+def policy_settings() -> Dict[str, str]:
+    return {
+        "chunk_time_interval": os.environ.get("TIMESCALE_CHUNK_TIME_INTERVAL", "7 days"),
+        "compress_after": os.environ.get("TIMESCALE_COMPRESS_AFTER", ""),
+        "compress_existing_chunks": os.environ.get("TIMESCALE_COMPRESS_EXISTING_CHUNKS", "false"),
+        "retention": os.environ.get("TIMESCALE_RETENTION", ""),
+    }
+
+
+def compression_command(table: str) -> str:
+    return (
+        f"ALTER TABLE odm2.{table} SET (timescaledb.compress, "
+        f"timescaledb.compress_segmentby = '{HYPERTABLES[table]['segmentby']}', "
+        f"timescaledb.compress_orderby = '{HYPERTABLES[table]['orderby']}')"
+    )
+
+
+def continuous_aggregate_command(view: str) -> str:
+    bucket = f"INTERVAL '{int(TRACK_RESULT_AGGREGATES[view].total_seconds())} seconds'"
+    return (
+        f"CREATE VIEW odm2.{view} WITH (timescaledb.continuous) AS "
+        f"SELECT resultid, time_bucket({bucket}, valuedatetime) AS valuedatetime, avg(datavalue) AS datavalue, "
+        "min(datavalue) AS minimum, max(datavalue) AS maximum, count(*) AS valuecount "
+        f"FROM odm2.trackresultvalues GROUP BY resultid, time_bucket({bucket}, valuedatetime)"
+    )
+
+
+async def create_continuous_aggregates(conn, settings: Dict[str, str]):
+    # raw chunks older than this are compressed or dropped, changes to them can not be materialized anymore
+    ignore_invalidation_older_than = await conn.fetchval(
+        "SELECT least(nullif($1, '')::interval, nullif($2, '')::interval)::text",
+        settings["compress_after"],
+        settings["retention"],
+    )
+    for view, refresh in TRACK_RESULT_AGGREGATE_REFRESH.items():
+        if await conn.fetchval("SELECT to_regclass($1) IS NULL", f"odm2.{view}"):
+            logging.info(await conn.execute(continuous_aggregate_command(view)))
+        options = [
+            f"timescaledb.refresh_lag = '{refresh['refresh_lag']}'",
+            f"timescaledb.refresh_interval = '{refresh['refresh_interval']}'",
+        ]
+        if ignore_invalidation_older_than:
+            options.append(f"timescaledb.ignore_invalidation_older_than = '{ignore_invalidation_older_than}'")
+        logging.info(await conn.execute(f"ALTER VIEW odm2.{view} SET ({', '.join(options)})"))
+
+
+async def chunk_report(conn, table: str) -> Dict:
+    row = await conn.fetchrow(CHUNK_REPORT_QUERY, table)
+    return {"table": table, **row}
+
+
+async def apply_hypertable_policies(conn, table: str, settings: Dict[str, str]):
+    await conn.execute(
+        "SELECT set_chunk_time_interval($1::regclass, $2::text::interval)",
+        f"odm2.{table}",
+        settings["chunk_time_interval"],
+    )
+
+    await conn.execute("SELECT remove_compress_chunks_policy($1::regclass, if_exists => true)", f"odm2.{table}")
+    if settings["compress_after"]:
+        compression_enabled = await conn.fetchval(
+            "SELECT compressed_hypertable_id IS NOT NULL FROM _timescaledb_catalog.hypertable "
+            "WHERE schema_name = 'odm2' AND table_name = $1",
+            table,
+        )
+        if not compression_enabled:
+            logging.info(await conn.execute(compression_command(table)))
+        # hypertables with compression enabled keep their segmentby and orderby, changing them needs all chunks
+        # decompressed first
+        await conn.execute(
+            "SELECT add_compress_chunks_policy($1::regclass, $2::text::interval)",
+            f"odm2.{table}",
+            settings["compress_after"],
+        )
+        if settings["compress_existing_chunks"].lower() == "true":
+            compressed = await conn.fetch(
+                "SELECT compress_chunk(chunk, if_not_compressed => true) "
+                "FROM show_chunks($1::regclass, older_than => $2::text::interval) chunk",
+                f"odm2.{table}",
+                settings["compress_after"],
+            )
+            logging.info("Compressed existing chunks", extra={"table": table, "chunks": len(compressed)})
+
+    await conn.execute("SELECT remove_drop_chunks_policy($1::regclass, if_exists => true)", f"odm2.{table}")
+    if settings["retention"]:
+        # continuous aggregates keep the statistics of dropped chunks
+        await conn.execute(
+            "SELECT add_drop_chunks_policy($1::regclass, $2::text::interval, cascade_to_materializations => false)",
+            f"odm2.{table}",
+            settings["retention"],
+        )
+
+
+async def run_hypertable_policies(conn) -> List[Dict]:
+    """
+    Creates the continuous aggregates and applies the policies from the environment to all hypertables, logging their
+    chunk sizes before and after
+    """
+    settings = policy_settings()
+    logging.info("Applying hypertable policies", extra=settings)
+    await create_continuous_aggregates(conn, settings)
+    reports = []
+    for table in HYPERTABLES:
+        before = await chunk_report(conn, table)
+        async with conn.transaction():
+            await apply_hypertable_policies(conn, table, settings)
+        after = await chunk_report(conn, table)
+        report = {
+            "table": table,
+            "chunks": after["chunks"],
+            "compressed_chunks": after["compressed_chunks"],
+            "total_bytes_before": before["total_bytes"],
+            "total_bytes_after": after["total_bytes"],
+        }
+        logging.info("Hypertable chunk sizes", extra=report)
+        reports.append(report)
+    return reports
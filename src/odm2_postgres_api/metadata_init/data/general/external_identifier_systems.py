@@ -11,7 +11,13 @@ def external_identifier_systems(org_id: int) -> List[ExternalIdentifierSystemsCr
             "externalidentifiersystemdescription": "reference to old 3-letter active "
             "directory usernames (SamAccountName)",
             "externalidentifiersystemurl": "",
-        }
+        },
+        {
+            "externalidentifiersystemname": "aquamonitor",
+            "identifiersystemorganizationid": org_id,
+            "externalidentifiersystemdescription": "ids of stations in Aquamonitor",
+            "externalidentifiersystemurl": "https://aquamonitor.niva.no",
+        },
     ]
 
     return [ExternalIdentifierSystemsCreate(**s) for s in systems]
@@ -1,7 +1,12 @@
+import hashlib
+import json
 import logging
+from typing import Dict, List
 
+from odm2_postgres_api.controlled_vocabularies.download_cvs import CONTROLLED_VOCABULARY_TABLE_NAMES
 from odm2_postgres_api.controlled_vocabularies.load_cvs import (
     load_controlled_vocabularies,
+    cv_file_path,
 )
 from odm2_postgres_api.metadata_init.data.begroing.begroing_metadata import (
     begroing_controlled_vocabularies,
@@ -33,79 +38,81 @@ from odm2_postgres_api.metadata_init.data.general.processing_levels import (
 )
 from odm2_postgres_api.metadata_init.data.general.units import units
 from odm2_postgres_api.metadata_init.data.general.variables import variables
+from odm2_postgres_api.queries.core_queries import insert_missing
 from odm2_postgres_api.queries.storage import (
     save_organization,
-    save_external_identifier_system,
     save_person,
-    post_processing_levels,
-    save_controlled_vocab,
-    save_units,
-    save_variables,
-    save_methods,
-    save_sampling_features,
-    save_annotations,
+    save_missing_controlled_vocabs,
+    save_missing_methods,
+    save_missing_sampling_features,
 )
 
 
-async def populate_metadata(db_pool):
-    logging.info("Populating ODM2 metadata")
-    await load_controlled_vocabularies(db_pool)
-
-    async with db_pool.acquire() as conn:
-        niva_org_created = await save_organization(conn, niva_org())
-        niva_org_id = niva_org_created.organizationid
-
-        # general static metadata
-        for s in external_identifier_systems(niva_org_id):
-            await save_external_identifier_system(conn, s)
-
-        await save_person(conn, unknown_person(org_id=niva_org_id))
-        for p in general_processing_levels():
-            await post_processing_levels(conn, p)
-
-        for cv in controlled_vocabularies():
-            await save_controlled_vocab(conn, cv)
-
-        for u in units():
-            await save_units(conn, u)
-
-        for v in variables():
-            await save_variables(conn, v)
-
-        for m in methods(org_id=niva_org_id):
-            await save_methods(conn, m)
+def bundled_metadata(org_id: int) -> Dict[str, List]:
+    """Static metadata shipped with the api, keyed by the table it goes into, in the order it has to be stored"""
+    return {
+        "externalidentifiersystems": external_identifier_systems(org_id),
+        "processinglevels": general_processing_levels(),
+        "controlled_vocabularies": controlled_vocabularies()
+        + begroing_controlled_vocabularies()
+        + mass_spec_controlled_vocabularies(),
+        "units": units(),
+        "variables": variables() + begroing_variables() + mass_spec_variables(),
+        "methods": methods(org_id=org_id)
+        + begroing_methods(org_id=org_id)
+        + mass_spec_methods(org_id=org_id)
+        + fish_rfid_methods(org_id),
+        "annotations": mass_spec_annotations(),
+        "samplingfeatures": mass_spec_sampling_features() + fish_rfid_sampling_features(),
+    }
+
+
+def metadata_fingerprint() -> str:
+    """sha256 of the controlled vocabulary files and the bundled metadata, any change to either gives a new one"""
+    digest = hashlib.sha256()
+    for cv_name in CONTROLLED_VOCABULARY_TABLE_NAMES:
+        with open(cv_file_path(cv_name), "rb") as f:
+            digest.update(f.read())
+    # the organizationid is only known once stored and does not change the bundled metadata, so a fixed one is used
+    metadata = {table: [m.dict() for m in items] for table, items in bundled_metadata(org_id=0).items()}
+    metadata["organizations"] = [niva_org().dict()]
+    metadata["people"] = [unknown_person(org_id=0).dict()]
+    digest.update(json.dumps(metadata, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
 
-        # begroing metadata
-        for cv in begroing_controlled_vocabularies():
-            await save_controlled_vocab(conn, cv)
 
-        for v in begroing_variables():
-            await save_variables(conn, v)
-
-        for m in begroing_methods(org_id=niva_org_id):
-            await save_methods(conn, m)
-
-        # masspec metadata
-        for sf in mass_spec_sampling_features():
-            await save_sampling_features(conn, sf)
-
-        for cv in mass_spec_controlled_vocabularies():
-            await save_controlled_vocab(conn, cv)
-
-        for m in mass_spec_methods(org_id=niva_org_id):
-            await save_methods(conn, m)
-
-        for v in mass_spec_variables():
-            await save_variables(conn, v)
-
-        for a in mass_spec_annotations():
-            await save_annotations(conn, a)
+async def populate_metadata(db_pool):
+    fingerprint = metadata_fingerprint()
+    async with db_pool.acquire() as conn:
+        if await conn.fetchval("SELECT count(*) FROM metadatafingerprints WHERE fingerprint = $1", fingerprint):
+            logging.info("ODM2 metadata is up to date", extra={"fingerprint": fingerprint})
+            return
 
-        # fish_rfid metadata
-        for sf in fish_rfid_sampling_features():
-            await save_sampling_features(conn, sf)
+    logging.info("Populating ODM2 metadata", extra={"fingerprint": fingerprint})
+    await load_controlled_vocabularies(db_pool)
 
-        for m in fish_rfid_methods(niva_org_id):
-            await save_methods(conn, m)
+    async with db_pool.acquire() as conn:
+        async with conn.transaction():
+            niva_org_created = await save_organization(conn, niva_org())
+            niva_org_id = niva_org_created.organizationid
+            await save_person(conn, unknown_person(org_id=niva_org_id))
+
+            metadata = bundled_metadata(niva_org_id)
+            for table in ("externalidentifiersystems", "processinglevels"):
+                await insert_missing(conn, table, [m.dict() for m in metadata[table]])
+            await save_missing_controlled_vocabs(conn, metadata["controlled_vocabularies"])
+            for table in ("units", "variables"):
+                await insert_missing(conn, table, [m.dict() for m in metadata[table]])
+            await save_missing_methods(conn, metadata["methods"])
+            await insert_missing(
+                conn, "annotations", [a.dict() for a in metadata["annotations"]], match_columns=["annotationtext"]
+            )
+            await save_missing_sampling_features(conn, metadata["samplingfeatures"])
+
+            await conn.execute(
+                "INSERT INTO metadatafingerprints (fingerprint, applieddatetime) VALUES ($1, now()) "
+                "ON CONFLICT DO NOTHING",
+                fingerprint,
+            )
 
     logging.info("ODM2 metadata init done")
@@ -1,5 +1,9 @@
+import datetime as dt
+import json
 import logging
-from typing import Optional, List, Union
+import math
+import os
+from typing import Hashable, Optional, List, Union, Dict, Tuple
 from uuid import uuid4
 
 import asyncpg
@@ -7,6 +11,8 @@ import shapely.wkt
 from fastapi import HTTPException
 
 from odm2_postgres_api.controlled_vocabularies.download_cvs import CONTROLLED_VOCABULARY_TABLE_NAMES
+from odm2_postgres_api.db_init.timescale_policies import TRACK_RESULT_AGGREGATES
+from odm2_postgres_api.queries import prepared_statements
 from odm2_postgres_api.schemas import schemas
 from odm2_postgres_api.schemas.schemas import (
     PersonExtended,
@@ -18,6 +24,32 @@ from odm2_postgres_api.schemas.schemas import (
     SamplingFeaturesCreate,
 )
 from odm2_postgres_api.utils import shapely_postgres_adapter
+from odm2_postgres_api.utils.stage_timer import StageTimer
+from odm2_postgres_api.utils.ttl_cache import TTLCache
+
+# Metadata tables that are looked up on nearly every submission and rarely change
+METADATA_CACHE_TABLES = ("units", "variables", "processinglevels", "methods")
+metadata_cache = TTLCache(
+    name="metadata",
+    maxsize=int(os.environ.get("METADATA_CACHE_SIZE", 1024)),
+    ttl=float(os.environ.get("METADATA_CACHE_TTL_SECONDS", 300)),
+)
+
+
+def invalidate_metadata_cache(table: str):
+    def in_table(key: Hashable) -> bool:
+        return isinstance(key, tuple) and key[0] == table
+
+    metadata_cache.invalidate(in_table)
+
+
+def cache_metadata_row(conn: asyncpg.connection, cache_key: Tuple, row: Optional[asyncpg.Record]):
+    """
+    Rows read inside a transaction may have been inserted by it and disappear on rollback, so only rows read outside
+    of a transaction are cached
+    """
+    if row is not None and not conn.is_in_transaction():
+        metadata_cache.set(cache_key, row)
 
 
 def argument_placeholder(arguments: dict):
@@ -28,17 +60,81 @@ def make_sql_query(table: str, data: dict):
     return f"INSERT INTO {table} ({','.join(data.keys())}) VALUES ({argument_placeholder(data)}) returning *"
 
 
+def make_multi_row_sql_query(table: str, columns: List[str], row_count: int):
+    rows = (
+        "(" + ", ".join(f"${r * len(columns) + c + 1}" for c in range(len(columns))) + ")" for r in range(row_count)
+    )
+    return f"INSERT INTO {table} ({','.join(columns)}) VALUES {', '.join(rows)} returning *"
+
+
+# postgres accepts at most 32767 bind parameters per statement
+MAX_QUERY_ARGUMENTS = 32767
+
+
+async def insert_many(conn: asyncpg.connection, table: str, rows: List[dict]) -> List[asyncpg.Record]:
+    """
+    Inserts rows (dicts with identical keys) using multi-row INSERT statements, one per chunk of rows that fits
+    within the bind parameter limit. Returns the inserted rows.
+    """
+    if not rows:
+        return []
+    columns = list(rows[0].keys())
+    chunk_size = MAX_QUERY_ARGUMENTS // len(columns)
+    inserted: List[asyncpg.Record] = []
+    async with conn.transaction():
+        for start in range(0, len(rows), chunk_size):
+            end = start + chunk_size
+            chunk = rows[start:end]
+            arguments = [row[column] for row in chunk for column in columns]
+            inserted.extend(await conn.fetch(make_multi_row_sql_query(table, columns, len(chunk)), *arguments))
+    if table in METADATA_CACHE_TABLES:
+        invalidate_metadata_cache(table)
+    return inserted
+
+
+async def insert_missing(
+    conn: asyncpg.connection, table: str, rows: List[dict], match_columns: Optional[List[str]] = None
+) -> List[asyncpg.Record]:
+    """
+    Set-based insert of the rows (dicts with identical keys) that are not stored yet, in one statement. Rows violating
+    a unique constraint are skipped, and so are rows equal to an existing row on all match_columns, for tables where
+    those columns have no unique constraint. Returns the inserted rows only.
+    """
+    if not rows:
+        return []
+    columns = ", ".join(rows[0].keys())
+    query = (
+        f"INSERT INTO {table} ({columns}) SELECT {columns} "
+        f"FROM jsonb_populate_recordset(NULL::{table}, $1::jsonb) AS new_rows"
+    )
+    if match_columns:
+        match = " AND ".join(f"existing.{column} = new_rows.{column}" for column in match_columns)
+        query += f" WHERE NOT EXISTS (SELECT 1 FROM {table} existing WHERE {match})"
+    inserted = await conn.fetch(f"{query} ON CONFLICT DO NOTHING returning *", json.dumps(rows, default=str))
+    if inserted and table in METADATA_CACHE_TABLES:
+        invalidate_metadata_cache(table)
+    return inserted
+
+
 async def insert_pydantic_object(conn: asyncpg.connection, table_name: str, pydantic_object, response_model):
     logging.debug(f"Inserting row", extra={"table": table_name})
     pydantic_dict = pydantic_object.dict()
     row = await conn.fetchrow(make_sql_query(table_name, pydantic_dict), *pydantic_dict.values())
+    if table_name in METADATA_CACHE_TABLES:
+        invalidate_metadata_cache(table_name)
     return response_model(**row)
 
 
 async def find_unit(conn: asyncpg.connection, unit: UnitsCreate, raise_if_none=False):
-    row = await conn.fetchrow(
-        f"SELECT * FROM units WHERE unitstypecv=$1 AND unitsabbreviation=$2", unit.unitstypecv, unit.unitsabbreviation
-    )
+    cache_key = ("units", unit.unitstypecv, unit.unitsabbreviation)
+    row = metadata_cache.get(cache_key)
+    if row is None:
+        row = await conn.fetchrow(
+            f"SELECT * FROM units WHERE unitstypecv=$1 AND unitsabbreviation=$2",
+            unit.unitstypecv,
+            unit.unitsabbreviation,
+        )
+        cache_metadata_row(conn, cache_key, row)
     if row is None and raise_if_none:
         raise HTTPException(
             status_code=422,
@@ -49,7 +145,14 @@ async def find_unit(conn: asyncpg.connection, unit: UnitsCreate, raise_if_none=F
 
 
 async def find_row(conn: asyncpg.connection, table: str, id_column: str, identifier, model, raise_if_none=False):
-    row = await conn.fetchrow(f"SELECT * FROM {table} WHERE {id_column}=$1", identifier)
+    """Rows from METADATA_CACHE_TABLES are served from the in-process metadata_cache when possible"""
+    cache_key = (table, id_column, identifier)
+    cached = table in METADATA_CACHE_TABLES
+    row = metadata_cache.get(cache_key) if cached else None
+    if row is None:
+        row = await conn.fetchrow(f"SELECT * FROM {table} WHERE {id_column}=$1", identifier)
+        if cached:
+            cache_metadata_row(conn, cache_key, row)
     if row is None and raise_if_none:
         raise HTTPException(status_code=422, detail=f"Item in table {table} with '{id_column}={identifier}' not found")
     return model(**row) if row else None
@@ -140,6 +243,7 @@ async def insert_method(conn: asyncpg.connection, method: schemas.MethodsCreate)
     method_data = {k: v for k, v in method if k != "annotations"}
     async with conn.transaction():
         method_row = await conn.fetchrow(make_sql_query("methods", method_data), *method_data.values())
+        invalidate_metadata_cache("methods")
         for annotation_id in await create_or_parse_annotations(conn, method.annotations):
             await conn.fetchrow(
                 "INSERT INTO methodannotations (methodid, annotationid) Values ($1, $2) returning *",
@@ -149,17 +253,45 @@ async def insert_method(conn: asyncpg.connection, method: schemas.MethodsCreate)
     return schemas.Methods(annotations=method.annotations, **method_row)
 
 
+async def insert_action_relations(
+    conn: asyncpg.connection, actionid: int, action: schemas.ActionsCreate
+) -> List[schemas.SamplingFeatures]:
+    """Stores equipment, directives, related actions and new sampling features of an action"""
+    for equipmentid in action.equipmentids:
+        equipment_used_create = schemas.EquipmentUsedCreate(actionid=actionid, equipmentid=equipmentid)
+        await insert_pydantic_object(conn, "equipmentused", equipment_used_create, schemas.EquipmentUsed)
+
+    for directiveid in action.directiveids:
+        action_directive_create = schemas.ActionDirectivesCreate(actionid=actionid, directiveid=directiveid)
+        await insert_pydantic_object(conn, "actiondirectives", action_directive_create, schemas.ActionDirective)
+
+    for action_id, relation_ship_type in action.relatedactions:
+        related_action_create = schemas.RelatedActionCreate(
+            actionid=actionid, relationshiptypecv=relation_ship_type, relatedactionid=action_id
+        )
+        await insert_pydantic_object(conn, "relatedactions", related_action_create, schemas.RelatedAction)
+
+    new_sampling_features = []
+    for sampling_feature in action.sampling_features:
+        new_sampling_features.append(await create_sampling_feature(conn, sampling_feature))
+
+        feature_action = schemas.FeatureActionsCreate(
+            samplingfeatureuuid=new_sampling_features[-1].samplingfeatureuuid, actionid=actionid
+        )
+        await create_feature_action(conn, feature_action)
+    return new_sampling_features
+
+
 async def do_action(conn: asyncpg.connection, action: schemas.ActionsCreate) -> schemas.Action:
     async with conn.transaction():
-        method_row = await conn.fetchrow("SELECT methodid FROM methods WHERE methodcode = $1", action.methodcode)
-        if method_row is None:
+        method = await find_row(conn, "methods", "methodcode", action.methodcode, schemas.Methods)
+        if method is None:
             raise HTTPException(status_code=422, detail="Please specify valid methodcode.")
-        action_row = await conn.fetchrow(
-            "INSERT INTO actions (actiontypecv, methodid, begindatetime, begindatetimeutcoffset,  enddatetime, "
-            "enddatetimeutcoffset, actiondescription, actionfilelink) "
-            "VALUES ($1, $2, $3, $4, $5, $6, $7, $8) returning *",
+        action_row = await prepared_statements.fetchrow(
+            conn,
+            "insert_action",
             action.actiontypecv,
-            method_row["methodid"],
+            method.methodid,
             action.begindatetime,
             action.begindatetimeutcoffset,
             action.enddatetime,
@@ -168,39 +300,17 @@ async def do_action(conn: asyncpg.connection, action: schemas.ActionsCreate) ->
             action.actionfilelink,
         )
 
-        action_by = schemas.ActionsByCreate(
-            actionid=action_row["actionid"],
-            affiliationid=action.affiliationid,
-            isactionlead=action.isactionlead,
-            roledescription=action.roledescription,
-        )
-        action_by_row = await insert_pydantic_object(conn, "actionby", action_by, schemas.ActionsBy)
-        for equipmentid in action.equipmentids:
-            equipment_used_create = schemas.EquipmentUsedCreate(
-                actionid=action_row["actionid"], equipmentid=equipmentid
-            )
-            await insert_pydantic_object(conn, "equipmentused", equipment_used_create, schemas.EquipmentUsed)
-
-        for directiveid in action.directiveids:
-            action_directive_create = schemas.ActionDirectivesCreate(
-                actionid=action_row["actionid"], directiveid=directiveid
-            )
-            await insert_pydantic_object(conn, "actiondirectives", action_directive_create, schemas.ActionDirective)
-
-        for action_id, relation_ship_type in action.relatedactions:
-            related_action_create = schemas.RelatedActionCreate(
-                actionid=action_row["actionid"], relationshiptypecv=relation_ship_type, relatedactionid=action_id
-            )
-            await insert_pydantic_object(conn, "relatedactions", related_action_create, schemas.RelatedAction)
-
-        new_sampling_features = []
-        for sampling_feature in action.sampling_features:
-            new_sampling_features.append(await create_sampling_feature(conn, sampling_feature))
-
-            feature_action = schemas.FeatureActionsCreate(
-                samplingfeatureuuid=new_sampling_features[-1].samplingfeatureuuid, actionid=action_row["actionid"]
+        action_by_row = schemas.ActionsBy(
+            **await prepared_statements.fetchrow(
+                conn,
+                "insert_action_by",
+                action_row["actionid"],
+                action.affiliationid,
+                action.isactionlead,
+                action.roledescription,
             )
-            await create_feature_action(conn, feature_action)
+        )
+        new_sampling_features = await insert_action_relations(conn, action_row["actionid"], action)
     # Dict allows overwriting of key while pydantic schema does not, identical action_id exists in both return rows
     return schemas.Action(
         equipmentids=action.equipmentids,
@@ -210,21 +320,77 @@ async def do_action(conn: asyncpg.connection, action: schemas.ActionsCreate) ->
     )
 
 
+async def do_actions(conn: asyncpg.connection, actions: List[schemas.ActionsCreate]) -> List[schemas.Action]:
+    """
+    Batch version of do_action. The actions and their actionby rows are inserted with one array based statement each,
+    equipment, directives, related actions and sampling features are still stored per action.
+    """
+    if not actions:
+        return []
+    method_ids = {}
+    for methodcode in {a.methodcode for a in actions}:
+        method = await find_row(conn, "methods", "methodcode", methodcode, schemas.Methods)
+        if method is None:
+            raise HTTPException(status_code=422, detail="Please specify valid methodcode.")
+        method_ids[methodcode] = method.methodid
+
+    async with conn.transaction():
+        # actionids come from a sequence, so ordering the insert by input position lets us match rows to input by id
+        action_rows = await conn.fetch(
+            "INSERT INTO actions (actiontypecv, methodid, begindatetime, begindatetimeutcoffset, enddatetime, "
+            "enddatetimeutcoffset, actiondescription, actionfilelink) "
+            "SELECT actiontypecv, methodid, begindatetime, begindatetimeutcoffset, enddatetime, "
+            "enddatetimeutcoffset, actiondescription, actionfilelink "
+            "FROM unnest($1::varchar[], $2::integer[], $3::timestamp[], $4::integer[], $5::timestamp[], "
+            "$6::integer[], $7::varchar[], $8::varchar[]) WITH ORDINALITY AS a(actiontypecv, methodid, "
+            "begindatetime, begindatetimeutcoffset, enddatetime, enddatetimeutcoffset, actiondescription, "
+            "actionfilelink, position) ORDER BY position returning *",
+            [a.actiontypecv for a in actions],
+            [method_ids[a.methodcode] for a in actions],
+            [a.begindatetime for a in actions],
+            [a.begindatetimeutcoffset for a in actions],
+            [a.enddatetime for a in actions],
+            [a.enddatetimeutcoffset for a in actions],
+            [a.actiondescription for a in actions],
+            [a.actionfilelink for a in actions],
+        )
+        action_rows = sorted(action_rows, key=lambda row: row["actionid"])
+        action_by_rows = await conn.fetch(
+            "INSERT INTO actionby (actionid, affiliationid, isactionlead, roledescription) "
+            "SELECT * FROM unnest($1::integer[], $2::integer[], $3::boolean[], $4::varchar[]) returning *",
+            [row["actionid"] for row in action_rows],
+            [a.affiliationid for a in actions],
+            [a.isactionlead for a in actions],
+            [a.roledescription for a in actions],
+        )
+        action_by_per_action = {row["actionid"]: row for row in action_by_rows}
+
+        stored_actions = []
+        for action, action_row in zip(actions, action_rows):
+            new_sampling_features = await insert_action_relations(conn, action_row["actionid"], action)
+            stored_actions.append(
+                schemas.Action(
+                    equipmentids=action.equipmentids,
+                    methodcode=action.methodcode,
+                    sampling_features=new_sampling_features,
+                    **{**action_row, **action_by_per_action[action_row["actionid"]]},
+                )
+            )
+    return stored_actions
+
+
 async def create_sampling_feature(conn: asyncpg.connection, sampling_feature: schemas.SamplingFeaturesCreate):
     # Todo: Find a better way to deal with 'Null' geometry
     if sampling_feature.featuregeometrywkt:
-        await shapely_postgres_adapter.set_shapely_adapter(conn)
+        await shapely_postgres_adapter.ensure_shapely_adapter(conn)
         featuregeometry = shapely.wkt.loads(sampling_feature.featuregeometrywkt)
     else:
         featuregeometry = None
 
     async with conn.transaction():
-        sampling_row = await conn.fetchrow(
-            "INSERT INTO samplingfeatures (samplingfeatureuuid, samplingfeaturetypecv, samplingfeaturecode, "
-            "samplingfeaturename, samplingfeaturedescription, samplingfeaturegeotypecv, featuregeometry, "
-            "featuregeometrywkt, elevation_m, elevationdatumcv) "
-            "VALUES ($1, $2, $3, $4, $5, $6, "
-            "ST_SetSRID($7::geometry, 4326), $8, $9, $10) returning *",
+        sampling_row = await prepared_statements.fetchrow(
+            conn,
+            "insert_sampling_feature",
             sampling_feature.samplingfeatureuuid,
             sampling_feature.samplingfeaturetypecv,
             sampling_feature.samplingfeaturecode,
@@ -286,22 +452,18 @@ async def create_result_data_quality(conn: asyncpg.connection, result_data_quali
 
 async def create_feature_action(conn: asyncpg.connection, feature_action: schemas.FeatureActionsCreate):
     if feature_action.samplingfeatureuuid and feature_action.samplingfeaturecode:
-        row = await conn.fetchrow(
-            "INSERT INTO featureactions (samplingfeatureid, actionid) "
-            "VALUES ((SELECT samplingfeatureid FROM samplingfeatures "
-            "where samplingfeatureuuid = $1 AND samplingfeaturecode = $2), $3) "
-            "ON CONFLICT (samplingfeatureid, actionid) DO UPDATE SET actionid = EXCLUDED.actionid returning *",
+        row = await prepared_statements.fetchrow(
+            conn,
+            "insert_feature_action_by_uuid_and_code",
             feature_action.samplingfeatureuuid,
             feature_action.samplingfeaturecode,
             feature_action.actionid,
         )
         return schemas.FeatureActions(samplingfeatureuuid=feature_action.samplingfeatureuuid, **row)
     else:
-        row = await conn.fetchrow(
-            "INSERT INTO featureactions (samplingfeatureid, actionid) "
-            "VALUES ((SELECT samplingfeatureid FROM samplingfeatures "
-            "where samplingfeatureuuid = $1 OR samplingfeaturecode = $2), $3) "
-            "ON CONFLICT (samplingfeatureid, actionid) DO UPDATE SET actionid = EXCLUDED.actionid returning *",
+        row = await prepared_statements.fetchrow(
+            conn,
+            "insert_feature_action_by_uuid_or_code",
             feature_action.samplingfeatureuuid,
             feature_action.samplingfeaturecode,
             feature_action.actionid,
@@ -313,6 +475,21 @@ async def create_feature_action(conn: asyncpg.connection, feature_action: schema
         )
 
 
+async def create_feature_actions(
+    conn: asyncpg.connection, samplingfeatureids: List[int], actionids: List[int]
+) -> List[schemas.FeatureActions]:
+    """Batch version of create_feature_action for pairs of sampling feature ids and action ids"""
+    pairs = list(dict.fromkeys(zip(samplingfeatureids, actionids)))
+    rows = await conn.fetch(
+        "INSERT INTO featureactions (samplingfeatureid, actionid) "
+        "SELECT * FROM unnest($1::integer[], $2::integer[]) "
+        "ON CONFLICT (samplingfeatureid, actionid) DO UPDATE SET actionid = EXCLUDED.actionid returning *",
+        [p[0] for p in pairs],
+        [p[1] for p in pairs],
+    )
+    return [schemas.FeatureActions(**row) for row in rows]
+
+
 async def create_result(conn: asyncpg.connection, result: schemas.ResultsCreate):
     async with conn.transaction():
         feature_action_create = schemas.FeatureActionsCreate(
@@ -321,11 +498,9 @@ async def create_result(conn: asyncpg.connection, result: schemas.ResultsCreate)
             actionid=result.actionid,
         )
         feature_action_row = await create_feature_action(conn, feature_action_create)
-        result_row = await conn.fetchrow(
-            "INSERT INTO results (resultuuid, featureactionid, resulttypecv, variableid, unitsid,"
-            "taxonomicclassifierid, processinglevelid, resultdatetime, resultdatetimeutcoffset, validdatetime,"
-            "validdatetimeutcoffset, statuscv, sampledmediumcv, valuecount) "
-            "VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14) returning *",
+        result_row = await prepared_statements.fetchrow(
+            conn,
+            "insert_result",
             result.resultuuid,
             feature_action_row.featureactionid,
             result.resulttypecv,
@@ -359,8 +534,150 @@ async def create_result(conn: asyncpg.connection, result: schemas.ResultsCreate)
     return schemas.Results(dataqualitycodes=result.dataqualitycodes, **{**result_row, **dict(feature_action_row)})
 
 
-async def upsert_track_result(conn: asyncpg.connection, track_result: schemas.TrackResultsCreate):
-    await shapely_postgres_adapter.set_shapely_adapter(conn)
+def parse_row_count(status: str) -> int:
+    """Extracts the affected row count from a command status like 'INSERT 0 42'"""
+    return int(status.split()[-1])
+
+
+async def copy_upsert_track_result_locations(conn: asyncpg.connection, samplingfeatureid: int, locations) -> int:
+    """
+    Streams track locations via COPY into a temporary staging table and merges them into trackresultlocations with
+    a single upsert. When a valuedatetime occurs several times in the payload the last one wins, as with executemany.
+    """
+    await conn.execute(
+        "CREATE TEMPORARY TABLE IF NOT EXISTS trackresultlocations_staging (ordinal bigint, valuedatetime timestamp, "
+        "trackpoint geometry, qualitycodecv varchar (255)) ON COMMIT DROP"
+    )
+    await conn.execute("TRUNCATE trackresultlocations_staging")
+    await conn.copy_records_to_table(
+        "trackresultlocations_staging",
+        records=(
+            (ordinal, rec[0], shapely.wkt.loads(f"POINT({rec[1]} {rec[2]})"), rec[3])
+            for ordinal, rec in enumerate(locations)
+        ),
+        columns=["ordinal", "valuedatetime", "trackpoint", "qualitycodecv"],
+    )
+    status = await conn.execute(
+        "INSERT INTO trackresultlocations (valuedatetime, trackpoint, qualitycodecv, samplingfeatureid) "
+        "SELECT DISTINCT ON (valuedatetime) valuedatetime, ST_SetSRID(trackpoint, 4326), qualitycodecv, $1 "
+        "FROM trackresultlocations_staging ORDER BY valuedatetime, ordinal DESC "
+        "ON CONFLICT (valuedatetime, samplingfeatureid) DO UPDATE SET "
+        "trackpoint = excluded.trackpoint, qualitycodecv = excluded.qualitycodecv",
+        samplingfeatureid,
+    )
+    return parse_row_count(status)
+
+
+async def copy_upsert_track_result_values(conn: asyncpg.connection, resultid: int, values) -> int:
+    """
+    Streams track values via COPY into a temporary staging table and merges them into trackresultvalues with a single
+    upsert. When a valuedatetime occurs several times in the payload the last one wins, as with executemany.
+    """
+    await conn.execute(
+        "CREATE TEMPORARY TABLE IF NOT EXISTS trackresultvalues_staging (ordinal bigint, valuedatetime timestamp, "
+        "datavalue double precision, qualitycodecv varchar (255)) ON COMMIT DROP"
+    )
+    await conn.execute("TRUNCATE trackresultvalues_staging")
+    await conn.copy_records_to_table(
+        "trackresultvalues_staging",
+        records=((ordinal, rec[0], rec[1], rec[2]) for ordinal, rec in enumerate(values)),
+        columns=["ordinal", "valuedatetime", "datavalue", "qualitycodecv"],
+    )
+    status = await conn.execute(
+        "INSERT INTO trackresultvalues (valuedatetime, datavalue, qualitycodecv, resultid) "
+        "SELECT DISTINCT ON (valuedatetime) valuedatetime, datavalue, qualitycodecv, $1 "
+        "FROM trackresultvalues_staging ORDER BY valuedatetime, ordinal DESC "
+        "ON CONFLICT (valuedatetime, resultid) DO UPDATE SET "
+        "datavalue = excluded.datavalue, qualitycodecv = excluded.qualitycodecv",
+        resultid,
+    )
+    return parse_row_count(status)
+
+
+async def create_results(conn: asyncpg.connection, results: List[schemas.ResultsCreate]) -> List[schemas.Results]:
+    """
+    Batch version of create_result. Creates one feature action per distinct sampling feature and action, and inserts
+    all results with multi-row statements. Returns the stored results in the same order as the input.
+    """
+    result_columns = [
+        "resultuuid",
+        "resulttypecv",
+        "variableid",
+        "unitsid",
+        "taxonomicclassifierid",
+        "processinglevelid",
+        "resultdatetime",
+        "resultdatetimeutcoffset",
+        "validdatetime",
+        "validdatetimeutcoffset",
+        "statuscv",
+        "sampledmediumcv",
+        "valuecount",
+    ]
+    async with conn.transaction():
+        feature_actions = {}
+        for result in results:
+            key = (result.samplingfeatureuuid, result.samplingfeaturecode, result.actionid)
+            if key not in feature_actions:
+                feature_actions[key] = await create_feature_action(
+                    conn,
+                    schemas.FeatureActionsCreate(
+                        samplingfeatureuuid=result.samplingfeatureuuid,
+                        samplingfeaturecode=result.samplingfeaturecode,
+                        actionid=result.actionid,
+                    ),
+                )
+        result_rows = await insert_many(
+            conn,
+            "results",
+            [
+                {
+                    "featureactionid": feature_actions[
+                        (r.samplingfeatureuuid, r.samplingfeaturecode, r.actionid)
+                    ].featureactionid,
+                    **{column: getattr(r, column) for column in result_columns},
+                }
+                for r in results
+            ],
+        )
+        rows_by_uuid = {row["resultuuid"]: row for row in result_rows}
+
+        stored = []
+        for result in results:
+            result_row = rows_by_uuid[result.resultuuid]
+            feature_action_row = feature_actions[
+                (result.samplingfeatureuuid, result.samplingfeaturecode, result.actionid)
+            ]
+            for data_quality_code in result.dataqualitycodes:
+                await create_result_data_quality(
+                    conn,
+                    schemas.ResultsDataQualityCreate(
+                        resultid=result_row["resultid"], dataqualitycode=data_quality_code
+                    ),
+                )
+            for annotation_id in await create_or_parse_annotations(conn, result.annotations):
+                await conn.fetchrow(
+                    "INSERT INTO resultannotations (resultid, annotationid, begindatetime, enddatetime) "
+                    "Values ($1, $2, $3, $4) returning *",
+                    result_row["resultid"],
+                    annotation_id,
+                    result.resultdatetime,
+                    result.validdatetime,
+                )
+            stored.append(
+                schemas.Results(dataqualitycodes=result.dataqualitycodes, **{**result_row, **dict(feature_action_row)})
+            )
+    return stored
+
+
+async def upsert_track_result(conn: asyncpg.connection, track_result: schemas.TrackResultsCreate, bulk: bool = False):
+    """
+    Upserts a track result with its values and locations. With bulk=True the values and locations are loaded with COPY
+    and merged set-based, which is much faster for large payloads. The report then counts distinct rows written.
+    """
+    await shapely_postgres_adapter.ensure_shapely_adapter(conn)
+    inserted_values = len(track_result.track_result_values)
+    inserted_locations = len(track_result.track_result_locations)
     async with conn.transaction():
         row = await conn.fetchrow(
             "SELECT samplingfeatureid FROM featureactions WHERE featureactionid = "
@@ -380,7 +697,11 @@ async def upsert_track_result(conn: asyncpg.connection, track_result: schemas.Tr
             track_result.aggregationstatisticcv,
         )
 
-        if track_result.track_result_locations:
+        if track_result.track_result_locations and bulk:
+            inserted_locations = await copy_upsert_track_result_locations(
+                conn, track_result.samplingfeatureid, track_result.track_result_locations
+            )
+        elif track_result.track_result_locations:
             location_records = (
                 (rec[0], shapely.wkt.loads(f"POINT({rec[1]} {rec[2]})"), rec[3], track_result.samplingfeatureid)
                 for rec in track_result.track_result_locations
@@ -392,11 +713,12 @@ async def upsert_track_result(conn: asyncpg.connection, track_result: schemas.Tr
                 "trackpoint = excluded.trackpoint, qualitycodecv = excluded.qualitycodecv",
                 location_records,
             )
-            # result = await conn.copy_records_to_table(table_name='trackresultlocations',
-            #                                           records=location_records, schema_name='odm2')
-            # logging.info(result)
 
-        if track_result.track_result_values:
+        if track_result.track_result_values and bulk:
+            inserted_values = await copy_upsert_track_result_values(
+                conn, track_result.resultid, track_result.track_result_values
+            )
+        elif track_result.track_result_values:
             value_records = (
                 (rec[0], rec[1], rec[2], track_result.resultid) for rec in track_result.track_result_values
             )
@@ -406,18 +728,440 @@ async def upsert_track_result(conn: asyncpg.connection, track_result: schemas.Tr
                 "datavalue = excluded.datavalue, qualitycodecv = excluded.qualitycodecv",
                 value_records,
             )
-            # result = await conn.copy_records_to_table(table_name='trackresultvalues',
-            #                                           records=records, schema_name='odm2')
-            # logging.info(result)
 
     return schemas.TrackResultsReport(
         samplingfeatureid=track_result.samplingfeatureid,
-        inserted_track_result_values=len(track_result.track_result_values),
-        inserted_track_result_locations=len(track_result.track_result_locations),
+        inserted_track_result_values=inserted_values,
+        inserted_track_result_locations=inserted_locations,
         **row,
     )
 
 
+def downsample_bucket(
+    begin: dt.datetime, end: dt.datetime, max_points: int, bucket: Optional[dt.timedelta] = None
+) -> dt.timedelta:
+    """
+    Returns the time_bucket width to use for the window [begin, end). A requested bucket is widened when it would give
+    more than max_points buckets, and is never narrower than one second.
+    """
+    smallest_bucket = max((end - begin) / max_points, dt.timedelta(seconds=1))
+    if bucket is None or bucket < smallest_bucket:
+        return smallest_bucket
+    return bucket
+
+
+async def find_result_values_downsampled(
+    conn: asyncpg.connection,
+    table: str,
+    resultid: int,
+    begin: dt.datetime,
+    end: dt.datetime,
+    max_points: int,
+    bucket: Optional[dt.timedelta] = None,
+) -> schemas.ResultValuesDownsampled:
+    """Aggregates the values of a result in the hypertable '<table>' into time buckets, see downsample_bucket"""
+    if end <= begin:
+        raise HTTPException(status_code=422, detail="'end' must be after 'begin'")
+    bucket = downsample_bucket(begin, end, max_points, bucket)
+    rows = await conn.fetch(
+        "SELECT time_bucket($1::interval, valuedatetime) AS valuedatetime, avg(datavalue) AS datavalue, "
+        f"min(datavalue) AS minimum, max(datavalue) AS maximum, count(*) AS valuecount FROM {table} "
+        "WHERE resultid = $2 AND valuedatetime >= $3 AND valuedatetime < $4 "
+        "GROUP BY 1 ORDER BY 1",
+        bucket,
+        resultid,
+        begin,
+        end,
+    )
+    return schemas.ResultValuesDownsampled(
+        resultid=resultid,
+        begin=begin,
+        end=end,
+        bucket=bucket,
+        source=table,
+        values=[schemas.ResultValuesBucket(**row) for row in rows],
+    )
+
+
+def track_result_aggregate(bucket: dt.timedelta) -> Optional[str]:
+    """Returns the coarsest continuous aggregate of trackresultvalues that fits in bucket, None for raw data"""
+    for view, aggregate_bucket in TRACK_RESULT_AGGREGATES.items():
+        if bucket >= aggregate_bucket:
+            return view
+    return None
+
+
+async def find_track_result_values(
+    conn: asyncpg.connection,
+    resultid: int,
+    begin: dt.datetime,
+    end: dt.datetime,
+    max_points: int,
+    bucket: Optional[dt.timedelta] = None,
+) -> schemas.ResultValuesDownsampled:
+    """
+    Like find_result_values_downsampled, but buckets of an hour or more are combined from the hourly or daily
+    continuous aggregate instead of scanning the raw values. The bucket is then rounded up to whole hours or days, and
+    holds the aggregate buckets starting in [begin, end).
+    """
+    if end <= begin:
+        raise HTTPException(status_code=422, detail="'end' must be after 'begin'")
+    view = track_result_aggregate(downsample_bucket(begin, end, max_points, bucket))
+    if view is None:
+        return await find_result_values_downsampled(
+            conn, "trackresultvalues", resultid, begin, end, max_points, bucket
+        )
+
+    width = TRACK_RESULT_AGGREGATES[view]
+    bucket = math.ceil(downsample_bucket(begin, end, max_points, bucket) / width) * width
+    rows = await conn.fetch(
+        "SELECT time_bucket($1::interval, valuedatetime) AS valuedatetime, "
+        "sum(datavalue * valuecount) / sum(valuecount) AS datavalue, min(minimum) AS minimum, "
+        f"max(maximum) AS maximum, sum(valuecount)::bigint AS valuecount FROM {view} "
+        "WHERE resultid = $2 AND valuedatetime >= $3 AND valuedatetime < $4 "
+        "GROUP BY 1 ORDER BY 1",
+        bucket,
+        resultid,
+        begin,
+        end,
+    )
+    return schemas.ResultValuesDownsampled(
+        resultid=resultid,
+        begin=begin,
+        end=end,
+        bucket=bucket,
+        source=view,
+        values=[schemas.ResultValuesBucket(**row) for row in rows],
+    )
+
+
+async def find_time_series_result_values(
+    conn: asyncpg.connection,
+    resultid: int,
+    begin: dt.datetime,
+    end: dt.datetime,
+    max_points: int,
+    bucket: Optional[dt.timedelta] = None,
+) -> schemas.ResultValuesDownsampled:
+    return await find_result_values_downsampled(
+        conn, "timeseriesresultvalues", resultid, begin, end, max_points, bucket
+    )
+
+
+async def upsert_time_series_result(
+    conn: asyncpg.connection, time_series_result: schemas.TimeSeriesResultsCreate
+) -> schemas.TimeSeriesResults:
+    data = time_series_result.dict()
+    updates = ", ".join(f"{column} = EXCLUDED.{column}" for column in data if column != "resultid")
+    row = await conn.fetchrow(
+        f"INSERT INTO timeseriesresults ({', '.join(data)}) VALUES ({argument_placeholder(data)}) "
+        f"ON CONFLICT (resultid) DO UPDATE SET {updates} returning *",
+        *data.values(),
+    )
+    return schemas.TimeSeriesResults(**row)
+
+
+async def copy_upsert_time_series_result_values(
+    conn: asyncpg.connection, resultid: int, values: schemas.TimeSeriesResultValuesCreate
+) -> schemas.TimeSeriesResultValuesReport:
+    """
+    Streams time series values via COPY into a temporary staging table and merges them into the
+    timeseriesresultvalues hypertable with a single upsert. When a valuedatetime occurs several times in the payload
+    the last one wins.
+    """
+    async with conn.transaction():
+        if await conn.fetchval("SELECT resultid FROM timeseriesresults WHERE resultid = $1", resultid) is None:
+            raise HTTPException(status_code=404, detail=f"Time series result {resultid} does not exist")
+        await conn.execute(
+            "CREATE TEMPORARY TABLE IF NOT EXISTS timeseriesresultvalues_staging (ordinal bigint, "
+            "valuedatetime timestamp, datavalue double precision, qualitycodecv varchar (255)) ON COMMIT DROP"
+        )
+        await conn.execute("TRUNCATE timeseriesresultvalues_staging")
+        await conn.copy_records_to_table(
+            "timeseriesresultvalues_staging",
+            records=(
+                (ordinal, rec[0], rec[1], rec[2]) for ordinal, rec in enumerate(values.time_series_result_values)
+            ),
+            columns=["ordinal", "valuedatetime", "datavalue", "qualitycodecv"],
+        )
+        status = await conn.execute(
+            "INSERT INTO timeseriesresultvalues (valuedatetime, datavalue, qualitycodecv, resultid, "
+            "valuedatetimeutcoffset, censorcodecv, timeaggregationinterval, timeaggregationintervalunitsid) "
+            "SELECT DISTINCT ON (valuedatetime) valuedatetime, datavalue, qualitycodecv, $1, $2, $3, $4, $5 "
+            "FROM timeseriesresultvalues_staging ORDER BY valuedatetime, ordinal DESC "
+            "ON CONFLICT (valuedatetime, resultid) DO UPDATE SET datavalue = excluded.datavalue, "
+            "qualitycodecv = excluded.qualitycodecv, valuedatetimeutcoffset = excluded.valuedatetimeutcoffset, "
+            "censorcodecv = excluded.censorcodecv, timeaggregationinterval = excluded.timeaggregationinterval, "
+            "timeaggregationintervalunitsid = excluded.timeaggregationintervalunitsid",
+            resultid,
+            values.valuedatetimeutcoffset,
+            values.censorcodecv,
+            values.timeaggregationinterval,
+            values.timeaggregationintervalunitsid,
+        )
+    return schemas.TimeSeriesResultValuesReport(
+        resultid=resultid, upserted_time_series_result_values=parse_row_count(status)
+    )
+
+
+RESULT_VALUE_KEYS = ["datavalue", "valuedatetime", "valuedatetimeutcoffset"]
+
+
+async def insert_result_values(conn: asyncpg.connection, table: str, result_values: List) -> List[asyncpg.Record]:
+    """
+    Inserts a list of MeasurementResultsCreate or CategoricalResultsCreate into '<table>' and '<table>values' with one
+    multi-row statement each. Returns the inserted value rows.
+    """
+    results_data = [{k: v for k, v in r if k not in RESULT_VALUE_KEYS} for r in result_values]
+    values_data = [{k: v for k, v in r if k in RESULT_VALUE_KEYS or k == "resultid"} for r in result_values]
+    async with conn.transaction():
+        await insert_many(conn, table, results_data)
+        return await insert_many(conn, f"{table}values", values_data)
+
+
+async def insert_measurement_results(
+    conn: asyncpg.connection, measurement_results: List[schemas.MeasurementResultsCreate]
+) -> List[asyncpg.Record]:
+    return await insert_result_values(conn, "measurementresults", measurement_results)
+
+
+async def insert_categorical_results(
+    conn: asyncpg.connection, categorical_results: List[schemas.CategoricalResultsCreate]
+) -> List[asyncpg.Record]:
+    return await insert_result_values(conn, "categoricalresults", categorical_results)
+
+
+def result_values_batch_report(
+    items: List, valueids: Dict[int, int], timings_ms: Dict[str, float], failures: Optional[Dict[int, str]] = None
+) -> schemas.ResultValuesBatchReport:
+    """
+    Status per item of a batch. valueids maps the resultids stored by the batch to their new valueid, failures maps
+    the index of items that could not be stored to the error
+    """
+    failures = failures or {}
+    seen, claimed = set(), set()
+    report_items = []
+    for index, item in enumerate(items):
+        if index in failures:
+            status, detail = "failed", failures[index]
+        elif item.resultid in valueids and item.resultid not in claimed:
+            status, detail = "created", None
+            claimed.add(item.resultid)
+        elif item.resultid in seen:
+            status, detail = "skipped", "resultid occurs earlier in the batch"
+        else:
+            status, detail = "skipped", "resultid already has a result value"
+        seen.add(item.resultid)
+        report_items.append(
+            schemas.ResultValuesBatchItem(
+                index=index,
+                resultid=item.resultid,
+                status=status,
+                valueid=valueids.get(item.resultid) if status == "created" else None,
+                detail=detail,
+            )
+        )
+    return schemas.ResultValuesBatchReport(
+        created=sum(i.status == "created" for i in report_items),
+        skipped=sum(i.status == "skipped" for i in report_items),
+        failed=len(failures),
+        items=report_items,
+        timings_ms=timings_ms,
+    )
+
+
+async def _copy_measurement_result_items(
+    conn: asyncpg.connection, measurement_results: List[schemas.MeasurementResultsCreate], timer: StageTimer
+) -> Dict[int, int]:
+    result_columns = [c for c in schemas.MeasurementResultsCreate.__fields__ if c not in RESULT_VALUE_KEYS]
+    staging_columns = ["ordinal", *result_columns, *RESULT_VALUE_KEYS]
+    await conn.execute(
+        "CREATE TEMPORARY TABLE IF NOT EXISTS measurementresults_staging (ordinal integer, LIKE measurementresults, "
+        "datavalue double precision, valuedatetime timestamp, valuedatetimeutcoffset integer) ON COMMIT DROP"
+    )
+    await conn.execute("TRUNCATE measurementresults_staging")
+    await conn.copy_records_to_table(
+        "measurementresults_staging",
+        records=[
+            (ordinal, *(getattr(m, c) for c in staging_columns[1:])) for ordinal, m in enumerate(measurement_results)
+        ],
+        columns=staging_columns,
+    )
+    timer.lap("copy")
+
+    columns = ", ".join(result_columns)
+    inserted = await conn.fetch(
+        f"INSERT INTO measurementresults ({columns}) SELECT DISTINCT ON (resultid) {columns} "
+        f"FROM measurementresults_staging ORDER BY resultid, ordinal "
+        f"ON CONFLICT (resultid) DO NOTHING returning resultid"
+    )
+    timer.lap("insert_results")
+
+    values = await conn.fetch(
+        "INSERT INTO measurementresultvalues (resultid, datavalue, valuedatetime, valuedatetimeutcoffset) "
+        "SELECT DISTINCT ON (resultid) resultid, datavalue, valuedatetime, valuedatetimeutcoffset "
+        "FROM measurementresults_staging WHERE resultid = ANY($1::bigint[]) ORDER BY resultid, ordinal "
+        "ON CONFLICT DO NOTHING returning resultid, valueid",
+        [r["resultid"] for r in inserted],
+    )
+    timer.lap("insert_values")
+    return {r["resultid"]: r["valueid"] for r in values}
+
+
+async def copy_measurement_results(
+    conn: asyncpg.connection, measurement_results: List[schemas.MeasurementResultsCreate]
+) -> schemas.ResultValuesBatchReport:
+    """
+    Batch version of upsert_measurement_result. Streams all items via COPY into a temporary staging table and merges
+    them with one statement per table, in one transaction. Items are skipped when their resultid already has a
+    measurement result or occurs earlier in the batch. If the batch fails on bad data, the items are retried one by
+    one in savepoints so that only the offending items fail and the rest are stored.
+    """
+    timer = StageTimer()
+    failures: Dict[int, str] = {}
+    async with conn.transaction():
+        try:
+            async with conn.transaction():
+                valueids = await _copy_measurement_result_items(conn, measurement_results, timer)
+        except (asyncpg.exceptions.IntegrityConstraintViolationError, asyncpg.exceptions.DataError) as e:
+            timer.lap("batch")
+            logging.info("Measurement results batch failed, retrying item by item", extra={"error": str(e)})
+            valueids = {}
+            for index, measurement_result in enumerate(measurement_results):
+                try:
+                    async with conn.transaction():
+                        valueids.update(await _copy_measurement_result_items(conn, [measurement_result], StageTimer()))
+                except (asyncpg.exceptions.IntegrityConstraintViolationError, asyncpg.exceptions.DataError) as e:
+                    failures[index] = str(e)
+            timer.lap("insert_item_by_item")
+    return result_values_batch_report(measurement_results, valueids, timer.total(), failures)
+
+
+CATEGORICAL_RESULT_COLUMN_TYPES = {
+    "resultid": "bigint",
+    "xlocation": "double precision",
+    "xlocationunitsid": "integer",
+    "ylocation": "double precision",
+    "ylocationunitsid": "integer",
+    "zlocation": "double precision",
+    "zlocationunitsid": "integer",
+    "spatialreferenceid": "integer",
+    "qualitycodecv": "varchar",
+}
+CATEGORICAL_RESULT_VALUE_COLUMN_TYPES = {
+    "datavalue": "varchar",
+    "valuedatetime": "timestamp",
+    "valuedatetimeutcoffset": "integer",
+}
+
+
+def _make_insert_categorical_results_query() -> str:
+    result_columns = ", ".join(CATEGORICAL_RESULT_COLUMN_TYPES)
+    result_arrays = ", ".join(f"${n + 1}::{t}[]" for n, t in enumerate(CATEGORICAL_RESULT_COLUMN_TYPES.values()))
+    value_columns = ", ".join(CATEGORICAL_RESULT_VALUE_COLUMN_TYPES)
+    qualified_value_columns = ", ".join(f"v.{c}" for c in CATEGORICAL_RESULT_VALUE_COLUMN_TYPES)
+    value_arrays = ", ".join(
+        f"${len(CATEGORICAL_RESULT_COLUMN_TYPES) + n + 1}::{t}[]"
+        for n, t in enumerate(CATEGORICAL_RESULT_VALUE_COLUMN_TYPES.values())
+    )
+    # the first occurrence of a resultid wins, values are only stored for results created by this statement
+    return (
+        f"WITH new_results AS (INSERT INTO categoricalresults ({result_columns}) "
+        f"SELECT DISTINCT ON (resultid) {result_columns} FROM unnest({result_arrays}) WITH ORDINALITY "
+        f"AS r({result_columns}, ordinal) ORDER BY resultid, ordinal "
+        f"ON CONFLICT (resultid) DO NOTHING returning resultid) "
+        f"INSERT INTO categoricalresultvalues (resultid, {value_columns}) "
+        f"SELECT DISTINCT ON (v.resultid) v.resultid, {qualified_value_columns} "
+        f"FROM unnest($1::bigint[], {value_arrays}) WITH ORDINALITY AS v(resultid, {value_columns}, ordinal) "
+        f"JOIN new_results USING (resultid) ORDER BY v.resultid, v.ordinal "
+        f"ON CONFLICT DO NOTHING returning resultid, valueid"
+    )
+
+
+INSERT_CATEGORICAL_RESULTS_QUERY = _make_insert_categorical_results_query()
+
+
+async def _insert_categorical_result_arrays(
+    conn: asyncpg.connection, categorical_results: List[schemas.CategoricalResultsCreate]
+) -> Dict[int, int]:
+    columns = [*CATEGORICAL_RESULT_COLUMN_TYPES, *CATEGORICAL_RESULT_VALUE_COLUMN_TYPES]
+    arrays = [[getattr(c, column) for c in categorical_results] for column in columns]
+    rows = await conn.fetch(INSERT_CATEGORICAL_RESULTS_QUERY, *arrays)
+    return {row["resultid"]: row["valueid"] for row in rows}
+
+
+async def insert_categorical_results_batch(
+    conn: asyncpg.connection, categorical_results: List[schemas.CategoricalResultsCreate]
+) -> schemas.ResultValuesBatchReport:
+    """
+    Batch version of upsert_categorical_result, writing categoricalresults and categoricalresultvalues with one
+    array based statement. If that fails on bad data, the items are retried one by one in savepoints so that only
+    the offending items fail and the rest are stored.
+    """
+    timer = StageTimer()
+    failures: Dict[int, str] = {}
+    async with conn.transaction():
+        try:
+            async with conn.transaction():
+                valueids = await _insert_categorical_result_arrays(conn, categorical_results)
+            timer.lap("insert")
+        except (asyncpg.exceptions.IntegrityConstraintViolationError, asyncpg.exceptions.DataError) as e:
+            timer.lap("insert")
+            logging.info("Categorical results batch failed, retrying item by item", extra={"error": str(e)})
+            valueids = {}
+            for index, categorical_result in enumerate(categorical_results):
+                try:
+                    async with conn.transaction():
+                        valueids.update(await _insert_categorical_result_arrays(conn, [categorical_result]))
+                except (asyncpg.exceptions.IntegrityConstraintViolationError, asyncpg.exceptions.DataError) as e:
+                    failures[index] = str(e)
+            timer.lap("insert_item_by_item")
+    return result_values_batch_report(categorical_results, valueids, timer.total(), failures)
+
+
+async def create_action_with_results(
+    conn: asyncpg.connection, document: schemas.ActionWithResultsCreate
+) -> schemas.ActionWithResults:
+    """
+    Stores an action, its results and their measurement or categorical values in one transaction. Replaces separate
+    calls to /actions, /results and /measurement_results or /categorical_results per datum.
+    """
+    async with conn.transaction():
+        action = await do_action(conn, document.action)
+        results = await create_results(
+            conn,
+            [
+                schemas.ResultsCreate(
+                    **{**r.dict(exclude={"measurement_value", "categorical_value"}), "actionid": action.actionid}
+                )
+                for r in document.results
+            ],
+        )
+        measurement_values, categorical_values = [], []
+        for result, stored in zip(document.results, results):
+            if result.measurement_value:
+                measurement_values.append(
+                    schemas.MeasurementResultsCreate(
+                        **{**result.measurement_value.dict(), "resultid": stored.resultid}
+                    )
+                )
+            if result.categorical_value:
+                categorical_values.append(
+                    schemas.CategoricalResultsCreate(
+                        **{**result.categorical_value.dict(), "resultid": stored.resultid}
+                    )
+                )
+        value_rows = [
+            *await insert_measurement_results(conn, measurement_values),
+            *await insert_categorical_results(conn, categorical_values),
+        ]
+    valueids = {row["resultid"]: row["valueid"] for row in value_rows}
+    return schemas.ActionWithResults(
+        action=action,
+        results=[schemas.ActionResult(valueid=valueids.get(r.resultid), **r.dict()) for r in results],
+    )
+
+
 async def upsert_measurement_result(conn: asyncpg.connection, measurement_result: schemas.MeasurementResultsCreate):
     async with conn.transaction():
         value_keys = ["datavalue", "valuedatetime", "valuedatetimeutcoffset"]
@@ -465,3 +1209,32 @@ async def find_or_create_sampling_feature(conn, code: str, sf_type: str, wkt: st
     )
 
     return await create_sampling_feature(conn, sampling_feature=new_sf)
+
+
+async def find_sampling_features_by_codes(conn: asyncpg.connection, codes: List[str]) -> Dict[str, SamplingFeatures]:
+    rows = await conn.fetch(
+        "SELECT * FROM samplingfeatures WHERE samplingfeaturecode = ANY($1::varchar[])", list(set(codes))
+    )
+    return {row["samplingfeaturecode"]: SamplingFeatures(**row) for row in rows}
+
+
+async def find_or_create_sampling_features(
+    conn: asyncpg.connection, codes: List[str], sf_type: str
+) -> Dict[str, SamplingFeatures]:
+    """Batch version of find_or_create_sampling_feature for sampling features without geometry, keyed by code"""
+    sampling_features = await find_sampling_features_by_codes(conn, codes)
+    new_sampling_features = [
+        SamplingFeaturesCreate(samplingfeatureuuid=uuid4(), samplingfeaturetypecv=sf_type, samplingfeaturecode=code)
+        for code in dict.fromkeys(codes)
+        if code not in sampling_features
+    ]
+    rows = await insert_many(
+        conn,
+        "samplingfeatures",
+        [
+            sf.dict(include={"samplingfeatureuuid", "samplingfeaturetypecv", "samplingfeaturecode"})
+            for sf in new_sampling_features
+        ],
+    )
+    sampling_features.update({row["samplingfeaturecode"]: SamplingFeatures(**row) for row in rows})
+    return sampling_features
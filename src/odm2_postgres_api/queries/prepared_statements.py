@@ -0,0 +1,70 @@
+"""
+Registry of named statements used on the hot paths of core_queries.
+
+Connections created with connection_class=PreparedStatementConnection prepare all statements once, in the pool init
+hook. Other connections (tests, scripts) fall back to running the query text, which still uses asyncpg's statement
+cache.
+"""
+from typing import Dict
+
+import asyncpg
+from asyncpg.prepared_stmt import PreparedStatement
+from prometheus_client import Counter
+
+STATEMENTS = {
+    "insert_action": "INSERT INTO actions (actiontypecv, methodid, begindatetime, begindatetimeutcoffset, "
+    "enddatetime, enddatetimeutcoffset, actiondescription, actionfilelink) "
+    "VALUES ($1, $2, $3, $4, $5, $6, $7, $8) returning *",
+    "insert_action_by": "INSERT INTO actionby (actionid, affiliationid, isactionlead, roledescription) "
+    "VALUES ($1, $2, $3, $4) returning *",
+    "insert_feature_action_by_uuid_and_code": "INSERT INTO featureactions (samplingfeatureid, actionid) "
+    "VALUES ((SELECT samplingfeatureid FROM samplingfeatures "
+    "where samplingfeatureuuid = $1 AND samplingfeaturecode = $2), $3) "
+    "ON CONFLICT (samplingfeatureid, actionid) DO UPDATE SET actionid = EXCLUDED.actionid returning *",
+    "insert_feature_action_by_uuid_or_code": "INSERT INTO featureactions (samplingfeatureid, actionid) "
+    "VALUES ((SELECT samplingfeatureid FROM samplingfeatures "
+    "where samplingfeatureuuid = $1 OR samplingfeaturecode = $2), $3) "
+    "ON CONFLICT (samplingfeatureid, actionid) DO UPDATE SET actionid = EXCLUDED.actionid returning *",
+    "insert_result": "INSERT INTO results (resultuuid, featureactionid, resulttypecv, variableid, unitsid,"
+    "taxonomicclassifierid, processinglevelid, resultdatetime, resultdatetimeutcoffset, validdatetime,"
+    "validdatetimeutcoffset, statuscv, sampledmediumcv, valuecount) "
+    "VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14) returning *",
+    "insert_sampling_feature": "INSERT INTO samplingfeatures (samplingfeatureuuid, samplingfeaturetypecv, "
+    "samplingfeaturecode, samplingfeaturename, samplingfeaturedescription, samplingfeaturegeotypecv, featuregeometry, "
+    "featuregeometrywkt, elevation_m, elevationdatumcv) "
+    "VALUES ($1, $2, $3, $4, $5, $6, ST_SetSRID($7::geometry, 4326), $8, $9, $10) returning *",
+}
+
+# hit rate = hit / (hit + miss). 'unprepared' counts lookups on connections without a registry
+STATEMENT_LOOKUPS = Counter(
+    "odm2_prepared_statement_lookups_total", "Lookups in the prepared statement registry", ["statement", "result"]
+)
+
+
+class PreparedStatementConnection(asyncpg.Connection):
+    """asyncpg connection holding its prepared statements from STATEMENTS, keyed by name"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared_statements: Dict[str, PreparedStatement] = {}
+
+
+async def prepare_statements(conn: PreparedStatementConnection):
+    for name, query in STATEMENTS.items():
+        conn.prepared_statements[name] = await conn.prepare(query)
+
+
+async def fetchrow(conn, name: str, *args):
+    """Runs the registered statement 'name' on conn and returns the first row"""
+    prepared = getattr(conn, "prepared_statements", None)
+    if prepared is None:
+        STATEMENT_LOOKUPS.labels(statement=name, result="unprepared").inc()
+        return await conn.fetchrow(STATEMENTS[name], *args)
+
+    statement = prepared.get(name)
+    if statement is None:
+        STATEMENT_LOOKUPS.labels(statement=name, result="miss").inc()
+        statement = prepared[name] = await conn.prepare(STATEMENTS[name])
+    else:
+        STATEMENT_LOOKUPS.labels(statement=name, result="hit").inc()
+    return await statement.fetchrow(*args)
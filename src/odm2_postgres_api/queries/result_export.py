@@ -0,0 +1,208 @@
+import csv
+import datetime as dt
+import io
+import json
+import os
+from typing import AsyncIterator, Callable, Iterable, List, Optional
+
+import asyncpg
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:  # optional, pip install odm2-postgres-api[arrow]
+    pyarrow = None
+
+# rows fetched per round trip from the server side cursor, and rows per chunk written to the response
+EXPORT_PREFETCH = int(os.environ.get("RESULT_EXPORT_PREFETCH", 1000))
+
+RESULT_EXPORT_COLUMNS = [
+    "resultid",
+    "resultuuid",
+    "resulttypecv",
+    "samplingfeaturecode",
+    "actionid",
+    "variablecode",
+    "unitsabbreviation",
+    "valuedatetime",
+    "valuedatetimeutcoffset",
+    "datavalue",
+    "categoricalvalue",
+    "qualitycodecv",
+]
+
+# $1 samplingfeaturecode, $2 directiveid, either may be null. $3 begin and $4 end of the time window
+RESULT_EXPORT_QUERY = (
+    "SELECT r.resultid, r.resultuuid, r.resulttypecv, sf.samplingfeaturecode, fa.actionid, v.variablecode, "
+    "u.unitsabbreviation, vals.valuedatetime, vals.valuedatetimeutcoffset, vals.datavalue, vals.categoricalvalue, "
+    "vals.qualitycodecv "
+    "FROM results r "
+    "JOIN featureactions fa ON fa.featureactionid = r.featureactionid "
+    "JOIN samplingfeatures sf ON sf.samplingfeatureid = fa.samplingfeatureid "
+    "JOIN variables v ON v.variableid = r.variableid "
+    "JOIN units u ON u.unitsid = r.unitsid "
+    "JOIN LATERAL ("
+    "SELECT m.valuedatetime, m.valuedatetimeutcoffset, m.datavalue, NULL::varchar AS categoricalvalue, "
+    "NULL::varchar AS qualitycodecv FROM measurementresultvalues m "
+    "WHERE m.resultid = r.resultid AND m.valuedatetime >= $3 AND m.valuedatetime < $4 "
+    "UNION ALL "
+    "SELECT c.valuedatetime, c.valuedatetimeutcoffset, NULL, c.datavalue, NULL FROM categoricalresultvalues c "
+    "WHERE c.resultid = r.resultid AND c.valuedatetime >= $3 AND c.valuedatetime < $4 "
+    "UNION ALL "
+    "SELECT t.valuedatetime, NULL, t.datavalue, NULL, t.qualitycodecv FROM trackresultvalues t "
+    "WHERE t.resultid = r.resultid AND t.valuedatetime >= $3 AND t.valuedatetime < $4"
+    ") vals ON true "
+    "WHERE ($1::varchar IS NULL OR sf.samplingfeaturecode = $1) "
+    "AND ($2::integer IS NULL OR EXISTS "
+    "(SELECT 1 FROM actiondirectives ad WHERE ad.actionid = fa.actionid AND ad.directiveid = $2)) "
+    "ORDER BY r.resultid, vals.valuedatetime"
+)
+
+
+async def stream_result_values(
+    conn: asyncpg.connection,
+    samplingfeaturecode: Optional[str],
+    directiveid: Optional[int],
+    begin: dt.datetime,
+    end: dt.datetime,
+) -> AsyncIterator[asyncpg.Record]:
+    """
+    Yields result values of a sampling feature and/or directive within [begin, end) from a server side cursor, so
+    memory use does not depend on the size of the export
+    """
+    # cursors only live inside a transaction
+    async with conn.transaction():
+        cursor = conn.cursor(
+            RESULT_EXPORT_QUERY, samplingfeaturecode, directiveid, begin, end, prefetch=EXPORT_PREFETCH
+        )
+        async for record in cursor:
+            yield record
+
+
+def _json_default(value):
+    if isinstance(value, (dt.datetime, dt.date)):
+        return value.isoformat()
+    return str(value)
+
+
+def ndjson_chunk(records: Iterable) -> str:
+    return "".join(json.dumps(dict(record), default=_json_default) + "\n" for record in records)
+
+
+def csv_chunk(records: Iterable, header: bool = False) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(RESULT_EXPORT_COLUMNS)
+    writer.writerows([record[column] for column in RESULT_EXPORT_COLUMNS] for record in records)
+    return buffer.getvalue()
+
+
+async def export_result_values(records: AsyncIterator, export_format: str) -> AsyncIterator[str]:
+    """Encodes the records as ndjson or csv, in chunks of EXPORT_PREFETCH rows"""
+    encode: Callable[[List[asyncpg.Record]], str] = ndjson_chunk
+    if export_format == "csv":
+        encode = csv_chunk
+        yield csv_chunk([], header=True)
+    chunk: List[asyncpg.Record] = []
+    async for record in records:
+        chunk.append(record)
+        if len(chunk) >= EXPORT_PREFETCH:
+            yield encode(chunk)
+            chunk = []
+    if chunk:
+        yield encode(chunk)
+
+
+# rows per Arrow record batch / Parquet row group
+TRACK_EXPORT_BATCH_SIZE = int(os.environ.get("TRACK_EXPORT_BATCH_SIZE", 65536))
+
+TRACK_EXPORT_QUERY = (
+    "SELECT v.valuedatetime, v.datavalue, v.qualitycodecv, ST_Y(l.trackpoint) AS latitude, "
+    "ST_X(l.trackpoint) AS longitude, l.qualitycodecv AS locationqualitycodecv "
+    "FROM trackresultvalues v "
+    "JOIN results r ON r.resultid = v.resultid "
+    "JOIN featureactions fa ON fa.featureactionid = r.featureactionid "
+    "LEFT JOIN trackresultlocations l "
+    "ON l.samplingfeatureid = fa.samplingfeatureid AND l.valuedatetime = v.valuedatetime "
+    "WHERE v.resultid = $1 AND v.valuedatetime >= $2 AND v.valuedatetime < $3 "
+    "ORDER BY v.valuedatetime"
+)
+
+if pyarrow is not None:
+    TRACK_EXPORT_SCHEMA = pyarrow.schema(
+        [
+            ("valuedatetime", pyarrow.timestamp("us")),
+            ("datavalue", pyarrow.float64()),
+            ("qualitycodecv", pyarrow.string()),
+            ("latitude", pyarrow.float64()),
+            ("longitude", pyarrow.float64()),
+            ("locationqualitycodecv", pyarrow.string()),
+        ]
+    )
+
+
+async def stream_track_result_records(
+    conn: asyncpg.connection, resultid: int, begin: dt.datetime, end: dt.datetime
+) -> AsyncIterator[List[asyncpg.Record]]:
+    """Yields the track values of a result joined with their location, TRACK_EXPORT_BATCH_SIZE rows at a time"""
+    async with conn.transaction():
+        cursor = await conn.cursor(TRACK_EXPORT_QUERY, resultid, begin, end)
+        while True:
+            records = await cursor.fetch(TRACK_EXPORT_BATCH_SIZE)
+            if not records:
+                break
+            yield records
+
+
+def track_record_batch(records: List) -> "pyarrow.RecordBatch":
+    columns = list(zip(*records)) if records else [[] for _ in TRACK_EXPORT_SCHEMA]
+    arrays = [pyarrow.array(column, type=field.type) for column, field in zip(columns, TRACK_EXPORT_SCHEMA)]
+    return pyarrow.RecordBatch.from_arrays(arrays, names=TRACK_EXPORT_SCHEMA.names)
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file collecting what the Arrow writers produce, drained after every batch"""
+
+    def __init__(self):
+        super().__init__()
+        self.chunks: List[bytes] = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        # Parquet stores offsets, so this is the position in the whole output and not in the current chunk
+        return self.position
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+async def export_track_result_values(batches: AsyncIterator[List], export_format: str) -> AsyncIterator[bytes]:
+    """Encodes batches of records as an Arrow IPC stream or as Parquet with one zstd compressed row group per batch"""
+    sink = _ChunkSink()
+    if export_format == "parquet":
+        writer = pyarrow.parquet.ParquetWriter(sink, TRACK_EXPORT_SCHEMA, compression="zstd")
+    else:
+        writer = pyarrow.ipc.new_stream(sink, TRACK_EXPORT_SCHEMA)
+    async for records in batches:
+        batch = track_record_batch(records)
+        if export_format == "parquet":
+            writer.write_table(pyarrow.Table.from_batches([batch]))
+        else:
+            writer.write_batch(batch)
+        data = sink.drain()
+        if data:
+            yield data
+    writer.close()
+    yield sink.drain()
@@ -1,5 +1,10 @@
+from collections import defaultdict
+from typing import List
+
+from odm2_postgres_api.controlled_vocabularies.download_cvs import CONTROLLED_VOCABULARY_TABLE_NAMES
 from odm2_postgres_api.queries import core_queries
 from odm2_postgres_api.queries.core_queries import (
+    insert_missing,
     insert_pydantic_object,
     find_row,
     find_unit,
@@ -149,3 +154,52 @@ async def save_annotations(connection, annotation: AnnotationsCreate) -> Annotat
     if existing:
         return existing
     return await core_queries.create_or_parse_annotations(connection, [annotation])
+
+
+async def save_missing_controlled_vocabs(conn, controlled_vocabularies: List[ControlledVocabularyCreate]):
+    """Set-based version of save_controlled_vocab, one statement per controlled vocabulary table"""
+    rows_by_table = defaultdict(list)
+    for cv in controlled_vocabularies:
+        rows_by_table[cv.controlled_vocabulary_table_name].append(
+            cv.dict(exclude={"controlled_vocabulary_table_name"})
+        )
+    for table_name, rows in rows_by_table.items():
+        # Check against hardcoded table names otherwise this could be an SQL injection
+        if table_name not in CONTROLLED_VOCABULARY_TABLE_NAMES:
+            raise RuntimeError(f"table_name: '{table_name}' is invalid")
+        await insert_missing(conn, table_name, rows, match_columns=["term"])
+
+
+async def save_missing_methods(connection, methods: List[MethodsCreate]) -> List[Methods]:
+    """Set-based version of save_methods. Returns, with their annotations, only the methods that were stored now"""
+    annotations = {m.methodcode: m.annotations for m in methods}
+    async with connection.transaction():
+        rows = await insert_missing(connection, "methods", [m.dict(exclude={"annotations"}) for m in methods])
+        for row in rows:
+            for annotation_id in await core_queries.create_or_parse_annotations(
+                connection, annotations[row["methodcode"]]
+            ):
+                await connection.execute(
+                    "INSERT INTO methodannotations (methodid, annotationid) VALUES ($1, $2)",
+                    row["methodid"],
+                    annotation_id,
+                )
+    return [Methods(annotations=annotations[row["methodcode"]], **row) for row in rows]
+
+
+async def save_missing_sampling_features(
+    connection, sampling_features: List[SamplingFeaturesCreate]
+) -> List[SamplingFeatures]:
+    """
+    Looks up all codes in one query, new sampling features are then created one by one since they may carry
+    geometry, relations and annotations
+    """
+    existing = await core_queries.find_sampling_features_by_codes(
+        connection, [sf.samplingfeaturecode for sf in sampling_features]
+    )
+    stored = []
+    for sf in sampling_features:
+        if sf.samplingfeaturecode not in existing:
+            existing[sf.samplingfeaturecode] = await create_sampling_feature(connection, sf)
+            stored.append(existing[sf.samplingfeaturecode])
+    return stored
@@ -1,17 +1,26 @@
 import os
 import uuid
 from collections import defaultdict
-from distutils.util import strtobool
 from typing import List, cast
 
 from fastapi import Depends, Header, APIRouter
 
-from odm2_postgres_api.aquamonitor.aquamonitor_client import store_begroing_results
-from odm2_postgres_api.queries.core_queries import find_row, find_unit
+from odm2_postgres_api.aquamonitor.aquamonitor_outbox import (
+    enqueue_begroing_results,
+    find_outbox_entry,
+    outbox_status,
+    outbox_worker,
+)
+from odm2_postgres_api.queries.core_queries import (
+    find_row,
+    find_unit,
+    create_results,
+    insert_categorical_results,
+    insert_measurement_results,
+)
 from odm2_postgres_api.routes.shared_routes import (
     post_actions,
     post_results,
-    post_categorical_results,
     post_measurement_results,
 )
 from odm2_postgres_api.schemas.schemas import (
@@ -26,7 +35,7 @@ from odm2_postgres_api.schemas.schemas import (
     BasicIndexingUnit,
 )
 
-from odm2_postgres_api.utils.api_pool_manager import api_pool_manager
+from odm2_postgres_api.utils.api_pool_manager import api_pool_manager, get_read_conn
 
 from odm2_postgres_api.queries.user import create_or_get_user
 from odm2_postgres_api.schemas import schemas
@@ -98,7 +107,22 @@ async def post_begroing_result(
         ),
     }
 
+    processing_level = await find_row(
+        connection,
+        "processinglevels",
+        "processinglevelcode",
+        "0",
+        ProcessingLevels,
+        raise_if_none=True,
+    )
+    abundance_variable = await find_row(
+        connection, "variables", "variablenamecv", "Abundance", Variables, raise_if_none=True
+    )
+
     async with connection.transaction():
+        # One action per method, then all results and their values are written with multi-row statements
+        data_results: List[schemas.ResultsCreate] = []
+        result_observations = []
         for method_index, method_observations in observations_per_method.items():
             method = begroing_result.methods[method_index]
 
@@ -113,50 +137,50 @@ async def post_begroing_result(
                 directiveids=[e.directiveid for e in begroing_result.projects],
             )
 
-            processing_level = await find_row(
-                connection,
-                "processinglevels",
-                "processinglevelcode",
-                "0",
-                ProcessingLevels,
-            )
-            abundance_variable = await find_row(connection, "variables", "variablenamecv", "Abundance", Variables)
-
             completed_action = await post_actions(data_action, connection)
             for result_index in method_observations:
-
-                data_result = schemas.ResultsCreate(
-                    samplingfeatureuuid=begroing_result.station.samplingfeatureuuid,
-                    actionid=completed_action.actionid,
-                    resultuuid=str(uuid.uuid4()),
-                    resulttypecv=result_type_and_unit_dict[method.methodname][0],
-                    variableid=abundance_variable.variableid,
-                    unitsid=result_type_and_unit_dict[method.methodname][1],
-                    taxonomicclassifierid=begroing_result.taxons[result_index]["taxonomicclassifierid"],
-                    processinglevelid=processing_level.processinglevelid,
-                    valuecount=0,
-                    statuscv="Complete",
-                    sampledmediumcv=result_type_and_unit_dict[method.methodname][2],
-                    dataqualitycodes=[],
+                data_results.append(
+                    schemas.ResultsCreate(
+                        samplingfeatureuuid=begroing_result.station.samplingfeatureuuid,
+                        actionid=completed_action.actionid,
+                        resultuuid=str(uuid.uuid4()),
+                        resulttypecv=result_type_and_unit_dict[method.methodname][0],
+                        variableid=abundance_variable.variableid,
+                        unitsid=result_type_and_unit_dict[method.methodname][1],
+                        taxonomicclassifierid=begroing_result.taxons[result_index]["taxonomicclassifierid"],
+                        processinglevelid=processing_level.processinglevelid,
+                        valuecount=0,
+                        statuscv="Complete",
+                        sampledmediumcv=result_type_and_unit_dict[method.methodname][2],
+                        dataqualitycodes=[],
+                    )
                 )
-                completed_result = await post_results(data_result, connection)
-                if method.methodname == "Microscopic abundance":
-                    data_categorical_result = schemas.CategoricalResultsCreate(
+                result_observations.append((method, begroing_result.observations[result_index][method_index]))
+
+        completed_results = await create_results(connection, data_results)
+
+        categorical_results: List[schemas.CategoricalResultsCreate] = []
+        measurement_results: List[schemas.MeasurementResultsCreate] = []
+        for completed_result, (method, observation) in zip(completed_results, result_observations):
+            if method.methodname == "Microscopic abundance":
+                categorical_results.append(
+                    schemas.CategoricalResultsCreate(
                         resultid=completed_result.resultid,
                         qualitycodecv="None",
-                        datavalue=begroing_result.observations[result_index][method_index],
+                        datavalue=observation,
                         valuedatetime=begroing_result.date,
                         valuedatetimeutcoffset=0,
                     )
-                    await post_categorical_results(data_categorical_result, connection)
+                )
+            else:
+                if observation[0] == "<":
+                    data_value = observation[1:]
+                    censor_code = "Less than"
                 else:
-                    if begroing_result.observations[result_index][method_index][0] == "<":
-                        data_value = begroing_result.observations[result_index][method_index][1:]
-                        censor_code = "Less than"
-                    else:
-                        data_value = begroing_result.observations[result_index][method_index]
-                        censor_code = "Not censored"
-                    data_measurement_result = schemas.MeasurementResultsCreate(
+                    data_value = observation
+                    censor_code = "Not censored"
+                measurement_results.append(
+                    schemas.MeasurementResultsCreate(
                         resultid=completed_result.resultid,
                         censorcodecv=censor_code,
                         qualitycodecv="None",
@@ -167,7 +191,10 @@ async def post_begroing_result(
                         valuedatetime=begroing_result.date,
                         valuedatetimeutcoffset=0,
                     )
-                    await post_measurement_results(data_measurement_result, connection)
+                )
+        await insert_categorical_results(connection, categorical_results)
+        await insert_measurement_results(connection, measurement_results)
+
         # TODO: assuming that we have only one project. T*his should also be changed in API endpoint
         observations: List[BegroingObservationValues] = []
         for method_index, method_observations in observations_per_method.items():
@@ -188,12 +215,33 @@ async def post_begroing_result(
             observations=observations,
         )
 
-        if strtobool(os.environ.get("WRITE_TO_AQUAMONITOR", "false")):
-            await store_begroing_results(mapped)
+        outbox_entry = None
+        if os.environ.get("WRITE_TO_AQUAMONITOR", "false").lower() == "true":
+            # sent by the outbox worker once this transaction is committed
+            outbox_entry = await enqueue_begroing_results(connection, mapped)
+
+    if outbox_entry is not None:
+        outbox_worker.wake()
 
     # TODO: Send email about new bucket_files
 
-    return schemas.BegroingResult(personid=user.personid, **begroing_result.dict())
+    return schemas.BegroingResult(
+        personid=user.personid,
+        aquamonitor_outboxid=outbox_entry.outboxid if outbox_entry else None,
+        **begroing_result.dict(),
+    )
+
+
+@router.get("/aquamonitor_outbox", response_model=schemas.AquamonitorOutboxStatus)
+async def get_aquamonitor_outbox_status(connection=Depends(get_read_conn)):
+    """Number of outbox entries per status, and when the oldest entry not yet sent to Aquamonitor was created"""
+    return await outbox_status(connection)
+
+
+@router.get("/aquamonitor_outbox/{outboxid}", response_model=schemas.AquamonitorOutboxEntry)
+async def get_aquamonitor_outbox_entry(outboxid: int, connection=Depends(get_read_conn)):
+    """Status of sending a begroing result to Aquamonitor, see aquamonitor_outboxid in the begroing_result response"""
+    return await find_outbox_entry(connection, outboxid)
 
 
 @router.post("/indices", response_model=schemas.BegroingIndices)
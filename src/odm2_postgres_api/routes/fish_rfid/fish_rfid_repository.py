@@ -1,11 +1,12 @@
 from datetime import timezone
-from typing import List
+
+from fastapi import HTTPException
 
 from odm2_postgres_api.queries.core_queries import (
-    find_row,
-    do_action,
-    create_feature_action,
-    find_or_create_sampling_feature,
+    do_actions,
+    create_feature_actions,
+    find_or_create_sampling_features,
+    find_sampling_features_by_codes,
 )
 from odm2_postgres_api.queries.user import StoredPerson
 from odm2_postgres_api.routes.fish_rfid.fish_rfid_types import (
@@ -13,36 +14,30 @@ from odm2_postgres_api.routes.fish_rfid.fish_rfid_types import (
     FishObservationRequest,
     FishObservationStored,
 )
-from odm2_postgres_api.schemas.schemas import (
-    SamplingFeatures,
-    ActionsCreate,
-    FeatureActionsCreate,
-)
+from odm2_postgres_api.schemas.schemas import ActionsCreate
 
 
 async def register_fish_observations(
     conn, request: FishObservationRequest, user: StoredPerson
 ) -> FishObservationResponse:
-    stored_observations: List[FishObservationStored] = []
-    fish_sampling_features: List[SamplingFeatures] = []
-    station_sampling_features: List[SamplingFeatures] = []
+    """
+    Stores all detections of a request in bulk: fish tags and stations are resolved with one query each, missing fish
+    specimens are created together, and actions, actionby and featureactions are inserted with array based statements.
+    """
+    fish_tags = [o.fish_tag for o in request.observations]
+    station_codes = [o.station_code for o in request.observations]
 
-    for observation in request.observations:
-        fish_sf = await find_or_create_sampling_feature(conn, observation.fish_tag, "Specimen")
-        # TODO: struggled making set of list of dicts. What is easiest way to ensure uniqueness?
-        if fish_sf not in fish_sampling_features:
-            fish_sampling_features.append(fish_sf)
-        station_sf = await find_row(
-            conn,
-            "samplingfeatures",
-            "samplingfeaturecode",
-            observation.station_code,
-            SamplingFeatures,
-            raise_if_none=True,
+    station_sampling_features = await find_sampling_features_by_codes(conn, station_codes)
+    missing_stations = [code for code in dict.fromkeys(station_codes) if code not in station_sampling_features]
+    if missing_stations:
+        raise HTTPException(
+            status_code=422,
+            detail=f"Item in table samplingfeatures with 'samplingfeaturecode={missing_stations[0]}' not found",
         )
-        if station_sf not in station_sampling_features:
-            station_sampling_features.append(station_sf)
+    fish_sampling_features = await find_or_create_sampling_features(conn, fish_tags, "Specimen")
 
+    actions = []
+    for observation in request.observations:
         if observation.datetime.tzinfo:
             obs_time = observation.datetime.astimezone(timezone.utc)
         else:
@@ -50,42 +45,39 @@ async def register_fish_observations(
             obs_time = observation.datetime.replace(tzinfo=timezone.utc)
         # TODO: storing action_by as the user object. This is in its current state the user who created the API token
         # we should instead link to equipment used, see https://github.com/NIVANorge/niva-port/issues/226
-        action = ActionsCreate(
-            actiontypecv="Observation",
-            methodcode="fish_rfid:observe_fish",
-            affiliationid=user.affiliationid,
-            isactionlead=True,
-            begindatetime=obs_time,
-            begindatetimeutcoffset=0,
-            enddatetime=obs_time + observation.duration,
-            enddatetimeutcoffset=0,
+        actions.append(
+            ActionsCreate(
+                actiontypecv="Observation",
+                methodcode="fish_rfid:observe_fish",
+                affiliationid=user.affiliationid,
+                isactionlead=True,
+                begindatetime=obs_time,
+                begindatetimeutcoffset=0,
+                enddatetime=obs_time + observation.duration,
+                enddatetimeutcoffset=0,
+            )
         )
-        stored_action = await do_action(conn, action)
+    stored_actions = await do_actions(conn, actions)
 
-        fa_fish = await create_feature_action(
-            conn,
-            FeatureActionsCreate(
-                samplingfeatureuuid=fish_sf.samplingfeatureuuid,
-                actionid=stored_action.actionid,
-            ),
-        )
-        fa_station = await create_feature_action(
-            conn,
-            FeatureActionsCreate(
-                samplingfeatureuuid=station_sf.samplingfeatureuuid,
-                actionid=stored_action.actionid,
-            ),
-        )
-        stored_observations.append(
-            FishObservationStored(
-                action=stored_action,
-                fish_sampling_feature=fish_sf.samplingfeatureuuid,
-                station_sampling_feature=station_sf.samplingfeatureuuid,
-            )
+    action_ids = [a.actionid for a in stored_actions]
+    await create_feature_actions(
+        conn,
+        [fish_sampling_features[tag].samplingfeatureid for tag in fish_tags]
+        + [station_sampling_features[code].samplingfeatureid for code in station_codes],
+        action_ids + action_ids,
+    )
+
+    stored_observations = [
+        FishObservationStored(
+            action=stored_action,
+            fish_sampling_feature=fish_sampling_features[observation.fish_tag].samplingfeatureuuid,
+            station_sampling_feature=station_sampling_features[observation.station_code].samplingfeatureuuid,
         )
+        for observation, stored_action in zip(request.observations, stored_actions)
+    ]
 
     return FishObservationResponse(
         observations=stored_observations,
-        fish_sampling_features=fish_sampling_features,
-        station_sampling_features=station_sampling_features,
+        fish_sampling_features=[fish_sampling_features[tag] for tag in dict.fromkeys(fish_tags)],
+        station_sampling_features=[station_sampling_features[code] for code in dict.fromkeys(station_codes)],
     )
@@ -1,6 +1,6 @@
 from fastapi import Depends, APIRouter
 from typing import Optional, List
-from odm2_postgres_api.utils.api_pool_manager import api_pool_manager
+from odm2_postgres_api.utils.api_pool_manager import api_pool_manager, get_read_conn
 from odm2_postgres_api.schemas import schemas
 
 from odm2_postgres_api.queries.mass_spec_select_queries import (
@@ -30,40 +30,36 @@ async def post_result_annotationlink(
 @router.get("/get_result_annotationlinks_per_replica/{samplingfeaturecode}")
 async def result_annotationlinks_per_replica(
     samplingfeaturecode: str,
-    connection=Depends(api_pool_manager.get_conn),
+    connection=Depends(get_read_conn),
 ) -> Optional[List]:
     return await get_result_annotationlinks_per_replica(connection, samplingfeaturecode)
 
 
 @router.get("/get_samplingfeatureid_from_samplingfeaturecode/{samplingfeaturecode}")
 async def samplingfeatureid_from_samplingfeaturecode(
-    samplingfeaturecode: str, connection=Depends(api_pool_manager.get_conn)
+    samplingfeaturecode: str, connection=Depends(get_read_conn)
 ) -> Optional[int]:
     return await get_samplingfeatureid_from_samplingfeaturecode(connection, samplingfeaturecode)
 
 
 @router.get("/get_samplingfeaturecodes_of_replicas/{samplingfeaturecode}")
-async def samplingfeaturecodes_of_replicas(
-    samplingfeaturecode: str, connection=Depends(api_pool_manager.get_conn)
-) -> List[str]:
+async def samplingfeaturecodes_of_replicas(samplingfeaturecode: str, connection=Depends(get_read_conn)) -> List[str]:
     return await get_samplingfeaturecodes_of_replicas(connection, samplingfeaturecode)
 
 
 @router.get("/get_method_annotationjson/{methodcode}")
-async def method_annotationjson(methodcode: str, connection=Depends(api_pool_manager.get_conn)) -> Optional[str]:
+async def method_annotationjson(methodcode: str, connection=Depends(get_read_conn)) -> Optional[str]:
     return await get_method_annotationjson(connection, methodcode)
 
 
 @router.get("/get_samplingfeature_annotationjson/{samplingfeaturecode}")
-async def samplingfeature_annotationjson(
-    samplingfeaturecode: str, connection=Depends(api_pool_manager.get_conn)
-) -> List[str]:
+async def samplingfeature_annotationjson(samplingfeaturecode: str, connection=Depends(get_read_conn)) -> List[str]:
     return await get_samplingfeature_annotationjson(connection, samplingfeaturecode)
 
 
 @router.get("/get_samplingfeaturecode_from_result_annotationlink/{annotationlink}")
 async def samplingfeaturecode_from_result_annotationlink(
-    annotationlink: str, connection=Depends(api_pool_manager.get_conn)
+    annotationlink: str, connection=Depends(get_read_conn)
 ) -> Optional[str]:
     return await get_samplingfeaturecode_from_result_annotationlink(connection, annotationlink)
 
@@ -1,9 +1,11 @@
-from typing import Union
+import datetime as dt
+from typing import List, Union, Optional
 
-from fastapi import Depends, APIRouter
+from fastapi import Depends, APIRouter, HTTPException, Query
 from pydantic import constr
+from starlette.responses import StreamingResponse
 
-from odm2_postgres_api.queries import core_queries
+from odm2_postgres_api.queries import core_queries, result_export
 from odm2_postgres_api.queries.core_queries import (
     insert_pydantic_object,
     find_person_by_external_id,
@@ -14,7 +16,7 @@ from odm2_postgres_api.schemas.schemas import (
     Directive,
     SamplingFeatures,
 )
-from odm2_postgres_api.utils.api_pool_manager import api_pool_manager
+from odm2_postgres_api.utils.api_pool_manager import api_pool_manager, get_read_conn
 
 router = APIRouter()
 
@@ -25,7 +27,7 @@ async def post_annotations(annotation: schemas.AnnotationsCreate, connection=Dep
 
 
 @router.get("/people/active-directory/{sam_account_name}", response_model=PersonExtended)
-async def get_person_by_ad_sam_acc_name(sam_account_name: str, connection=Depends(api_pool_manager.get_conn)):
+async def get_person_by_ad_sam_acc_name(sam_account_name: str, connection=Depends(get_read_conn)):
     """Retrieves users based on their Active Directory 3-letter username (SamAccountName)"""
     return await find_person_by_external_id(connection, "onprem-active-directory", sam_account_name)
 
@@ -76,6 +78,14 @@ async def post_actions(action_create: schemas.ActionsCreate, connection=Depends(
     return await core_queries.do_action(connection, action_create)
 
 
+@router.post("/actions/with_results", response_model=schemas.ActionWithResults)
+async def post_action_with_results(
+    document: schemas.ActionWithResultsCreate, connection=Depends(api_pool_manager.get_conn)
+):
+    """Stores an action with its results and their values in one round trip and one transaction"""
+    return await core_queries.create_action_with_results(connection, document)
+
+
 @router.post("/sampling_features", response_model=SamplingFeatures)
 async def post_sampling_features(
     sampling_feature: schemas.SamplingFeaturesCreate,
@@ -156,9 +166,118 @@ async def post_results(result: schemas.ResultsCreate, connection=Depends(api_poo
 @router.post("/track_results", response_model=schemas.TrackResultsReport)
 async def post_track_results(
     track_result: schemas.TrackResultsCreate,
+    bulk: bool = False,
     connection=Depends(api_pool_manager.get_conn),
 ):
-    return await core_queries.upsert_track_result(connection, track_result)
+    """Set bulk=true to load values and locations with COPY, recommended for large payloads"""
+    return await core_queries.upsert_track_result(connection, track_result, bulk)
+
+
+@router.get("/track_results/{resultid}/values", response_model=schemas.ResultValuesDownsampled)
+async def get_track_result_values(
+    resultid: int,
+    begin: dt.datetime,
+    end: dt.datetime,
+    bucket: Optional[dt.timedelta] = None,
+    max_points: int = Query(1000, gt=0, le=10000),
+    connection=Depends(get_read_conn),
+):
+    """
+    Returns track result values between begin and end aggregated into time buckets (average, min, max and count), so
+    that at most max_points are returned. The bucket, for example 'PT1H' or seconds, is widened if it is too small.
+    Buckets of an hour or more are read from the hourly or daily continuous aggregate and rounded up to whole hours
+    or days, the response tells the source.
+    """
+    return await core_queries.find_track_result_values(connection, resultid, begin, end, max_points, bucket)
+
+
+@router.post("/time_series_results", response_model=schemas.TimeSeriesResults)
+async def post_time_series_results(
+    time_series_result: schemas.TimeSeriesResultsCreate,
+    connection=Depends(api_pool_manager.get_conn),
+):
+    return await core_queries.upsert_time_series_result(connection, time_series_result)
+
+
+@router.post("/time_series_results/{resultid}/values", response_model=schemas.TimeSeriesResultValuesReport)
+async def post_time_series_result_values(
+    resultid: int,
+    values: schemas.TimeSeriesResultValuesCreate,
+    connection=Depends(api_pool_manager.get_conn),
+):
+    """Loads the values with COPY, values already stored for the same valuedatetime are overwritten"""
+    return await core_queries.copy_upsert_time_series_result_values(connection, resultid, values)
+
+
+@router.get("/time_series_results/{resultid}/values", response_model=schemas.ResultValuesDownsampled)
+async def get_time_series_result_values(
+    resultid: int,
+    begin: dt.datetime,
+    end: dt.datetime,
+    bucket: Optional[dt.timedelta] = None,
+    max_points: int = Query(1000, gt=0, le=10000),
+    connection=Depends(get_read_conn),
+):
+    """Returns time series result values between begin and end aggregated into time buckets, like track results"""
+    return await core_queries.find_time_series_result_values(connection, resultid, begin, end, max_points, bucket)
+
+
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+@router.get("/results/export")
+async def export_results(
+    begin: dt.datetime,
+    end: dt.datetime,
+    samplingfeaturecode: Optional[str] = None,
+    directiveid: Optional[int] = None,
+    format: str = Query("ndjson", regex="^(ndjson|csv)$"),
+    connection=Depends(get_read_conn),
+):
+    """
+    Streams all measurement, categorical and track result values of a sampling feature and/or directive with
+    valuedatetime in [begin, end) as ndjson or csv, one row per value
+    """
+    if samplingfeaturecode is None and directiveid is None:
+        raise HTTPException(status_code=422, detail="Either samplingfeaturecode or directiveid is required")
+    if end <= begin:
+        raise HTTPException(status_code=422, detail="end must be after begin")
+    records = result_export.stream_result_values(connection, samplingfeaturecode, directiveid, begin, end)
+    return StreamingResponse(
+        result_export.export_result_values(records, format),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="results.{format}"'},
+    )
+
+
+TRACK_EXPORT_MEDIA_TYPES = {
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+@router.get("/track_results/{resultid}/export")
+async def export_track_result_values(
+    resultid: int,
+    begin: dt.datetime,
+    end: dt.datetime,
+    format: str = Query("arrow", regex="^(arrow|parquet)$"),
+    connection=Depends(get_read_conn),
+):
+    """
+    Track result values with valuedatetime in [begin, end) joined with the track locations, as an Arrow IPC stream or
+    a Parquet file. For example pandas.read_parquet or pyarrow.ipc.open_stream read the response directly
+    """
+    if result_export.pyarrow is None:
+        raise HTTPException(status_code=501, detail="Arrow and Parquet exports need pyarrow installed")
+    if end <= begin:
+        raise HTTPException(status_code=422, detail="end must be after begin")
+    batches = result_export.stream_track_result_records(connection, resultid, begin, end)
+    return StreamingResponse(
+        result_export.export_track_result_values(batches, format),
+        media_type=TRACK_EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="track_result_{resultid}.{format}"'},
+    )
 
 
 @router.post("/measurement_results", response_model=schemas.MeasurementResults)
@@ -169,6 +288,15 @@ async def post_measurement_results(
     return await core_queries.upsert_measurement_result(connection, measurement_result)
 
 
+@router.post("/measurement_results/batch", response_model=schemas.ResultValuesBatchReport)
+async def post_measurement_results_batch(
+    measurement_results: List[schemas.MeasurementResultsCreate],
+    connection=Depends(api_pool_manager.get_conn),
+):
+    """Stores many measurement results with their value in one transaction, reporting the status of every item"""
+    return await core_queries.copy_measurement_results(connection, measurement_results)
+
+
 @router.post("/categorical_results", response_model=schemas.CategoricalResults)
 async def post_categorical_results(
     categorical_result: schemas.CategoricalResultsCreate,
@@ -177,11 +305,20 @@ async def post_categorical_results(
     return await core_queries.upsert_categorical_result(connection, categorical_result)
 
 
+@router.post("/categorical_results/batch", response_model=schemas.ResultValuesBatchReport)
+async def post_categorical_results_batch(
+    categorical_results: List[schemas.CategoricalResultsCreate],
+    connection=Depends(api_pool_manager.get_conn),
+):
+    """Stores many categorical results with their value, items that fail are reported while the rest are stored"""
+    return await core_queries.insert_categorical_results_batch(connection, categorical_results)
+
+
 @router.get("/unit", response_model=schemas.Units)
 async def get_unit(
     unitstypecv: constr(max_length=255),  # type: ignore
     unitsabbreviation: constr(max_length=50),  # type: ignore
-    connection=Depends(api_pool_manager.get_conn),
+    connection=Depends(get_read_conn),
 ):
     units_create = schemas.UnitsCreate(unitstypecv=unitstypecv, unitsabbreviation=unitsabbreviation, unitsname="")
     return await core_queries.find_unit(connection, units_create, raise_if_none=True)
@@ -190,7 +327,7 @@ async def get_unit(
 @router.get("/variable", response_model=schemas.Variables)
 async def get_variable(
     variablecode: constr(max_length=50),  # type: ignore
-    connection=Depends(api_pool_manager.get_conn),
+    connection=Depends(get_read_conn),
 ):
     return await core_queries.find_row(
         connection,
@@ -205,7 +342,7 @@ async def get_variable(
 @router.get("/processinglevel", response_model=schemas.ProcessingLevels)
 async def get_processinglevel(
     processinglevelcode: constr(max_length=50),  # type: ignore
-    connection=Depends(api_pool_manager.get_conn),
+    connection=Depends(get_read_conn),
 ):
     return await core_queries.find_row(
         connection,
@@ -3,7 +3,7 @@ import datetime as dt
 from typing import Optional, List, Tuple, Dict, Union
 
 import shapely.wkt
-from pydantic import BaseModel, constr, conlist, validator
+from pydantic import BaseModel, Json, constr, conlist, validator
 
 from odm2_postgres_api.controlled_vocabularies.download_cvs import (
     CONTROLLED_VOCABULARY_TABLE_NAMES,
@@ -463,10 +463,9 @@ class TaxonomicClassifier(TaxonomicClassifierCreate):
     taxonomicclassifierid: int
 
 
-class FeatureActionsCreate(BaseModel):
+class FeatureActionsFields(BaseModel):
     samplingfeatureuuid: Optional[uuid.UUID] = None
     samplingfeaturecode: Optional[str] = None
-    actionid: int
 
     @validator("samplingfeaturecode", always=True)
     def must_supply_uuid_or_code(cls, v, values):
@@ -475,11 +474,15 @@ class FeatureActionsCreate(BaseModel):
         return v
 
 
+class FeatureActionsCreate(FeatureActionsFields):
+    actionid: int
+
+
 class FeatureActions(FeatureActionsCreate):
     featureactionid: int
 
 
-class ResultsCreate(FeatureActionsCreate):
+class ResultsFields(FeatureActionsFields):
     dataqualitycodes: List[str] = []
     resultuuid: uuid.UUID
     resulttypecv: constr(max_length=255)  # type: ignore
@@ -505,6 +508,10 @@ class ResultsCreate(FeatureActionsCreate):
         return validdatetime_checker(enddatetime, values)
 
 
+class ResultsCreate(ResultsFields):
+    actionid: int
+
+
 class Results(ResultsCreate):
     resultid: int
 
@@ -527,8 +534,58 @@ class TrackResultsReport(TrackResultsFields):
     inserted_track_result_locations: int
 
 
-class ResultSharedBase(BaseModel):
+class ResultValuesBucket(BaseModel):
+    valuedatetime: dt.datetime
+    datavalue: float
+    minimum: float
+    maximum: float
+    valuecount: int
+
+
+class ResultValuesDownsampled(BaseModel):
+    resultid: int
+    begin: dt.datetime
+    end: dt.datetime
+    bucket: dt.timedelta
+    source: str  # the table or continuous aggregate the buckets were computed from
+    values: List[ResultValuesBucket]
+
+
+class TimeSeriesResultsCreate(BaseModel):
+    resultid: int
+    xlocation: Optional[float]
+    xlocationunitsid: Optional[int]
+    ylocation: Optional[float]
+    ylocationunitsid: Optional[int]
+    zlocation: Optional[float]
+    zlocationunitsid: Optional[int]
+    spatialreferenceid: Optional[int]
+    intendedtimespacing: Optional[float]
+    intendedtimespacingunitsid: Optional[int]
+    aggregationstatisticcv: constr(max_length=255)  # type: ignore
+
+
+class TimeSeriesResults(TimeSeriesResultsCreate):
+    pass
+
+
+class TimeSeriesResultValuesCreate(BaseModel):
+    """Values of one time series result, the fields besides the values apply to all of them"""
+
+    valuedatetimeutcoffset: int
+    censorcodecv: constr(max_length=255)  # type: ignore
+    timeaggregationinterval: float
+    timeaggregationintervalunitsid: int
+    # valuedatetime, datavalue, qualitycodecv
+    time_series_result_values: List[Tuple[dt.datetime, float, str]]
+
+
+class TimeSeriesResultValuesReport(BaseModel):
     resultid: int
+    upserted_time_series_result_values: int
+
+
+class ResultValuesFields(BaseModel):
     xlocation: Optional[float]
     xlocationunitsid: Optional[int]
     ylocation: Optional[float]
@@ -544,16 +601,20 @@ class ResultSharedBase(BaseModel):
         return valuedatetime_checker(enddatetime, values)
 
 
-class CategoricalResultsCreate(ResultSharedBase):
+class CategoricalResultValuesFields(ResultValuesFields):
     qualitycodecv: constr(max_length=255)  # type: ignore
     datavalue: constr(max_length=255)  # type: ignore
 
 
+class CategoricalResultsCreate(CategoricalResultValuesFields):
+    resultid: int
+
+
 class CategoricalResults(CategoricalResultsCreate):
     valueid: int
 
 
-class MeasurementResultsCreate(ResultSharedBase):
+class MeasurementResultValuesFields(ResultValuesFields):
     censorcodecv: constr(max_length=255)  # type: ignore
     qualitycodecv: constr(max_length=255)  # type: ignore
     aggregationstatisticcv: constr(max_length=255)  # type: ignore
@@ -562,10 +623,51 @@ class MeasurementResultsCreate(ResultSharedBase):
     datavalue: float
 
 
+class MeasurementResultsCreate(MeasurementResultValuesFields):
+    resultid: int
+
+
 class MeasurementResults(MeasurementResultsCreate):
     valueid: int
 
 
+class ResultValuesBatchItem(BaseModel):
+    index: int
+    resultid: int
+    status: str  # "created", "skipped" or "failed"
+    valueid: Optional[int] = None
+    detail: Optional[str] = None
+
+
+class ResultValuesBatchReport(BaseModel):
+    created: int
+    skipped: int
+    failed: int = 0
+    items: List[ResultValuesBatchItem]
+    timings_ms: Dict[str, float]
+
+
+class ActionResultCreate(ResultsFields):
+    """A result of ActionWithResultsCreate, actionid and the resultid of the value are set when they are stored"""
+
+    measurement_value: Optional[MeasurementResultValuesFields] = None
+    categorical_value: Optional[CategoricalResultValuesFields] = None
+
+
+class ActionWithResultsCreate(BaseModel):
+    action: ActionsCreate
+    results: List[ActionResultCreate]
+
+
+class ActionResult(Results):
+    valueid: Optional[int] = None
+
+
+class ActionWithResults(BaseModel):
+    action: Action
+    results: List[ActionResult]
+
+
 class BegroingResultCreate(BaseModel):
     projects: List[Directive]
     date: dt.datetime
@@ -591,6 +693,23 @@ class BegroingObservations(BaseModel):
 
 class BegroingResult(BegroingResultCreate):
     personid: int
+    aquamonitor_outboxid: Optional[int] = None
+
+
+class AquamonitorOutboxEntry(BaseModel):
+    outboxid: int
+    status: str
+    attempts: int
+    nextattemptdatetime: dt.datetime
+    createddatetime: dt.datetime
+    completeddatetime: Optional[dt.datetime]
+    lasterror: Optional[str]
+    response: Optional[Json]
+
+
+class AquamonitorOutboxStatus(BaseModel):
+    entries: Dict[str, int]
+    oldest_unsent: Optional[dt.datetime]
 
 
 class BasicIndexingUnit(BaseModel):
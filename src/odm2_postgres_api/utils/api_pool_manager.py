@@ -1,13 +1,230 @@
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Optional
+
 import asyncpg
+from fastapi import HTTPException
+from prometheus_client import Counter, Gauge, Histogram
+
+from odm2_postgres_api.queries.prepared_statements import PreparedStatementConnection, prepare_statements
+from odm2_postgres_api.utils.shapely_postgres_adapter import set_shapely_adapter
+
+# saturation = in use / max size, exposed on /metrics/ together with the waiting requests and acquire times
+POOL_MAX_SIZE = Gauge("odm2_db_pool_max_size", "Maximum number of connections in the pool", ["pool"])
+POOL_IN_USE = Gauge("odm2_db_pool_connections_in_use", "Connections currently acquired from the pool", ["pool"])
+POOL_WAITING = Gauge("odm2_db_pool_acquire_waiting", "Requests waiting for a connection from the pool", ["pool"])
+POOL_ACQUIRE_SECONDS = Histogram("odm2_db_pool_acquire_seconds", "Time spent acquiring a connection", ["pool"])
+POOL_ACQUIRE_TIMEOUTS = Counter("odm2_db_pool_acquire_timeouts_total", "Acquires that timed out", ["pool"])
+READ_ROUTING = Counter("odm2_db_read_requests_total", "Read only requests by the pool that served them", ["pool"])
+
+# Errors worth retrying while the database is starting up or unreachable
+CONNECT_ERRORS = (
+    OSError,
+    asyncio.TimeoutError,
+    asyncpg.exceptions.CannotConnectNowError,
+    asyncpg.exceptions.PostgresConnectionError,
+)
+
+
+async def init_connection(connection: PreparedStatementConnection):
+    """Runs once for every new connection in the pool, registers the PostGIS codecs and prepares statements"""
+    # the geometry codec must be in place before statements with geometry parameters are prepared
+    await set_shapely_adapter(connection)
+    await prepare_statements(connection)
+
+
+class PoolUnavailableError(Exception):
+    pass
 
 
 class ApiPoolManager:
-    def __init__(self):
+    """
+    Creates the asyncpg pool on first use, retrying with exponential backoff while the database is not reachable.
+    create_pool opens min_size connections up front, each running init, so the pool is warm once created.
+    Sizing and timeouts are read from the environment when the pool is created.
+
+    With a retry_cooldown, get_pool fails fast with PoolUnavailableError for that many seconds after the pool could
+    not be created, instead of making every caller wait for all connection attempts.
+
+    on_create runs once with every newly created pool, before it is handed out. If it fails, the pool is closed and
+    treated as not created.
+    """
+
+    def __init__(
+        self,
+        name: str = "primary",
+        user_env: str = "ODM2_DB_USER",
+        password_env: str = "ODM2_DB_PASSWORD",
+        host_env: str = "TIMESCALE_ODM2_SERVICE_HOST",
+        port_env: str = "TIMESCALE_ODM2_SERVICE_PORT",
+        init: Callable[[asyncpg.Connection], Awaitable] = init_connection,
+        connect_attempts_env: str = "ODM2_DB_CONNECT_ATTEMPTS",
+        default_connect_attempts: int = 10,
+        min_size_env: str = "ODM2_DB_POOL_MIN_SIZE",
+        max_size_env: str = "ODM2_DB_POOL_MAX_SIZE",
+        default_min_size: int = 10,
+        default_max_size: int = 10,
+        retry_cooldown: float = 0,
+        on_create: Optional[Callable[[asyncpg.pool.Pool], Awaitable]] = None,
+    ):
+        self.name = name
+        self.user_env = user_env
+        self.password_env = password_env
+        self.host_env = host_env
+        self.port_env = port_env
+        self.init = init
+        self.connect_attempts_env = connect_attempts_env
+        self.default_connect_attempts = default_connect_attempts
+        self.min_size_env = min_size_env
+        self.max_size_env = max_size_env
+        self.default_min_size = default_min_size
+        self.default_max_size = default_max_size
+        self.retry_cooldown = retry_cooldown
+        self.on_create = on_create
         self.pool = None  # Optional[asyncpg.pool.Pool]
+        self.acquire_timeout = float(os.environ.get("ODM2_DB_ACQUIRE_TIMEOUT_SECONDS", 10))
+        self._lock: Optional[asyncio.Lock] = None
+        self._unavailable_until = 0.0
+
+    async def get_pool(self) -> asyncpg.pool.Pool:
+        if self.pool is None:
+            if time.monotonic() < self._unavailable_until:
+                raise PoolUnavailableError(f"Connection pool '{self.name}' is unavailable")
+            # created here rather than in __init__ so it belongs to the running event loop
+            if self._lock is None:
+                self._lock = asyncio.Lock()
+            async with self._lock:
+                if self.pool is None:
+                    try:
+                        self.pool = await self._prepare_pool(await self._create_pool())
+                    except Exception:
+                        self._unavailable_until = time.monotonic() + self.retry_cooldown
+                        raise
+        return self.pool
+
+    async def _prepare_pool(self, pool: asyncpg.pool.Pool) -> asyncpg.pool.Pool:
+        if self.on_create is not None:
+            try:
+                await self.on_create(pool)
+            except Exception:
+                await pool.close()
+                raise
+        return pool
+
+    async def _create_pool(self) -> asyncpg.pool.Pool:
+        attempts = int(os.environ.get(self.connect_attempts_env, self.default_connect_attempts))
+        backoff = float(os.environ.get("ODM2_DB_CONNECT_BACKOFF_SECONDS", 0.5))
+        min_size = int(os.environ.get(self.min_size_env, self.default_min_size))
+        max_size = int(os.environ.get(self.max_size_env, self.default_max_size))
+        self.acquire_timeout = float(os.environ.get("ODM2_DB_ACQUIRE_TIMEOUT_SECONDS", 10))
+
+        for attempt in range(1, attempts + 1):
+            logging.info("Creating connection pool", extra={"pool": self.name, "attempt": attempt})
+            try:
+                pool = await asyncpg.create_pool(
+                    user=os.environ[self.user_env],
+                    password=os.environ[self.password_env],
+                    server_settings={"search_path": "odm2,public"},
+                    host=os.environ.get(self.host_env) or os.environ["TIMESCALE_ODM2_SERVICE_HOST"],
+                    port=os.environ.get(self.port_env) or os.environ["TIMESCALE_ODM2_SERVICE_PORT"],
+                    database=os.environ["ODM2_DB"],
+                    min_size=min_size,
+                    max_size=max_size,
+                    max_queries=int(os.environ.get("ODM2_DB_POOL_MAX_QUERIES", 50000)),
+                    max_inactive_connection_lifetime=float(
+                        os.environ.get("ODM2_DB_POOL_MAX_INACTIVE_LIFETIME_SECONDS", 300)
+                    ),
+                    connection_class=PreparedStatementConnection,
+                    init=self.init,
+                )
+            except CONNECT_ERRORS as e:
+                if attempt == attempts:
+                    raise
+                delay = backoff * 2 ** (attempt - 1)
+                logging.warning(
+                    "Could not create connection pool, retrying",
+                    extra={"pool": self.name, "error": str(e), "retry_in_seconds": delay},
+                )
+                await asyncio.sleep(delay)
+            else:
+                POOL_MAX_SIZE.labels(pool=self.name).set(max_size)
+                logging.info("Successfully created connection pool", extra={"pool": self.name})
+                return pool
+        raise RuntimeError(f"{self.connect_attempts_env} must be at least 1, got {attempts}")
+
+    @asynccontextmanager
+    async def acquire(self):
+        try:
+            pool = await self.get_pool()
+        except PoolUnavailableError:
+            raise HTTPException(status_code=503, detail="Database unavailable, try again later")
+        POOL_WAITING.labels(pool=self.name).inc()
+        start = time.perf_counter()
+        try:
+            connection = await pool.acquire(timeout=self.acquire_timeout)
+        except asyncio.TimeoutError:
+            POOL_ACQUIRE_TIMEOUTS.labels(pool=self.name).inc()
+            raise HTTPException(status_code=503, detail="No database connection available, try again later")
+        finally:
+            POOL_WAITING.labels(pool=self.name).dec()
+            POOL_ACQUIRE_SECONDS.labels(pool=self.name).observe(time.perf_counter() - start)
+
+        POOL_IN_USE.labels(pool=self.name).inc()
+        try:
+            yield connection
+        finally:
+            POOL_IN_USE.labels(pool=self.name).dec()
+            await pool.release(connection)
 
     async def get_conn(self) -> asyncpg.connection.Connection:
-        async with self.pool.acquire() as connection:
+        async with self.acquire() as connection:
             yield connection
 
+    async def close(self):
+        if self.pool is not None:
+            logging.info("Closing connection pool", extra={"pool": self.name})
+            await self.pool.close()
+            self.pool = None
+            logging.info("Successfully closed connection pool", extra={"pool": self.name})
+
+
+# created on the first request, so a database that is not ready yet fails requests fast instead of blocking startup
+api_pool_manager = ApiPoolManager(retry_cooldown=float(os.environ.get("ODM2_DB_RETRY_SECONDS", 10)))
+
+# Read only user provisioned by db_initiate.grant_read_only, optionally on a replica. It only runs SELECTs, so the
+# connections just need the PostGIS codecs. It is sized separately and kept small, so it does not double the number
+# of connections every instance holds open
+read_only_pool_manager = ApiPoolManager(
+    name="read_only",
+    user_env="ODM2_DB_READ_ONLY_USER",
+    password_env="ODM2_DB_READ_ONLY_PASSWORD",
+    host_env="TIMESCALE_ODM2_READ_ONLY_SERVICE_HOST",
+    port_env="TIMESCALE_ODM2_READ_ONLY_SERVICE_PORT",
+    init=set_shapely_adapter,
+    connect_attempts_env="ODM2_DB_READ_ONLY_CONNECT_ATTEMPTS",
+    default_connect_attempts=2,
+    min_size_env="ODM2_DB_RO_POOL_MIN_SIZE",
+    max_size_env="ODM2_DB_RO_POOL_MAX_SIZE",
+    default_min_size=1,
+    default_max_size=3,
+    retry_cooldown=float(os.environ.get("ODM2_DB_READ_ONLY_RETRY_SECONDS", 60)),
+)
+
 
-api_pool_manager = ApiPoolManager()
+async def get_read_conn() -> asyncpg.connection.Connection:
+    """
+    Dependency for GET handlers, yields a connection from the read only pool so lookups do not compete with ingest
+    for writer connections. Falls back to the primary pool while the read only pool cannot be created.
+    """
+    manager = read_only_pool_manager
+    try:
+        await manager.get_pool()
+    except (KeyError, PoolUnavailableError, asyncpg.exceptions.PostgresError) + CONNECT_ERRORS as e:
+        logging.warning("Read only pool unavailable, using the primary pool", extra={"error": str(e)})
+        manager = api_pool_manager
+    READ_ROUTING.labels(pool=manager.name).inc()
+    async with manager.acquire() as connection:
+        yield connection
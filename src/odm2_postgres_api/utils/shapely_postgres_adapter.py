@@ -1,12 +1,15 @@
 import shapely.geometry
 import shapely.wkb
+from shapely.geometry.base import BaseGeometry
 
 
 def encode_geometry(geometry):
+    # Fast path, shapely geometries already carry their WKB
+    if isinstance(geometry, BaseGeometry):
+        return geometry.wkb
     if not hasattr(geometry, "__geo_interface__"):
         raise TypeError("{g} does not conform to " "the geo interface".format(g=geometry))
-    shape = shapely.geometry.asShape(geometry)
-    return shapely.wkb.dumps(shape)
+    return shapely.geometry.shape(geometry).wkb
 
 
 def decode_geometry(wkb):
@@ -17,9 +20,22 @@ async def set_shapely_adapter(connection):
     """From https://magicstack.github.io/asyncpg/current/usage.html#example-automatic-conversion-of-postgis-types"""
     # TODO: somehow implement this: https://stackoverflow.com/questions/29500460/
     #  why-can-shapely-geos-parse-this-invalid-well-known-binary/29548439#29548439
-    await connection.set_type_codec(
-        "geometry",  # also works for 'geography'
-        encoder=encode_geometry,
-        decoder=decode_geometry,
-        format="binary",
-    )
+    for typename in ("geometry", "geography"):
+        await connection.set_type_codec(
+            typename,
+            encoder=encode_geometry,
+            decoder=decode_geometry,
+            format="binary",
+        )
+    try:
+        connection.shapely_adapter_registered = True
+    except AttributeError:
+        # plain asyncpg connections and pool proxies do not take new attributes, ensure_shapely_adapter will
+        # re-register
+        pass
+
+
+async def ensure_shapely_adapter(connection):
+    """Registers the codecs unless this connection already got them, normally from the pool init hook"""
+    if not getattr(connection, "shapely_adapter_registered", False):
+        await set_shapely_adapter(connection)
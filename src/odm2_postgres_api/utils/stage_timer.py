@@ -0,0 +1,19 @@
+import time
+from typing import Dict
+
+
+class StageTimer:
+    """Collects the elapsed milliseconds of consecutive named stages, for timings reported back to clients"""
+
+    def __init__(self):
+        self.timings_ms: Dict[str, float] = {}
+        self._start = self._last = time.perf_counter()
+
+    def lap(self, stage: str) -> None:
+        now = time.perf_counter()
+        self.timings_ms[stage] = round((now - self._last) * 1000, 3)
+        self._last = now
+
+    def total(self) -> Dict[str, float]:
+        self.timings_ms["total"] = round((time.perf_counter() - self._start) * 1000, 3)
+        return self.timings_ms
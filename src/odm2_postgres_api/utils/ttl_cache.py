@@ -0,0 +1,99 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from prometheus_client import Counter
+
+CACHE_HITS = Counter("odm2_cache_hits_total", "Lookups answered from an in-process cache", ["cache"])
+CACHE_MISSES = Counter("odm2_cache_misses_total", "Lookups not found in an in-process cache", ["cache"])
+CACHE_COALESCED = Counter(
+    "odm2_cache_coalesced_total", "Misses that waited for a load already in flight instead of loading again", ["cache"]
+)
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Small in-process LRU cache where entries also expire ttl seconds after they were stored.
+
+    Not thread safe, it is meant to be used from the event loop only.
+    """
+
+    def __init__(
+        self, name: str, maxsize: int = 1024, ttl: float = 300.0, clock: Callable[[], float] = time.monotonic
+    ):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > self.clock():
+            self._entries.move_to_end(key)
+            self.hits += 1
+            CACHE_HITS.labels(cache=self.name).inc()
+            return entry[1]
+        if entry is not None:
+            del self._entries[key]
+        self.misses += 1
+        CACHE_MISSES.labels(cache=self.name).inc()
+        return default
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self._entries[key] = (self.clock() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, predicate: Optional[Callable[[Hashable], bool]] = None) -> int:
+        """Removes all entries, or only those whose key matches predicate. Returns the number of removed entries"""
+        if predicate is None:
+            removed = len(self._entries)
+            self._entries.clear()
+            return removed
+        keys = [key for key in self._entries if predicate(key)]
+        for key in keys:
+            del self._entries[key]
+        return len(keys)
+
+    def stats(self) -> Dict:
+        return {"name": self.name, "size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+class SingleFlightTTLCache(TTLCache):
+    """
+    TTLCache for values loaded by coroutines. Concurrent misses for the same key share one load, so a burst of
+    lookups for a key that is not cached yet results in a single call. Failed loads are not cached.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.coalesced = 0
+        self._loading: Dict[Hashable, asyncio.Future] = {}
+
+    async def get_or_load(self, key: Hashable, load: Callable[[], Awaitable]) -> Any:
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        loading = self._loading.get(key)
+        if loading is not None:
+            self.coalesced += 1
+            CACHE_COALESCED.labels(cache=self.name).inc()
+            return await asyncio.shield(loading)
+
+        loading = self._loading[key] = asyncio.ensure_future(load())
+        try:
+            value = await asyncio.shield(loading)
+        finally:
+            del self._loading[key]
+        self.set(key, value)
+        return value
+
+    def stats(self) -> Dict:
+        return {**super().stats(), "coalesced": self.coalesced}
@@ -1,6 +1,7 @@
 import asyncio
 import logging
 import os
+from contextlib import asynccontextmanager
 from pathlib import Path
 
 import asyncpg
@@ -77,3 +78,14 @@ async def db_conn(wait_for_db):
         finally:
             # clean up after test
             await transaction.rollback()
+
+
+class ConnectionPoolManager:
+    """Hands out the test connection in place of an ApiPoolManager, so everything runs in the test transaction"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    @asynccontextmanager
+    async def acquire(self):
+        yield self.conn
@@ -0,0 +1,198 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from odm2_postgres_api.utils import api_pool_manager as pool_module
+from odm2_postgres_api.utils.api_pool_manager import ApiPoolManager
+
+DB_ENV = {
+    "ODM2_DB_USER": "user",
+    "ODM2_DB_PASSWORD": "password",
+    "TIMESCALE_ODM2_SERVICE_HOST": "localhost",
+    "TIMESCALE_ODM2_SERVICE_PORT": "5432",
+    "ODM2_DB": "odm2",
+    "ODM2_DB_CONNECT_BACKOFF_SECONDS": "0",
+}
+
+
+class FakePool:
+    def __init__(self, acquire_error=None):
+        self.acquire_error = acquire_error
+        self.released = []
+        self.closed = False
+
+    async def acquire(self, timeout=None):
+        if self.acquire_error:
+            raise self.acquire_error
+        return "connection"
+
+    async def release(self, connection):
+        self.released.append(connection)
+
+    async def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def db_env(monkeypatch):
+    for key, value in DB_ENV.items():
+        monkeypatch.setenv(key, value)
+
+
+@pytest.mark.asyncio
+async def test_pool_creation_is_retried(db_env, monkeypatch):
+    pool = FakePool()
+    calls = []
+
+    async def create_pool(**kwargs):
+        calls.append(kwargs)
+        if len(calls) < 3:
+            raise ConnectionRefusedError()
+        return pool
+
+    monkeypatch.setattr(pool_module.asyncpg, "create_pool", create_pool)
+    monkeypatch.setenv("ODM2_DB_POOL_MIN_SIZE", "2")
+    manager = ApiPoolManager()
+
+    assert await manager.get_pool() is pool
+    assert await manager.get_pool() is pool
+    assert len(calls) == 3
+    assert calls[0]["min_size"] == 2
+
+
+@pytest.mark.asyncio
+async def test_read_only_pool_is_sized_separately(db_env, monkeypatch):
+    calls = []
+
+    async def create_pool(**kwargs):
+        calls.append(kwargs)
+        return FakePool()
+
+    monkeypatch.setattr(pool_module.asyncpg, "create_pool", create_pool)
+    monkeypatch.setenv("ODM2_DB_POOL_MIN_SIZE", "20")
+    monkeypatch.setenv("ODM2_DB_POOL_MAX_SIZE", "20")
+    monkeypatch.setenv("ODM2_DB_RO_POOL_MAX_SIZE", "5")
+    manager = ApiPoolManager(
+        name="read_only",
+        min_size_env="ODM2_DB_RO_POOL_MIN_SIZE",
+        max_size_env="ODM2_DB_RO_POOL_MAX_SIZE",
+        default_min_size=1,
+        default_max_size=3,
+    )
+
+    await manager.get_pool()
+    assert calls[0]["min_size"] == 1
+    assert calls[0]["max_size"] == 5
+
+
+@pytest.mark.asyncio
+async def test_pool_creation_gives_up(db_env, monkeypatch):
+    async def create_pool(**kwargs):
+        raise ConnectionRefusedError()
+
+    monkeypatch.setattr(pool_module.asyncpg, "create_pool", create_pool)
+    monkeypatch.setenv("ODM2_DB_CONNECT_ATTEMPTS", "2")
+
+    with pytest.raises(ConnectionRefusedError):
+        await ApiPoolManager().get_pool()
+
+
+@pytest.mark.asyncio
+async def test_get_conn_releases_connection():
+    manager = ApiPoolManager()
+    manager.pool = FakePool()
+
+    connections = manager.get_conn()
+    assert await connections.__anext__() == "connection"
+    with pytest.raises(StopAsyncIteration):
+        await connections.__anext__()
+    assert manager.pool.released == ["connection"]
+
+
+@pytest.mark.asyncio
+async def test_acquire_timeout_is_service_unavailable():
+    manager = ApiPoolManager()
+    manager.pool = FakePool(acquire_error=asyncio.TimeoutError())
+
+    with pytest.raises(HTTPException) as e:
+        await manager.get_conn().__anext__()
+    assert e.value.status_code == 503
+
+
+@pytest.mark.asyncio
+async def test_failed_pool_creation_cools_down(db_env, monkeypatch):
+    calls = []
+
+    async def create_pool(**kwargs):
+        calls.append(kwargs)
+        raise ConnectionRefusedError()
+
+    monkeypatch.setattr(pool_module.asyncpg, "create_pool", create_pool)
+    manager = ApiPoolManager(name="read_only", default_connect_attempts=1, retry_cooldown=60)
+
+    with pytest.raises(ConnectionRefusedError):
+        await manager.get_pool()
+    with pytest.raises(pool_module.PoolUnavailableError):
+        await manager.get_pool()
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_pool_is_closed_when_on_create_fails(db_env, monkeypatch):
+    pools = []
+
+    async def create_pool(**kwargs):
+        pools.append(FakePool())
+        return pools[-1]
+
+    async def on_create(pool):
+        if len(pools) == 1:
+            raise ConnectionResetError()
+
+    monkeypatch.setattr(pool_module.asyncpg, "create_pool", create_pool)
+    manager = ApiPoolManager(on_create=on_create)
+
+    with pytest.raises(ConnectionResetError):
+        await manager.get_pool()
+    assert pools[0].closed
+    assert await manager.get_pool() is pools[1]
+    assert not pools[1].closed
+
+
+@pytest.mark.asyncio
+async def test_acquire_unavailable_pool_is_service_unavailable():
+    manager = ApiPoolManager(retry_cooldown=10)
+    manager._unavailable_until = float("inf")
+
+    with pytest.raises(HTTPException) as e:
+        async with manager.acquire():
+            pass
+    assert e.value.status_code == 503
+
+
+@pytest.mark.asyncio
+async def test_read_conn_falls_back_to_primary(monkeypatch):
+    read_only = ApiPoolManager(name="read_only")
+    read_only._unavailable_until = float("inf")
+    primary = ApiPoolManager()
+    primary.pool = FakePool()
+    monkeypatch.setattr(pool_module, "read_only_pool_manager", read_only)
+    monkeypatch.setattr(pool_module, "api_pool_manager", primary)
+
+    connections = pool_module.get_read_conn()
+    assert await connections.__anext__() == "connection"
+    await connections.aclose()
+    assert primary.pool.released == ["connection"]
+
+
+@pytest.mark.asyncio
+async def test_read_conn_uses_read_only_pool(monkeypatch):
+    read_only = ApiPoolManager(name="read_only")
+    read_only.pool = FakePool()
+    monkeypatch.setattr(pool_module, "read_only_pool_manager", read_only)
+
+    connections = pool_module.get_read_conn()
+    assert await connections.__anext__() == "connection"
+    await connections.aclose()
+    assert read_only.pool.released == ["connection"]
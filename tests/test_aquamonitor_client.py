@@ -1,12 +1,15 @@
 import json
 import re
 from datetime import datetime
+from typing import Optional, Tuple
 from uuid import uuid4
 
 import pytest
 import respx
-from httpx import AsyncClient
+from httpx import AsyncClient, URL
+from prometheus_client import REGISTRY
 
+from integration_test_fixtures import wait_for_db, db_conn, ConnectionPoolManager
 from odm2_postgres_api.aquamonitor.aquamonitor_api_types import (
     StationCargo,
     BegroingSampleCargo,
@@ -18,9 +21,25 @@ from odm2_postgres_api.aquamonitor.aquamonitor_api_types import (
     BegroingObservationCargoCreate,
     StationResponse,
 )
-from odm2_postgres_api.aquamonitor.aquamonitor_client import post_begroing_observations
+from odm2_postgres_api.aquamonitor.aquamonitor_client import (
+    AquamonitorClientManager,
+    AquamonitorUnavailableError,
+    CircuitBreaker,
+    ResilientAsyncClient,
+    aquamonitor_cache,
+    diff_begroing_observations,
+    endpoint_label,
+    get_method_by_id,
+    post_begroing_observations,
+    request_hooks,
+    resolve_station,
+)
+from odm2_postgres_api.app import aquamonitor_unavailable_exception_handler
+from odm2_postgres_api.aquamonitor.aquamonitor_identifiers import find_aquamonitor_station
+from odm2_postgres_api.queries.core_queries import find_or_create_sampling_feature, insert_pydantic_object
 from odm2_postgres_api.schemas.schemas import (
     BegroingObservations,
+    DirectivesCreate,
     Directive,
     SamplingFeatures,
     TaxonomicClassifier,
@@ -130,8 +149,12 @@ async def test_post_begroing_observations():
             observations=observations,
         )
 
+        aquamonitor_cache.invalidate()
         response = await post_begroing_observations(client, begroing_observations)
         assert mock_post_observations.call_count == len(observations)
+        # both observations use the same method, the cache fetches it once
+        assert mock_get_method_by_id.call_count == 1
+        assert mock_get_taxon.call_count == len(observations)
         for i, obs in enumerate(observations):
             # check that our outgoing request is wired correctly together
             body = [l for l in mock_post_observations.calls[i][0].stream][0]
@@ -140,3 +163,256 @@ async def test_post_begroing_observations():
             assert obs_post_body.Taxonomy == taxon
             assert obs_post_body.Value == obs.value
             assert obs_post_body.Sample == sample
+
+
+def test_endpoint_label():
+    url = URL("https://aquamonitor.niva.no/AquaServices/api/begroing/samples/567/observations?methodId=null")
+    assert endpoint_label(url) == "/AquaServices/api/begroing/samples/{id}/observations"
+
+
+@pytest.mark.asyncio
+async def test_client_manager_shares_one_client(monkeypatch):
+    monkeypatch.setenv("AQUAMONITOR_USER", "user")
+    monkeypatch.setenv("AQUAMONITOR_PASSWORD", "password")
+    manager = AquamonitorClientManager()
+    client = manager.get_client()
+    assert manager.get_client() is client
+    await manager.close()
+    assert client.is_closed
+    assert manager.get_client() is not client
+    await manager.close()
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_request_latency_histogram():
+    labels = {"method": "GET", "endpoint": "/methods/{id}", "status": "200"}
+    before = REGISTRY.get_sample_value("odm2_aquamonitor_request_seconds_count", labels) or 0
+    method = MethodCargo(Id=25128, Name="Presence/absence")
+    respx.get(url=re.compile(r"^.*/methods/\d*$"), status_code=200, content=method.json())
+
+    async with AsyncClient(base_url="https://doesnotexist.niva.no", event_hooks=request_hooks) as client:
+        assert await get_method_by_id(client, 25128) == method
+
+    assert REGISTRY.get_sample_value("odm2_aquamonitor_request_seconds_count", labels) == before + 1
+
+
+@pytest.mark.docker
+@pytest.mark.asyncio
+@respx.mock
+async def test_resolve_station_stores_ids(db_conn):
+    project = await insert_pydantic_object(
+        db_conn,
+        "directives",
+        DirectivesCreate(directivetypecv="Project", directivedescription="project1"),
+        Directive,
+    )
+    station = await find_or_create_sampling_feature(db_conn, "HEDEGL06", "Site")
+    station_cargo = StationCargo(Id=3, ProjectId=6, Type={"Id": 1, "Text": "Elv"}, Code="HEDEGL06")
+    mock_get_stations = respx.get(
+        url=re.compile(r"^.*/Stations\?.*$"),
+        status_code=200,
+        content=StationResponse(Size=100, Total=1, Records=[station_cargo]).json(),
+    )
+    pool_manager = ConnectionPoolManager(db_conn)
+
+    async with AsyncClient(base_url="https://doesnotexist.niva.no") as client:
+        assert await find_aquamonitor_station(db_conn, project.directiveid, station.samplingfeatureid) is None
+        aquamonitor_cache.invalidate()
+        assert await resolve_station(client, pool_manager, project, station) == station_cargo
+        # the second lookup is served from odm2, not from the in process cache
+        aquamonitor_cache.invalidate()
+        assert await resolve_station(client, pool_manager, project, station) == station_cargo
+
+    assert mock_get_stations.call_count == 1
+    stored = await find_aquamonitor_station(db_conn, project.directiveid, station.samplingfeatureid)
+    assert (stored.Id, stored.ProjectId) == (3, 6)
+
+
+def begroing_observation(code: str, value: str, method_name: str = "Presence/absence") -> BegroingObservationValues:
+    return BegroingObservationValues(
+        taxon=TaxonomicClassifier(
+            taxonomicclassifierid=1,
+            taxonomicclassifiertypecv="Biology",
+            taxonomicclassifiername=code,
+        ),
+        method=Methods(methodid=4, methodname=method_name, methodtypecv="Observation", methodcode="003"),
+        value=value,
+    )
+
+
+def observation_cargo(
+    observation_id: int, code: Optional[str], value: str, method_id: int = 25128
+) -> BegroingObservationCargo:
+    return BegroingObservationCargo(
+        Id=observation_id,
+        Sample=BegroingSampleCargo(
+            Id=567, Station=StationCargo(Id=3, ProjectId=6, Type={}), SampleDate=datetime.now()
+        ),
+        Method=MethodCargo(Id=method_id),
+        Taxonomy=TaxonomyCodeCargo(Id=observation_id, Code=code, Domain=DomainCargo(Id=9)),
+        Value=value,
+    )
+
+
+def test_diff_begroing_observations():
+    existing = [
+        observation_cargo(1, "BRYOPHYT", "x"),
+        observation_cargo(2, "ACHN BIA", "<1"),
+        observation_cargo(3, "ACHN BIA", "<1"),
+        observation_cargo(4, "GONGROSI", "x"),
+        # a method this api does not write is left alone
+        observation_cargo(5, "GONGROSI", "1", method_id=1),
+        # as are taxa without a code, they can not be matched to a submitted observation
+        observation_cargo(6, None, "x"),
+        observation_cargo(7, None, "x"),
+    ]
+    observations = [
+        begroing_observation("BRYOPHYT", "x"),
+        begroing_observation("ACHN BIA", "1"),
+        begroing_observation("NOSTOC", "x"),
+    ]
+
+    diff = diff_begroing_observations(existing, observations)
+
+    assert [o.taxon.taxonomicclassifiername for o in diff.add] == ["NOSTOC"]
+    assert [(o.Id, o.Value) for o in diff.update] == [(2, "1")]
+    assert sorted(o.Id for o in diff.delete) == [3, 4]
+    assert diff.unchanged == 1
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_sync_unchanged_sample_only_reads():
+    station_cargo = StationCargo(Id=3, ProjectId=6, Type={})
+    sample = BegroingSampleCargo(Id=567, Station=station_cargo, SampleDate=datetime.now())
+    observations = [begroing_observation(f"TAXON{i}", "x") for i in range(150)]
+    existing = [observation_cargo(i, f"TAXON{i}", "x") for i in range(150)]
+
+    mock_get_sample = respx.get(
+        url=re.compile(r"^.*/query/begroing/samples\?.*$"), status_code=200, content=f"[{sample.json()}]"
+    )
+    mock_get_observations = respx.get(
+        url=re.compile(r"^.*/begroing/samples/567/observations\?.*$"),
+        status_code=200,
+        content=f"[{','.join(o.json() for o in existing)}]",
+    )
+
+    async with AsyncClient(base_url="https://doesnotexist.niva.no") as client:
+        result = BegroingObservations(
+            project=Directive(directivetypecv="Project", directivedescription="project1", directiveid=1),
+            date=sample.SampleDate,
+            station=SamplingFeatures(
+                samplingfeatureid=1,
+                samplingfeatureuuid=uuid4(),
+                samplingfeaturecode="HEDEGL06",
+                samplingfeaturetypecv="Site",
+            ),
+            observations=observations,
+        )
+        aquamonitor_cache.invalidate()
+        response = await post_begroing_observations(client, result, sync=True, station=station_cargo)
+        # the sample is cached, resubmitting only reads the observations
+        await post_begroing_observations(client, result, sync=True, station=station_cargo)
+
+    assert mock_get_sample.call_count == 1
+    assert mock_get_observations.call_count == 2
+    # respx fails any request that is not mocked, so nothing was posted, updated or deleted
+    assert (response["added"], response["updated"], response["deleted"], response["unchanged"]) == (0, 0, 0, 150)
+
+
+def respond_in_turn(*responses: Tuple[int, str]):
+    """respx matcher answering every request with the next status code and content"""
+    remaining = iter(responses)
+
+    def match(request, response):
+        response.status_code, response.content = next(remaining)
+        return response
+
+    return match
+
+
+def resilient_client(retries: int = 3, breaker: CircuitBreaker = None) -> ResilientAsyncClient:
+    return ResilientAsyncClient(
+        base_url="https://doesnotexist.niva.no",
+        retries=retries,
+        backoff=0,
+        max_backoff=0,
+        breaker=breaker or CircuitBreaker(failure_threshold=100, reset_seconds=30),
+    )
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_retries_transient_errors_of_idempotent_requests():
+    method = MethodCargo(Id=25128, Name="Presence/absence")
+    mock_get_method = respx.add(respond_in_turn((502, ""), (503, ""), (200, method.json())))
+    before = REGISTRY.get_sample_value(
+        "odm2_aquamonitor_retries_total", {"method": "GET", "endpoint": "/methods/{id}", "reason": "502"}
+    )
+
+    async with resilient_client() as client:
+        assert await get_method_by_id(client, 25128) == method
+
+    assert mock_get_method.call_count == 3
+    after = REGISTRY.get_sample_value(
+        "odm2_aquamonitor_retries_total", {"method": "GET", "endpoint": "/methods/{id}", "reason": "502"}
+    )
+    assert after == (before or 0) + 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("status_code", [502, 503])
+@respx.mock
+async def test_does_not_retry_posts_that_may_have_been_processed(status_code):
+    mock_post_sample = respx.post(url=re.compile(r"^.*/begroing/samples$"), status_code=status_code)
+
+    async with resilient_client() as client:
+        response = await client.post("/begroing/samples", data="{}")
+
+    assert response.status_code == status_code
+    assert mock_post_sample.call_count == 1
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_circuit_breaker_fails_fast_while_open():
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=30)
+    mock_get_method = respx.add(respond_in_turn((503, ""), (503, ""), (200, MethodCargo(Id=25128).json())))
+
+    async with resilient_client(retries=5, breaker=breaker) as client:
+        with pytest.raises(AquamonitorUnavailableError):
+            await get_method_by_id(client, 25128)
+        assert mock_get_method.call_count == 2
+        with pytest.raises(AquamonitorUnavailableError) as unavailable:
+            await get_method_by_id(client, 25128)
+        assert mock_get_method.call_count == 2
+        assert 0 < unavailable.value.retry_after <= 30
+
+        response = await aquamonitor_unavailable_exception_handler(None, unavailable.value)
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "30"
+
+        # once the reset time has passed requests go through again, and a success closes the circuit
+        breaker.opened_at -= 30
+        assert (await get_method_by_id(client, 25128)).Id == 25128
+        assert breaker.opened_at is None
+
+
+def test_half_open_circuit_lets_one_probe_through():
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=30)
+    breaker.record_failure()
+    assert not breaker.allow_request()
+
+    breaker.opened_at -= 30
+    assert breaker.allow_request()
+    # the other requests keep failing fast while the probe is in flight
+    assert not breaker.allow_request()
+
+    breaker.record_failure()
+    assert not breaker.allow_request()
+    breaker.opened_at -= 30
+    assert breaker.allow_request()
+    breaker.record_success()
+    assert breaker.allow_request()
+    assert breaker.allow_request()
@@ -0,0 +1,89 @@
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+import pytest
+from fastapi import HTTPException
+
+from integration_test_fixtures import wait_for_db, db_conn, ConnectionPoolManager
+from odm2_postgres_api.aquamonitor.aquamonitor_api_types import BegroingSampleCargo, StationCargo
+from odm2_postgres_api.aquamonitor.aquamonitor_client import AquamonitorAPIError
+from odm2_postgres_api.aquamonitor.aquamonitor_outbox import (
+    AquamonitorOutboxWorker,
+    enqueue_begroing_results,
+    find_outbox_entry,
+    is_permanent_error,
+    outbox_status,
+    retry_delay,
+)
+from odm2_postgres_api.schemas.schemas import BegroingObservations, Directive, SamplingFeatures
+
+
+def aquamonitor_error(status_code: int) -> AquamonitorAPIError:
+    return AquamonitorAPIError(message="error", url="/begroing/samples", method="POST", status_code=status_code)
+
+
+def test_retry_delay():
+    assert timedelta(seconds=15) <= retry_delay(1, 30, 3600) <= timedelta(seconds=30)
+    assert timedelta(seconds=60) <= retry_delay(3, 30, 3600) <= timedelta(seconds=120)
+    assert retry_delay(20, 30, 3600) <= timedelta(seconds=3600)
+
+
+def test_is_permanent_error():
+    assert is_permanent_error(aquamonitor_error(400))
+    assert is_permanent_error(HTTPException(404, "Did not find station"))
+    assert not is_permanent_error(aquamonitor_error(429))
+    assert not is_permanent_error(aquamonitor_error(503))
+    assert not is_permanent_error(ConnectionError())
+
+
+@pytest.mark.docker
+@pytest.mark.asyncio
+async def test_outbox_worker_retries_until_sent(db_conn):
+    observations = BegroingObservations(
+        project=Directive(directivetypecv="Project", directivedescription="project1", directiveid=1),
+        date=datetime(2020, 9, 1),
+        station=SamplingFeatures(
+            samplingfeatureid=1,
+            samplingfeatureuuid=uuid4(),
+            samplingfeaturecode="HEDEGL06",
+            samplingfeaturetypecv="Site",
+        ),
+        observations=[],
+    )
+    calls = []
+    sample = BegroingSampleCargo(Id=567, Station=StationCargo(Id=3, ProjectId=6, Type={}), SampleDate=datetime.now())
+
+    async def store(result, sync=False):
+        calls.append(sync)
+        if len(calls) == 1:
+            raise aquamonitor_error(503)
+        return {"sample": sample, "observations": [], "added": 0, "updated": 0, "deleted": 0, "unchanged": 2}
+
+    entry = await enqueue_begroing_results(db_conn, observations)
+    assert entry.status == "pending"
+
+    worker = AquamonitorOutboxWorker(ConnectionPoolManager(db_conn), store=store)
+    # now() does not advance within the test transaction, without backoff the entry is due again right away
+    worker.backoff = 0
+
+    assert await worker.run_once() == 1
+    failed_attempt = await find_outbox_entry(db_conn, entry.outboxid)
+    assert (failed_attempt.status, failed_attempt.attempts) == ("pending", 1)
+    assert "error" in failed_attempt.lasterror
+
+    assert await worker.run_once() == 1
+    sent = await find_outbox_entry(db_conn, entry.outboxid)
+    assert (sent.status, sent.attempts, sent.lasterror) == ("done", 2, None)
+    assert sent.response == {
+        "sample_id": 567,
+        "observation_ids": [],
+        "added": 0,
+        "updated": 0,
+        "deleted": 0,
+        "unchanged": 2,
+    }
+    # every attempt is synced, so the retry skips observations aquamonitor already got
+    assert calls == [True, True]
+
+    assert await worker.run_once() == 0
+    assert "pending" not in (await outbox_status(db_conn)).entries
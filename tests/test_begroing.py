@@ -57,10 +57,10 @@ async def test_post_new_indices(db_conn):
     # TODO: the endpoint does not really respond with anything worth asserting on
 
 
-@patch("odm2_postgres_api.routes.begroing_routes.store_begroing_results", autospec=True)
+@patch("odm2_postgres_api.routes.begroing_routes.enqueue_begroing_results", autospec=True)
 @pytest.mark.asyncio
 @pytest.mark.docker
-async def test_post_new_begroing_observations(store_begroing_results, db_conn):
+async def test_post_new_begroing_observations(enqueue_begroing_results, db_conn):
     taxon_create = TaxonomicClassifierCreate(
         **{
             "taxonomicclassifiercommonname": "Achnanthes biasolettiana",
@@ -128,4 +128,71 @@ async def test_post_new_begroing_observations(store_begroing_results, db_conn):
 
     await post_begroing_result(begroing_result=begroing_result, connection=db_conn, niva_user=USER_HEADER)
 
-    assert not store_begroing_results.called
+    assert not enqueue_begroing_results.called
+
+
+@patch("odm2_postgres_api.routes.begroing_routes.enqueue_begroing_results", autospec=True)
+@pytest.mark.asyncio
+@pytest.mark.docker
+async def test_post_begroing_result_stores_every_observation(enqueue_begroing_results, db_conn):
+    taxons = []
+    for name in ("TEST TAXON 1", "TEST TAXON 2", "TEST TAXON 3"):
+        taxon_create = TaxonomicClassifierCreate(
+            taxonomicclassifiercommonname=name,
+            taxonomicclassifiertypecv="Biology",
+            taxonomicclassifiername=name,
+        )
+        taxons.append(await post_taxonomic_classifiers(taxon_create, db_conn))
+
+    methods = [
+        Methods(
+            methodid=3,
+            methodname="Microscopic abundance",
+            methodtypecv="Observation",
+            methodcode="begroing_1",
+        ),
+        Methods(
+            methodid=6,
+            methodname="Macroscopic coverage",
+            methodtypecv="Observation",
+            methodcode="begroing_4",
+        ),
+    ]
+    project = await post_directive(
+        DirectivesCreate(directivedescription="Test project with several observations", directivetypecv="Project"),
+        db_conn,
+    )
+    station = await post_sampling_features(
+        SamplingFeaturesCreate(
+            samplingfeatureuuid=uuid4(), samplingfeaturecode="TEST_STATION_BATCH", samplingfeaturetypecv="Site"
+        ),
+        db_conn,
+    )
+
+    begroing_result = BegroingResultCreate(
+        projects=[project],
+        date=datetime(2020, 9, 1),
+        station=station,
+        taxons=taxons,
+        methods=methods,
+        observations=[["x", ""], ["", "<1"], ["x", ""]],
+    )
+    await post_begroing_result(begroing_result=begroing_result, connection=db_conn, niva_user=USER_HEADER)
+
+    rows = await db_conn.fetch(
+        "SELECT r.taxonomicclassifierid, r.resulttypecv, m.methodcode, cv.datavalue AS categorical_value, "
+        "mv.datavalue AS measurement_value, mr.censorcodecv FROM results r "
+        "JOIN featureactions fa ON fa.featureactionid = r.featureactionid "
+        "JOIN actions a ON a.actionid = fa.actionid JOIN methods m ON m.methodid = a.methodid "
+        "LEFT JOIN categoricalresultvalues cv ON cv.resultid = r.resultid "
+        "LEFT JOIN measurementresults mr ON mr.resultid = r.resultid "
+        "LEFT JOIN measurementresultvalues mv ON mv.resultid = r.resultid "
+        "WHERE fa.samplingfeatureid = $1 ORDER BY r.resultid",
+        station.samplingfeatureid,
+    )
+    # results are created per method in the order of the taxons, each with exactly one value
+    assert [tuple(row) for row in rows] == [
+        (taxons[0].taxonomicclassifierid, "Category observation", "begroing_1", "x", None, None),
+        (taxons[2].taxonomicclassifierid, "Category observation", "begroing_1", "x", None, None),
+        (taxons[1].taxonomicclassifierid, "Measurement", "begroing_4", None, 1.0, "Less than"),
+    ]
@@ -1,11 +1,33 @@
 import json
+import uuid
+from datetime import datetime, timedelta
 
 import pytest
 from asyncpg import ForeignKeyViolationError
 from pydantic import ValidationError
 
 from integration_test_fixtures import wait_for_db, db_conn
-from odm2_postgres_api.queries.core_queries import insert_taxonomic_classifier
+from odm2_postgres_api.queries.core_queries import (
+    find_unit,
+    insert_pydantic_object,
+    metadata_cache,
+    copy_measurement_results,
+    create_action_with_results,
+    insert_categorical_results_batch,
+    result_values_batch_report,
+    insert_taxonomic_classifier,
+    find_row,
+    do_action,
+    create_result,
+    upsert_track_result,
+    downsample_bucket,
+    find_track_result_values,
+    track_result_aggregate,
+    upsert_time_series_result,
+    copy_upsert_time_series_result_values,
+    find_time_series_result_values,
+    make_multi_row_sql_query,
+)
 from odm2_postgres_api.schemas import schemas
 
 
@@ -191,3 +213,384 @@ def test_create_taxons_with_wrong_annotation():
     with pytest.raises(ValidationError):
         data["annotations"][0]["annotationtypecv"] = "A wrong CV term"
         schemas.TaxonomicClassifierCreate(**data)
+
+
+async def create_track_result(db_conn) -> schemas.Results:
+    person = await db_conn.fetchrow("SELECT affiliationid FROM affiliations LIMIT 1")
+    processing_level = await find_row(
+        db_conn, "processinglevels", "processinglevelcode", "0", schemas.ProcessingLevels
+    )
+    unit = await db_conn.fetchrow("SELECT unitsid FROM units LIMIT 1")
+    variable = await db_conn.fetchrow("SELECT variableid FROM variables LIMIT 1")
+    sampling_feature = schemas.SamplingFeaturesCreate(
+        samplingfeatureuuid=uuid.uuid4(),
+        samplingfeaturetypecv="Ships track",
+        samplingfeaturecode=str(uuid.uuid4())[:50],
+    )
+    action = await do_action(
+        db_conn,
+        schemas.ActionsCreate(
+            affiliationid=person["affiliationid"],
+            isactionlead=True,
+            actiontypecv="Instrument deployment",
+            methodcode="000",
+            begindatetime=datetime(2020, 1, 1),
+            begindatetimeutcoffset=0,
+            sampling_features=[sampling_feature],
+        ),
+    )
+    return await create_result(
+        db_conn,
+        schemas.ResultsCreate(
+            samplingfeatureuuid=sampling_feature.samplingfeatureuuid,
+            actionid=action.actionid,
+            resultuuid=uuid.uuid4(),
+            resulttypecv="Trajectory coverage",
+            variableid=variable["variableid"],
+            unitsid=unit["unitsid"],
+            processinglevelid=processing_level.processinglevelid,
+            valuecount=0,
+            sampledmediumcv="Liquid aqueous",
+        ),
+    )
+
+
+@pytest.mark.docker
+@pytest.mark.asyncio
+async def test_bulk_upsert_track_result(db_conn):
+    result = await create_track_result(db_conn)
+    samplingfeatureid = await db_conn.fetchval(
+        "SELECT samplingfeatureid FROM featureactions WHERE featureactionid = $1", result.featureactionid
+    )
+    start = datetime(2020, 1, 1)
+    values = [(start + timedelta(seconds=n), float(n), "Good") for n in range(1000)]
+    locations = [(start + timedelta(seconds=n), 59.9, 10.7 + n / 1000, "Good") for n in range(1000)]
+    track_result = schemas.TrackResultsCreate(
+        resultid=result.resultid,
+        samplingfeatureid=samplingfeatureid,
+        aggregationstatisticcv="Continuous",
+        # the duplicated timestamp at the end should overwrite the first value, like the executemany path does
+        track_result_values=values + [(start, -1.0, "Bad")],
+        track_result_locations=locations,
+    )
+
+    report = await upsert_track_result(db_conn, track_result, bulk=True)
+    assert report.inserted_track_result_values == 1000
+    assert report.inserted_track_result_locations == 1000
+
+    first = await db_conn.fetchrow(
+        "SELECT datavalue, qualitycodecv FROM trackresultvalues WHERE resultid = $1 AND valuedatetime = $2",
+        result.resultid,
+        start,
+    )
+    assert (first["datavalue"], first["qualitycodecv"]) == (-1.0, "Bad")
+
+    # Re-posting the same payload updates existing rows instead of failing on the unique constraints
+    report = await upsert_track_result(db_conn, track_result, bulk=True)
+    assert report.inserted_track_result_values == 1000
+    stored = await db_conn.fetchval("SELECT count(*) FROM trackresultvalues WHERE resultid = $1", result.resultid)
+    assert stored == 1000
+
+
+def test_downsample_bucket():
+    begin = datetime(2020, 1, 1)
+    end = datetime(2021, 1, 1)
+    assert downsample_bucket(begin, end, 366) == timedelta(days=1)
+    # a too fine bucket is widened to respect max_points, a coarser one is kept
+    assert downsample_bucket(begin, end, 366, timedelta(hours=1)) == timedelta(days=1)
+    assert downsample_bucket(begin, end, 366, timedelta(days=7)) == timedelta(days=7)
+    assert downsample_bucket(begin, begin + timedelta(seconds=10), 1000) == timedelta(seconds=1)
+
+
+@pytest.mark.docker
+@pytest.mark.asyncio
+async def test_find_track_result_values(db_conn):
+    result = await create_track_result(db_conn)
+    samplingfeatureid = await db_conn.fetchval(
+        "SELECT samplingfeatureid FROM featureactions WHERE featureactionid = $1", result.featureactionid
+    )
+    start = datetime(2020, 1, 1)
+    values = [(start + timedelta(seconds=n), float(n), "Good") for n in range(3600)]
+    track_result = schemas.TrackResultsCreate(
+        resultid=result.resultid,
+        samplingfeatureid=samplingfeatureid,
+        aggregationstatisticcv="Continuous",
+        track_result_values=values,
+        track_result_locations=[],
+    )
+    await upsert_track_result(db_conn, track_result, bulk=True)
+
+    downsampled = await find_track_result_values(db_conn, result.resultid, start, start + timedelta(hours=1), 60)
+    assert downsampled.bucket == timedelta(minutes=1)
+    assert len(downsampled.values) == 60
+    assert sum(v.valuecount for v in downsampled.values) == 3600
+    assert downsampled.values[0].minimum == 0.0
+    assert downsampled.values[0].maximum == 59.0
+    assert downsampled.values[0].datavalue == 29.5
+
+
+@pytest.mark.docker
+@pytest.mark.asyncio
+async def test_time_series_result_values(db_conn):
+    result = await create_track_result(db_conn)
+    unit = await db_conn.fetchrow("SELECT unitsid FROM units LIMIT 1")
+    await upsert_time_series_result(
+        db_conn, schemas.TimeSeriesResultsCreate(resultid=result.resultid, aggregationstatisticcv="Continuous")
+    )
+    start = datetime(2020, 1, 1)
+    values = schemas.TimeSeriesResultValuesCreate(
+        valuedatetimeutcoffset=0,
+        censorcodecv="Not censored",
+        timeaggregationinterval=1,
+        timeaggregationintervalunitsid=unit["unitsid"],
+        # one day of 1-minute data, the duplicated timestamp at the end overwrites the first value
+        time_series_result_values=[(start + timedelta(minutes=n), float(n), "Good") for n in range(1440)]
+        + [(start, -1.0, "Bad")],
+    )
+
+    report = await copy_upsert_time_series_result_values(db_conn, result.resultid, values)
+    assert report.upserted_time_series_result_values == 1440
+    report = await copy_upsert_time_series_result_values(db_conn, result.resultid, values)
+    assert report.upserted_time_series_result_values == 1440
+
+    downsampled = await find_time_series_result_values(db_conn, result.resultid, start, start + timedelta(days=1), 24)
+    assert downsampled.bucket == timedelta(hours=1)
+    assert len(downsampled.values) == 24
+    assert sum(v.valuecount for v in downsampled.values) == 1440
+    assert downsampled.values[0].minimum == -1.0
+    assert downsampled.values[0].maximum == 59.0
+
+
+def test_track_result_aggregate():
+    assert track_result_aggregate(timedelta(minutes=59)) is None
+    assert track_result_aggregate(timedelta(hours=1)) == "trackresultvalues_hourly"
+    assert track_result_aggregate(timedelta(hours=23)) == "trackresultvalues_hourly"
+    assert track_result_aggregate(timedelta(days=7)) == "trackresultvalues_daily"
+
+
+@pytest.mark.docker
+@pytest.mark.asyncio
+async def test_find_track_result_values_from_aggregate(db_conn):
+    result = await create_track_result(db_conn)
+    samplingfeatureid = await db_conn.fetchval(
+        "SELECT samplingfeatureid FROM featureactions WHERE featureactionid = $1", result.featureactionid
+    )
+    start = datetime(2020, 1, 1)
+    track_result = schemas.TrackResultsCreate(
+        resultid=result.resultid,
+        samplingfeatureid=samplingfeatureid,
+        aggregationstatisticcv="Continuous",
+        track_result_values=[(start + timedelta(minutes=n), float(n % 60), "Good") for n in range(3 * 1440)],
+        track_result_locations=[],
+    )
+    await upsert_track_result(db_conn, track_result, bulk=True)
+
+    # 90 minute buckets are rounded up to 2 hours from the hourly aggregate
+    downsampled = await find_track_result_values(db_conn, result.resultid, start, start + timedelta(days=3), 48)
+    assert downsampled.source == "trackresultvalues_hourly"
+    assert downsampled.bucket == timedelta(hours=2)
+    assert len(downsampled.values) == 36
+    assert sum(v.valuecount for v in downsampled.values) == 3 * 1440
+    assert (downsampled.values[0].minimum, downsampled.values[0].maximum) == (0.0, 59.0)
+    assert downsampled.values[0].datavalue == 29.5
+
+    downsampled = await find_track_result_values(db_conn, result.resultid, start, start + timedelta(days=3), 3)
+    assert downsampled.source == "trackresultvalues_daily"
+    assert [v.valuecount for v in downsampled.values] == [1440, 1440, 1440]
+
+
+def test_make_multi_row_sql_query():
+    query = make_multi_row_sql_query("measurementresultvalues", ["resultid", "datavalue"], 3)
+    assert query == (
+        "INSERT INTO measurementresultvalues (resultid,datavalue) VALUES ($1, $2), ($3, $4), ($5, $6) returning *"
+    )
+
+
+def measurement_result(resultid: int, datavalue: float, unitsid: int = 1) -> schemas.MeasurementResultsCreate:
+    return schemas.MeasurementResultsCreate(
+        resultid=resultid,
+        censorcodecv="Not censored",
+        qualitycodecv="None",
+        aggregationstatisticcv="Unknown",
+        timeaggregationinterval=0,
+        timeaggregationintervalunitsid=unitsid,
+        datavalue=datavalue,
+        valuedatetime=datetime(2020, 1, 1),
+        valuedatetimeutcoffset=0,
+    )
+
+
+def test_result_values_batch_report():
+    items = [measurement_result(1, 1.0), measurement_result(2, 2.0), measurement_result(1, 3.0)]
+
+    report = result_values_batch_report(items, {1: 10}, {"total": 1.0})
+
+    assert (report.created, report.skipped) == (1, 2)
+    assert [(i.status, i.valueid) for i in report.items] == [("created", 10), ("skipped", None), ("skipped", None)]
+    assert report.items[2].detail == "resultid occurs earlier in the batch"
+
+
+def test_result_values_batch_report_with_failures():
+    items = [measurement_result(1, 1.0), measurement_result(1, 2.0), measurement_result(2, 3.0)]
+
+    # the first item failed, so the second one with the same resultid was stored
+    report = result_values_batch_report(items, {1: 10}, {"total": 1.0}, failures={0: "bad value"})
+
+    assert (report.created, report.skipped, report.failed) == (1, 1, 1)
+    assert [i.status for i in report.items] == ["failed", "created", "skipped"]
+    assert report.items[0].detail == "bad value"
+
+
+@pytest.mark.docker
+@pytest.mark.asyncio
+async def test_copy_measurement_results(db_conn):
+    results = [await create_track_result(db_conn) for _ in range(3)]
+    unit = await db_conn.fetchrow("SELECT unitsid FROM units LIMIT 1")
+    items = [measurement_result(r.resultid, float(n), unit["unitsid"]) for n, r in enumerate(results)]
+
+    report = await copy_measurement_results(db_conn, items)
+    assert report.created == 3
+    assert set(report.timings_ms) == {"copy", "insert_results", "insert_values", "total"}
+
+    # posting the same results again leaves the stored values alone
+    report = await copy_measurement_results(db_conn, items)
+    assert (report.created, report.skipped) == (0, 3)
+    stored = await db_conn.fetchval(
+        "SELECT count(*) FROM measurementresultvalues WHERE resultid = ANY($1::bigint[])",
+        [r.resultid for r in results],
+    )
+    assert stored == 3
+
+
+@pytest.mark.docker
+@pytest.mark.asyncio
+async def test_copy_measurement_results_with_invalid_item(db_conn):
+    results = [await create_track_result(db_conn) for _ in range(3)]
+    unit = await db_conn.fetchrow("SELECT unitsid FROM units LIMIT 1")
+    items = [measurement_result(r.resultid, float(n), unit["unitsid"]) for n, r in enumerate(results)]
+    # unknown censor code, violates the foreign key to cv_censorcode
+    items[1].censorcodecv = "Not a censor code"
+
+    report = await copy_measurement_results(db_conn, items)
+
+    assert [i.status for i in report.items] == ["created", "failed", "created"]
+    assert "cv_censorcode" in report.items[1].detail
+    assert "insert_item_by_item" in report.timings_ms
+    stored = await db_conn.fetchval(
+        "SELECT count(*) FROM measurementresultvalues WHERE resultid = ANY($1::bigint[])",
+        [r.resultid for r in results],
+    )
+    assert stored == 2
+
+
+@pytest.mark.docker
+@pytest.mark.asyncio
+async def test_insert_categorical_results_batch(db_conn):
+    results = [await create_track_result(db_conn) for _ in range(3)]
+    items = [
+        schemas.CategoricalResultsCreate(
+            resultid=r.resultid,
+            qualitycodecv="None",
+            datavalue=f"value {n}",
+            valuedatetime=datetime(2020, 1, 1),
+            valuedatetimeutcoffset=0,
+        )
+        for n, r in enumerate(results)
+    ]
+    # unknown quality code, violates the foreign key to cv_qualitycode
+    items[1].qualitycodecv = "Not a quality code"
+
+    report = await insert_categorical_results_batch(db_conn, items)
+
+    assert [i.status for i in report.items] == ["created", "failed", "created"]
+    assert "insert_item_by_item" in report.timings_ms
+    stored = await db_conn.fetchval(
+        "SELECT count(*) FROM categoricalresultvalues WHERE resultid = ANY($1::bigint[])",
+        [r.resultid for r in results],
+    )
+    assert stored == 2
+
+
+def action_with_results_document(affiliationid: int, variableid: int, unitsid: int, processinglevelid: int):
+    sampling_feature = schemas.SamplingFeaturesCreate(
+        samplingfeatureuuid=uuid.uuid4(), samplingfeaturetypecv="Specimen", samplingfeaturecode=str(uuid.uuid4())[:50]
+    )
+    result = {
+        "samplingfeatureuuid": sampling_feature.samplingfeatureuuid,
+        "resulttypecv": "Measurement",
+        "variableid": variableid,
+        "unitsid": unitsid,
+        "processinglevelid": processinglevelid,
+        "valuecount": 1,
+        "sampledmediumcv": "Liquid aqueous",
+    }
+    value = {"qualitycodecv": "None", "valuedatetime": datetime(2020, 1, 1), "valuedatetimeutcoffset": 0}
+    return schemas.ActionWithResultsCreate(
+        action=schemas.ActionsCreate(
+            affiliationid=affiliationid,
+            isactionlead=True,
+            actiontypecv="Specimen analysis",
+            methodcode="000",
+            begindatetime=datetime(2020, 1, 1),
+            begindatetimeutcoffset=0,
+            sampling_features=[sampling_feature],
+        ),
+        results=[
+            {
+                **result,
+                "resultuuid": uuid.uuid4(),
+                "measurement_value": {
+                    **value,
+                    "censorcodecv": "Not censored",
+                    "aggregationstatisticcv": "Unknown",
+                    "timeaggregationinterval": 0,
+                    "timeaggregationintervalunitsid": unitsid,
+                    "datavalue": 1.5,
+                },
+            },
+            {**result, "resultuuid": uuid.uuid4(), "categorical_value": {**value, "datavalue": "present"}},
+            {**result, "resultuuid": uuid.uuid4()},
+        ],
+    )
+
+
+def test_action_with_results_document():
+    document = action_with_results_document(1, 2, 3, 4)
+    assert isinstance(document.results[0].measurement_value, schemas.MeasurementResultValuesFields)
+    assert document.results[0].measurement_value.datavalue == 1.5
+    assert document.results[1].categorical_value.datavalue == "present"
+
+
+@pytest.mark.docker
+@pytest.mark.asyncio
+async def test_create_action_with_results(db_conn):
+    person = await db_conn.fetchrow("SELECT affiliationid FROM affiliations LIMIT 1")
+    processing_level = await find_row(
+        db_conn, "processinglevels", "processinglevelcode", "0", schemas.ProcessingLevels
+    )
+    unit = await db_conn.fetchrow("SELECT unitsid FROM units LIMIT 1")
+    variable = await db_conn.fetchrow("SELECT variableid FROM variables LIMIT 1")
+    document = action_with_results_document(
+        person["affiliationid"], variable["variableid"], unit["unitsid"], processing_level.processinglevelid
+    )
+
+    stored = await create_action_with_results(db_conn, document)
+
+    assert len(stored.action.sampling_features) == 1
+    assert all(r.actionid == stored.action.actionid for r in stored.results)
+    assert [r.valueid is not None for r in stored.results] == [True, True, False]
+    categorical = await db_conn.fetchval(
+        "SELECT datavalue FROM categoricalresultvalues WHERE valueid = $1", stored.results[1].valueid
+    )
+    assert categorical == "present"
+
+
+@pytest.mark.docker
+@pytest.mark.asyncio
+async def test_find_unit_does_not_cache_rows_read_in_a_transaction(db_conn):
+    unit = schemas.UnitsCreate(unitstypecv="Dimensionless", unitsabbreviation=f"u-{uuid.uuid4()}"[:50], unitsname="u")
+    await insert_pydantic_object(db_conn, "units", unit, schemas.Units)
+
+    # the unit is gone if the test transaction rolls back, it must not be served from the cache afterwards
+    assert await find_unit(db_conn, unit) is not None
+    assert metadata_cache.get(("units", unit.unitstypecv, unit.unitsabbreviation)) is None
@@ -1,6 +1,7 @@
 from datetime import timezone
 
 import pytest
+from fastapi import HTTPException
 from odm2_postgres_api.routes.fish_rfid.fish_rfid_routes import post_fish_observation
 
 from integration_test_fixtures import db_conn, wait_for_db
@@ -115,3 +116,28 @@ async def test_store_fish_observations(db_conn):
         assert station_sf.samplingfeaturecode in station_codes
         assert station_sf.samplingfeaturetypecv == "Site"
         assert station_sf.featuregeometrywkt is not None
+
+
+@pytest.mark.docker
+@pytest.mark.asyncio
+async def test_store_fish_observations_reuses_existing_fish(db_conn):
+    observations = [csv_to_observation(l) for l in example_file.split("\n") if l]
+    payload = FishObservationRequest(observations=observations)
+    await find_or_create_sampling_feature(db_conn, "AAA", "Site", wkt="POINT (10.907013757789976 60.25819134332953)")
+
+    first = await post_fish_observation(payload, db_conn, niva_user=user_header()["Niva-User"])
+    second = await post_fish_observation(payload, db_conn, niva_user=user_header()["Niva-User"])
+
+    assert first.fish_sampling_features == second.fish_sampling_features
+    assert len({o.action.actionid for o in first.observations + second.observations}) == 2 * len(observations)
+
+
+@pytest.mark.docker
+@pytest.mark.asyncio
+async def test_store_fish_observations_unknown_station(db_conn):
+    observation = csv_to_observation(example_file.strip().split("\n")[0].replace("AAA", "DOES_NOT_EXIST"))
+    with pytest.raises(HTTPException) as e:
+        await post_fish_observation(
+            FishObservationRequest(observations=[observation]), db_conn, niva_user=user_header()["Niva-User"]
+        )
+    assert e.value.status_code == 422
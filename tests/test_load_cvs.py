@@ -0,0 +1,30 @@
+import pytest
+from integration_test_fixtures import wait_for_db, init_dbpool
+
+from odm2_postgres_api.controlled_vocabularies.load_cvs import (
+    cv_records,
+    read_cv_from_file,
+    load_controlled_vocabularies,
+)
+
+
+def test_cv_records():
+    cvs = read_cv_from_file("cv_unitstype")
+    records = cv_records("cv_unitstype")
+
+    assert len(records) == len(cvs)
+    assert records[0] == (cvs[0].term, cvs[0].name, cvs[0].definition, cvs[0].category)
+
+
+@pytest.mark.docker
+@pytest.mark.asyncio
+async def test_reload_leaves_controlled_vocabularies_unchanged(wait_for_db):
+    db_pool = await init_dbpool()
+    try:
+        report = await load_controlled_vocabularies(db_pool)
+    finally:
+        await db_pool.close()
+
+    assert all(r["inserted"] == 0 for r in report)
+    unitstype = next(r for r in report if r["table"] == "cv_unitstype")
+    assert unitstype["unchanged"] == len(cv_records("cv_unitstype"))
@@ -0,0 +1,19 @@
+import pytest
+from integration_test_fixtures import wait_for_db, db_conn
+
+from odm2_postgres_api.metadata_init.populate_metadata import metadata_fingerprint
+
+
+def test_metadata_fingerprint_is_stable():
+    fingerprint = metadata_fingerprint()
+    assert len(fingerprint) == 64
+    assert fingerprint == metadata_fingerprint()
+
+
+@pytest.mark.docker
+@pytest.mark.asyncio
+async def test_populated_metadata_is_fingerprinted(db_conn):
+    stored = await db_conn.fetchval(
+        "SELECT count(*) FROM metadatafingerprints WHERE fingerprint = $1", metadata_fingerprint()
+    )
+    assert stored == 1
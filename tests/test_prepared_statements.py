@@ -0,0 +1,57 @@
+import pytest
+
+from odm2_postgres_api.queries import prepared_statements
+from odm2_postgres_api.queries.prepared_statements import STATEMENTS
+
+
+class FakeStatement:
+    def __init__(self, query):
+        self.query = query
+
+    async def fetchrow(self, *args):
+        return {"query": self.query, "args": args}
+
+
+class FakeConnection:
+    def __init__(self):
+        self.prepared = []
+
+    async def prepare(self, query):
+        self.prepared.append(query)
+        return FakeStatement(query)
+
+    async def fetchrow(self, query, *args):
+        return {"query": query, "args": args, "unprepared": True}
+
+
+class FakeRegistryConnection(FakeConnection):
+    def __init__(self):
+        super().__init__()
+        self.prepared_statements = {}
+
+
+@pytest.mark.asyncio
+async def test_registered_statements_are_prepared_once():
+    conn = FakeRegistryConnection()
+    await prepared_statements.prepare_statements(conn)
+    assert set(conn.prepared_statements) == set(STATEMENTS)
+
+    row = await prepared_statements.fetchrow(conn, "insert_action_by", 1, 2, True, None)
+    assert row == {"query": STATEMENTS["insert_action_by"], "args": (1, 2, True, None)}
+    assert len(conn.prepared) == len(STATEMENTS)
+
+
+@pytest.mark.asyncio
+async def test_missing_statement_is_prepared_on_first_use():
+    conn = FakeRegistryConnection()
+    await prepared_statements.fetchrow(conn, "insert_result", *range(14))
+    await prepared_statements.fetchrow(conn, "insert_result", *range(14))
+    assert conn.prepared == [STATEMENTS["insert_result"]]
+
+
+@pytest.mark.asyncio
+async def test_connection_without_registry_runs_query_text():
+    conn = FakeConnection()
+    row = await prepared_statements.fetchrow(conn, "insert_action_by", 1, 2, True, None)
+    assert row["unprepared"]
+    assert conn.prepared == []
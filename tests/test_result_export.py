@@ -0,0 +1,125 @@
+import json
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from integration_test_fixtures import wait_for_db, db_conn
+from test_core_queries import create_track_result
+
+from odm2_postgres_api.queries.core_queries import upsert_track_result
+from odm2_postgres_api.queries.result_export import (
+    RESULT_EXPORT_COLUMNS,
+    csv_chunk,
+    export_result_values,
+    export_track_result_values,
+    ndjson_chunk,
+    stream_result_values,
+    stream_track_result_records,
+)
+from odm2_postgres_api.schemas import schemas
+
+RECORD = {
+    "resultid": 1,
+    "resultuuid": uuid.UUID("3fa85f64-5717-4562-b3fc-2c963f66afa6"),
+    "resulttypecv": "Measurement",
+    "samplingfeaturecode": "901-3-8",
+    "actionid": 2,
+    "variablecode": "temp",
+    "unitsabbreviation": "degC",
+    "valuedatetime": datetime(2020, 1, 1, 12),
+    "valuedatetimeutcoffset": 0,
+    "datavalue": 4.5,
+    "categoricalvalue": None,
+    "qualitycodecv": None,
+}
+
+
+async def records(count):
+    for _ in range(count):
+        yield RECORD
+
+
+def test_ndjson_chunk():
+    line = json.loads(ndjson_chunk([RECORD]))
+    assert line["valuedatetime"] == "2020-01-01T12:00:00"
+    assert line["resultuuid"] == "3fa85f64-5717-4562-b3fc-2c963f66afa6"
+    assert line["categoricalvalue"] is None
+
+
+def test_csv_chunk():
+    lines = csv_chunk([RECORD], header=True).splitlines()
+    assert lines[0] == ",".join(RESULT_EXPORT_COLUMNS)
+    assert lines[1].startswith("1,3fa85f64-5717-4562-b3fc-2c963f66afa6,Measurement,901-3-8,2,")
+
+
+@pytest.mark.asyncio
+async def test_export_result_values_in_chunks(monkeypatch):
+    monkeypatch.setattr("odm2_postgres_api.queries.result_export.EXPORT_PREFETCH", 2)
+    chunks = [chunk async for chunk in export_result_values(records(5), "csv")]
+    # header, two full chunks and the remainder
+    assert len(chunks) == 4
+    assert sum(len(chunk.splitlines()) for chunk in chunks) == 6
+
+
+@pytest.mark.docker
+@pytest.mark.asyncio
+async def test_stream_result_values(db_conn):
+    result = await create_track_result(db_conn)
+    samplingfeature = await db_conn.fetchrow(
+        "SELECT sf.samplingfeatureid, sf.samplingfeaturecode FROM samplingfeatures sf "
+        "JOIN featureactions fa ON fa.samplingfeatureid = sf.samplingfeatureid WHERE fa.featureactionid = $1",
+        result.featureactionid,
+    )
+    start = datetime(2020, 1, 1)
+    track_result = schemas.TrackResultsCreate(
+        resultid=result.resultid,
+        samplingfeatureid=samplingfeature["samplingfeatureid"],
+        aggregationstatisticcv="Continuous",
+        track_result_values=[(start + timedelta(minutes=n), float(n), "Good") for n in range(10)],
+        track_result_locations=[(start + timedelta(minutes=n), 59.9, 10.7, "Good") for n in range(10)],
+    )
+    await upsert_track_result(db_conn, track_result)
+
+    exported = [
+        r
+        async for r in stream_result_values(
+            db_conn, samplingfeature["samplingfeaturecode"], None, start, start + timedelta(minutes=5)
+        )
+    ]
+    assert [r["datavalue"] for r in exported] == [0.0, 1.0, 2.0, 3.0, 4.0]
+    assert all(r["resultid"] == result.resultid and r["qualitycodecv"] == "Good" for r in exported)
+
+    batches = [
+        b async for b in stream_track_result_records(db_conn, result.resultid, start, start + timedelta(hours=1))
+    ]
+    assert [len(b) for b in batches] == [10]
+    assert (batches[0][0]["latitude"], batches[0][0]["longitude"]) == (59.9, 10.7)
+
+
+TRACK_RECORDS = [
+    (datetime(2020, 1, 1) + timedelta(seconds=n), float(n), "Good", 59.9, 10.7, "Good" if n else None)
+    for n in range(5)
+]
+
+
+async def track_batches(size):
+    for start in range(0, len(TRACK_RECORDS), size):
+        yield TRACK_RECORDS[start : start + size]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("export_format", ["arrow", "parquet"])
+async def test_export_track_result_values(export_format):
+    pyarrow = pytest.importorskip("pyarrow")
+    import pyarrow.parquet
+
+    data = b"".join([chunk async for chunk in export_track_result_values(track_batches(2), export_format)])
+
+    if export_format == "parquet":
+        table = pyarrow.parquet.read_table(pyarrow.BufferReader(data))
+        assert table.num_rows == 5
+    else:
+        table = pyarrow.ipc.open_stream(data).read_all()
+    assert table.column("datavalue").to_pylist() == [0.0, 1.0, 2.0, 3.0, 4.0]
+    assert table.column("locationqualitycodecv").to_pylist()[:2] == [None, "Good"]
+    assert table.column("valuedatetime").to_pylist()[0] == datetime(2020, 1, 1)
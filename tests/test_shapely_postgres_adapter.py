@@ -0,0 +1,37 @@
+import pytest
+import shapely.wkt
+
+from odm2_postgres_api.utils.shapely_postgres_adapter import (
+    encode_geometry,
+    decode_geometry,
+    ensure_shapely_adapter,
+)
+
+
+class GeoInterface:
+    __geo_interface__ = {"type": "Point", "coordinates": (10.7, 59.9)}
+
+
+def test_geometry_roundtrip():
+    point = shapely.wkt.loads("POINT (10.7 59.9)")
+    assert encode_geometry(point) == point.wkb
+    assert decode_geometry(encode_geometry(point)).equals(point)
+    assert decode_geometry(encode_geometry(GeoInterface())).equals(point)
+    with pytest.raises(TypeError):
+        encode_geometry("POINT (10.7 59.9)")
+
+
+class FakeConnection:
+    def __init__(self):
+        self.codecs = []
+
+    async def set_type_codec(self, typename, **kwargs):
+        self.codecs.append(typename)
+
+
+@pytest.mark.asyncio
+async def test_codecs_are_registered_once_per_connection():
+    conn = FakeConnection()
+    await ensure_shapely_adapter(conn)
+    await ensure_shapely_adapter(conn)
+    assert conn.codecs == ["geometry", "geography"]
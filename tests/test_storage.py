@@ -7,6 +7,7 @@ from odm2_postgres_api.queries.storage import (
     save_organization,
     save_controlled_vocab,
     save_units,
+    save_missing_controlled_vocabs,
 )
 from odm2_postgres_api.schemas.schemas import (
     OrganizationsCreate,
@@ -70,3 +71,24 @@ async def test_create_units(db_conn):
         saved_unit = await save_units(db_conn, unit)
         assert saved_unit.unitsid > 0
         assert {**{"unitsid": saved_unit.unitsid}, **unit.dict()} == saved_unit.dict()
+
+
+@pytest.mark.docker
+@pytest.mark.asyncio
+async def test_save_missing_controlled_vocabs(db_conn):
+    cvs = [
+        ControlledVocabularyCreate(
+            term=f"term-{uuid.uuid4()}",
+            name=f"Test unit {uuid.uuid4()}",
+            controlled_vocabulary_table_name="cv_unitstype",
+        )
+        for _ in range(3)
+    ]
+
+    await save_missing_controlled_vocabs(db_conn, cvs)
+    await save_missing_controlled_vocabs(db_conn, cvs)
+
+    stored = await db_conn.fetchval(
+        "SELECT count(*) FROM cv_unitstype WHERE name = ANY($1::varchar[])", [c.name for c in cvs]
+    )
+    assert stored == 3
@@ -0,0 +1,20 @@
+from odm2_postgres_api.db_init.timescale_policies import compression_command, policy_settings
+
+
+def test_compression_command():
+    assert compression_command("trackresultvalues") == (
+        "ALTER TABLE odm2.trackresultvalues SET (timescaledb.compress, timescaledb.compress_segmentby = 'resultid', "
+        "timescaledb.compress_orderby = 'valuedatetime DESC')"
+    )
+
+
+def test_policy_settings(monkeypatch):
+    monkeypatch.delenv("TIMESCALE_COMPRESS_AFTER", raising=False)
+    monkeypatch.delenv("TIMESCALE_COMPRESS_EXISTING_CHUNKS", raising=False)
+    monkeypatch.setenv("TIMESCALE_RETENTION", "10 years")
+    settings = policy_settings()
+    assert settings["chunk_time_interval"] == "7 days"
+    # compressed chunks are read only, compression is opt in
+    assert settings["compress_after"] == ""
+    assert settings["compress_existing_chunks"] == "false"
+    assert settings["retention"] == "10 years"
@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+
+from odm2_postgres_api.utils.ttl_cache import SingleFlightTTLCache, TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_entries_expire_after_ttl():
+    clock = FakeClock()
+    cache = TTLCache("test", ttl=10, clock=clock)
+    cache.set("unit", 1)
+    assert cache.get("unit") == 1
+    clock.now = 10
+    assert cache.get("unit") is None
+    assert cache.stats() == {"name": "test", "size": 0, "hits": 1, "misses": 1}
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLCache("test", maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_invalidate_by_key_predicate():
+    cache = TTLCache("test")
+    cache.set(("units", "Time", "s"), 1)
+    cache.set(("methods", "methodcode", "000"), 2)
+    assert cache.invalidate(lambda key: key[0] == "units") == 1
+    assert cache.get(("units", "Time", "s")) is None
+    assert cache.get(("methods", "methodcode", "000")) == 2
+
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_share_one_load():
+    cache = SingleFlightTTLCache("test")
+    loads = []
+
+    async def load():
+        loads.append(1)
+        await asyncio.sleep(0.01)
+        return "method"
+
+    assert await asyncio.gather(*[cache.get_or_load("method", load) for _ in range(5)]) == ["method"] * 5
+    assert await cache.get_or_load("method", load) == "method"
+    assert len(loads) == 1
+    assert cache.stats() == {"name": "test", "size": 1, "hits": 1, "misses": 5, "coalesced": 4}
+
+
+@pytest.mark.asyncio
+async def test_failed_loads_are_not_cached():
+    cache = SingleFlightTTLCache("test")
+
+    async def fail():
+        raise ValueError("not found")
+
+    async def load():
+        return 1
+
+    with pytest.raises(ValueError):
+        await cache.get_or_load("key", fail)
+    assert await cache.get_or_load("key", load) == 1